@@ -0,0 +1,144 @@
+"""
+Сверка и замер парсера страницы портала BIO
+Новый парсер (valute_bio.parse_bio_rates) сравнивается с прежним
+(BeautifulSoup + get_text() и регулярные выражения на каждый шаблон)
+на коротких фрагментах с крайними случаями и на синтетической странице
+fixtures/bio_portal.html (составлена вручную, не сохранена с портала).
+Фрагменты повторяют разметку, типичную для настоящих страниц: курс,
+разбитый тегами и переносами строк, кириллическая «Р» и знак ₽,
+&nbsp;, теги в верхнем регистре, текст в noscript/textarea/svg,
+дублирующиеся мобильный и десктопный виджеты.
+
+Страницу, сохраненную с портала, можно сверить параметром --page:
+с ней сравниваются оба парсера (нужен bs4), ожидаемые курсы не задаются
+
+Запуск из корня проекта:
+    python benchmarks/bench_bio_parser.py
+    python benchmarks/bench_bio_parser.py --page saved_portal.html
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import valute_bio
+
+try:
+    from bs4 import BeautifulSoup
+    BS4_AVAILABLE = True
+except ImportError:
+    BS4_AVAILABLE = False
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'bio_portal.html')
+
+# Фрагменты страницы и ожидаемые курсы
+CASES = [
+    ('<div>YE EUR 95,10 P</div><div>YE USD 80,20 P</div>', {'EUR': 95.1, 'USD': 80.2}),
+    # Без префикса YE и в нижнем регистре
+    ('<p>eur: 101,5 p; usd: 90,01 p</p>', {'EUR': 101.5, 'USD': 90.01}),
+    # YE-курс приоритетнее более раннего упоминания валюты
+    ('<p>EUR 1,11 P</p><p>YE EUR 2,22 P</p>', {'EUR': 2.22}),
+    # Курс перед валютой
+    ('<span>93,40 P</span> <span>USD</span>', {'USD': 93.4}),
+    # Скрипты, стили, комментарии и сущности
+    ('<script>var EUR = "7,77 P"</script><!-- USD 8,88 P --><b>EUR&nbsp;95,10&#160;P</b>', {'EUR': 95.1}),
+    ('<p>Курсы недоступны</p>', {}),
+    # Курс разбит тегами и переносами строк
+    ('<div class="rate">YE EUR<br>\n  <span class="val">95,10</span>\n  <span class="cur">P</span></div>',
+     {'EUR': 95.1}),
+    # Кириллическая «Р» и знак ₽ не совпадают с латинской P (как и раньше)
+    ('<div>YE EUR 95,10 Р</div><div>YE USD 80,20 ₽</div>', {}),
+    ('<DIV>YE&nbsp;EUR&nbsp;95,10&nbsp;P</DIV>', {'EUR': 95.1}),
+    # Атрибуты - не текст; noscript, textarea и svg - текст
+    ('<a title="EUR 1,23 P" href="/eur">Курс</a> <span>YE EUR 95,10 P</span>', {'EUR': 95.1}),
+    ('<div>YE EUR 95,10 P</div><noscript>YE USD 70,00 P</noscript><div>YE USD 80,20 P</div>',
+     {'EUR': 95.1, 'USD': 70.0}),
+    ('<textarea>EUR 5,55 P</textarea><p>EUR 95,10 P</p>', {'EUR': 5.55}),
+    ('<svg><text>USD 9,99 P</text></svg><p>USD 80,20 P</p>', {'USD': 9.99}),
+    ('<template><p>YE EUR 1,11 P</p></template><p>YE EUR 95,10 P</p>', {'EUR': 95.1}),
+    # Мобильный и десктопный виджеты: берется первый
+    ('<div class="mobile">YE EUR 95,10 P</div><div class="desktop">YE EUR 96,00 P</div>', {'EUR': 95.1}),
+    # Разделитель тысяч и точка вместо запятой не поддерживались и раньше
+    ('<p>EUR 1 095,10 P</p>', {'EUR': 95.1}),
+    ('<p>EUR 95.10 P</p>', {}),
+]
+
+
+def reference_bio_rates(html):
+    """Прежний парсер: полное дерево BeautifulSoup и get_text() на каждый шаблон"""
+    soup = BeautifulSoup(html, "html.parser")
+    bio_rates = {}
+    for currency in ('EUR', 'USD'):
+        patterns = [
+            rf'YE\s*{currency}.*?(\d+,\d+)\s*P',
+            rf'{currency}.*?(\d+,\d+)\s*P',
+            rf'(\d+,\d+)\s*P.*?{currency}'
+        ]
+        for pattern in patterns:
+            matches = re.findall(pattern, soup.get_text(), re.IGNORECASE | re.DOTALL)
+            if matches:
+                bio_rates[currency] = float(matches[0].replace(',', '.'))
+                break
+    return bio_rates
+
+
+def new_bio_rates(html):
+    return valute_bio.find_bio_rates(valute_bio.page_text(html))
+
+
+def chunks(text, size=8192):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+def measure(function, html, number):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return min(timeit.repeat(lambda: function(html), number=number, repeat=5)) / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Сверка и замер парсера страницы портала BIO')
+    parser.add_argument('--page', help='страница, сохраненная с портала BIO (сверка с прежним парсером)')
+    args = parser.parse_args()
+
+    with open(FIXTURE_PATH, encoding='utf-8') as f:
+        portal_html = f.read()
+
+    print("=== Сверка парсера страницы BIO ===")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for html, expected in CASES:
+            assert new_bio_rates(html) == expected, (html, new_bio_rates(html), expected)
+            if BS4_AVAILABLE:
+                assert reference_bio_rates(html) == expected, (html, reference_bio_rates(html))
+        portal_rates = new_bio_rates(portal_html)
+        assert portal_rates == {'EUR': 95.1, 'USD': 80.2}, portal_rates
+        assert new_bio_rates(chunks(portal_html)) == portal_rates
+        if BS4_AVAILABLE:
+            assert reference_bio_rates(portal_html) == portal_rates
+    print(f"Совпадение: {len(CASES)} фрагментов и синтетическая страница ({len(portal_html) // 1024} КБ)")
+
+    if args.page:
+        assert BS4_AVAILABLE, "Для сверки страницы портала нужен bs4 (pip install beautifulsoup4)"
+        with open(args.page, encoding='utf-8', errors='replace') as f:
+            saved_html = f.read()
+        with contextlib.redirect_stdout(io.StringIO()):
+            saved_rates = new_bio_rates(saved_html)
+            assert saved_rates == reference_bio_rates(saved_html), (saved_rates, reference_bio_rates(saved_html))
+            assert new_bio_rates(chunks(saved_html)) == saved_rates
+        print(f"Совпадение на странице {args.page}: {saved_rates}")
+
+    print("\n=== Время разбора синтетической страницы ===")
+    number = 20
+    new_time = measure(new_bio_rates, portal_html, number)
+    stream_time = measure(lambda html: new_bio_rates(chunks(html)), portal_html, number)
+    print(f"Новый парсер:             {new_time * 1000:8.2f} мс")
+    print(f"Новый парсер (по частям): {stream_time * 1000:8.2f} мс")
+    if BS4_AVAILABLE:
+        old_time = measure(reference_bio_rates, portal_html, number)
+        print(f"Прежний парсер (bs4):     {old_time * 1000:8.2f} мс  (ускорение x{old_time / new_time:.1f})")
+    else:
+        print("bs4 не установлен, прежний парсер не замерялся")
@@ -0,0 +1,378 @@
+"""
+Сверка и замеры расчета стоимости
+1. Эталонные значения на границах весовых категорий (30, 300, 1000 кг):
+   скалярный, векторный расчет и POST /api/calculate-price
+2. Замеры: доставка и формула цены (один вызов и пакет), полный путь
+   POST /api/calculate-price через тестовый клиент Flask, запись истории
+   и выгрузка отчетов на 10k / 100k / 1M строк
+
+Halyk и портал BIO заменяются локальными заглушками (stub_sources.py),
+база и хранилище курсов создаются во временном каталоге - замер
+работает без сети и не трогает рабочие данные.
+Результаты сохраняются в JSON для сравнения запусков.
+
+Запуск из корня проекта:
+    python benchmarks/bench_pricing.py
+    python benchmarks/bench_pricing.py --sizes 10000,100000
+    python benchmarks/bench_pricing.py --golden-only
+    python benchmarks/bench_pricing.py --compare benchmarks/results/<прежний>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_sources import HALYK_RUB_SELL, start_stub_sources
+
+# Окружение задается до импорта модулей проекта: пути и адреса читаются при импорте
+WORKDIR = tempfile.mkdtemp(prefix='bio-bench-')
+SOURCES = start_stub_sources()
+os.environ.update(SOURCES.environ())
+os.environ.update({
+    'CALCULATIONS_DB_PATH': os.path.join(WORKDIR, 'calculations.db'),
+    'RATES_STORE_PATH': os.path.join(WORKDIR, 'rates.json'),
+    'FORMULA_VERSION_PATH': os.path.join(WORKDIR, 'calculations.db.formula-version'),
+    'RATES_BACKGROUND_REFRESH': '0',
+    'RATES_HTTP_RETRIES': '0',
+})
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import reports
+    import server
+    import storage
+    from pricing import (NUMPY_AVAILABLE, calculate_delivery_cost, quote_item,
+                         calculate_delivery_cost_vectorized, quote_items_vectorized)
+    from tariff import get_tariff_plan
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_SIZES = (10000, 100000, 1000000)
+BATCH_SIZE = 10000
+
+# Стоимость доставки по параметрам по умолчанию (складские услуги 26 × 450 = 11700):
+#   до 30 кг включительно - delivery30 = 37700
+#   30-300 кг   - 37700 + (вес - 30) × 261 (215 + 27 + 19), на 300 кг - 108170
+#   300-1000 кг - 119870 + (вес - 300) × 181 (164 + 15 + 2), на 1000 кг - 246570
+#   свыше 1000 кг - 246570
+GOLDEN_DELIVERY = [
+    (0.5, 37700),
+    (29.999, 37700),
+    (30, 37700),
+    (30.001, 37700.261),
+    (299.999, 108169.739),
+    (300, 108170),
+    (300.001, 119870.181),
+    (999.999, 246569.819),
+    (1000, 246570),
+    (1000.001, 246570),
+    (5000, 246570),
+]
+
+# Объемный вес на границах: 1 кг, объем × volumetricFactor (200) = 30 / 300 / 1000 кг
+GOLDEN_VOLUMETRIC = [
+    ((1000, 1000, 150), 37700),
+    ((1000, 1000, 1500), 108170),
+    ((1000, 1000, 5000), 246570),
+]
+
+# Финальные цены (округленные, как в ответе API) для товара 300 кг:
+# (X / 1.22 × курс × 1.16 + 108170) × 1.16
+GOLDEN_RATES = {'RUB': 7.02, 'KZT': 1}
+GOLDEN_BIO_RATES = {'EUR': 783.71, 'USD': 668.67}
+GOLDEN_QUOTES = [
+    ('RUB', 1000, 133219.91),
+    ('EUR', 100, 211916.56),
+    ('KZT', 50000, 180624.74),
+]
+
+EPSILON = 1e-6
+
+
+def golden_item(currency='KZT', price=1000, weight=300, dimensions=(100, 100, 100)):
+    length, width, height = dimensions
+    return {'productName': 'Эталон', 'originalPrice': float(price), 'currency': currency,
+            'weight': float(weight), 'length': float(length), 'width': float(width), 'height': float(height)}
+
+
+def check_golden(client):
+    """Сверка с эталонными значениями, возвращает число проверок"""
+    plan = get_tariff_plan()
+    checks = 0
+
+    for weight, expected in GOLDEN_DELIVERY:
+        for cost in (plan.delivery_cost(weight, 0), calculate_delivery_cost(weight, 0, dict(plan.params))):
+            assert abs(cost - expected) < EPSILON, (weight, cost, expected)
+            checks += 1
+    if NUMPY_AVAILABLE:
+        _, costs = calculate_delivery_cost_vectorized([w for w, _ in GOLDEN_DELIVERY], [0] * len(GOLDEN_DELIVERY), plan)
+        for (weight, expected), cost in zip(GOLDEN_DELIVERY, costs):
+            assert abs(cost - expected) < EPSILON, (weight, float(cost), expected)
+            checks += 1
+
+    items = [golden_item(weight=1, dimensions=dimensions) for dimensions, _ in GOLDEN_VOLUMETRIC]
+    items += [golden_item(currency, price) for currency, price, _ in GOLDEN_QUOTES]
+    expected_delivery = [cost for _, cost in GOLDEN_VOLUMETRIC] + [108170] * len(GOLDEN_QUOTES)
+    expected_final = [None] * len(GOLDEN_VOLUMETRIC) + [final for _, _, final in GOLDEN_QUOTES]
+
+    quote_sets = [[quote_item(item, plan, GOLDEN_RATES, GOLDEN_BIO_RATES) for item in items]]
+    if NUMPY_AVAILABLE:
+        quote_sets.append(quote_items_vectorized(items, plan, GOLDEN_RATES, GOLDEN_BIO_RATES))
+    for quotes in quote_sets:
+        for item, quote, delivery, final in zip(items, quotes, expected_delivery, expected_final):
+            assert abs(quote['deliveryCost'] - delivery) < EPSILON, (item, quote['deliveryCost'], delivery)
+            if final is not None:
+                assert round(quote['finalPrice'], 2) == final, (item, quote['finalPrice'], final)
+            checks += 1
+
+    # Полный путь через API: тенге не зависят от курсов заглушек
+    for item, delivery, final in zip(items, expected_delivery, expected_final):
+        if item['currency'] != 'KZT':
+            continue
+        response = client.post('/api/calculate-price', json=item)
+        assert response.status_code == 200, response.get_json()
+        data = response.get_json()
+        assert data['deliveryCost'] == round(delivery, 2), (item, data)
+        if final is not None:
+            assert data['finalPrice'] == final, (item, data)
+        checks += 1
+
+    return checks
+
+
+def measure(function, number, repeat=5):
+    """Лучшее время одного вызова (сек)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def random_items(count, seed=1):
+    rng = random.Random(seed)
+    return [{
+        'productName': f'Товар {i % 500}',
+        'originalPrice': rng.uniform(1, 100000),
+        'currency': rng.choice(['EUR', 'USD', 'RUB', 'KZT']),
+        'weight': rng.uniform(0.01, 2000),
+        'length': rng.uniform(1, 3000),
+        'width': rng.uniform(1, 3000),
+        'height': rng.uniform(1, 3000)
+    } for i in range(count)]
+
+
+def bench_formula(results):
+    plan = get_tariff_plan()
+    params = dict(plan.params)
+    rng = random.Random(2)
+    weights = [rng.uniform(0.01, 2000) for _ in range(1000)]
+
+    def delivery_plan():
+        for weight in weights:
+            plan.delivery_cost(weight, 0.01)
+
+    def delivery_params():
+        for weight in weights:
+            calculate_delivery_cost(weight, 0.01, params)
+
+    def price():
+        for weight in weights:
+            plan.price(weight, 7.02, 37700)
+
+    results['delivery_cost_call'] = {'seconds': measure(delivery_plan, 20) / len(weights)}
+    results['delivery_cost_params_call'] = {'seconds': measure(delivery_params, 20) / len(weights)}
+    results['price_formula_call'] = {'seconds': measure(price, 20) / len(weights)}
+
+    items = random_items(BATCH_SIZE)
+    rates, bio_rates = GOLDEN_RATES, GOLDEN_BIO_RATES
+    results['quote_batch_scalar'] = {
+        'items': BATCH_SIZE,
+        'seconds': measure(lambda: [quote_item(item, plan, rates, bio_rates) for item in items], 1, 5)
+    }
+    if NUMPY_AVAILABLE:
+        volumes = [0.01] * BATCH_SIZE
+        batch_weights = [item['weight'] for item in items]
+        results['delivery_cost_batch_vectorized'] = {
+            'items': BATCH_SIZE,
+            'seconds': measure(lambda: calculate_delivery_cost_vectorized(batch_weights, volumes, plan), 5, 3)
+        }
+        results['quote_batch_vectorized'] = {
+            'items': BATCH_SIZE,
+            'seconds': measure(lambda: quote_items_vectorized(items, plan, rates, bio_rates), 1, 5)
+        }
+
+
+def bench_http(results, client):
+    payload = golden_item('RUB', 1000, 12.5, (400, 300, 200))
+    counter = iter(range(10 ** 9))
+
+    def miss():
+        # Новая цена - промах кэша расчетов, полный расчет и запись истории
+        client.post('/api/calculate-price', json=dict(payload, originalPrice=1000 + next(counter)))
+
+    def hit():
+        client.post('/api/calculate-price', json=payload)
+
+    results['http_calculate_price_miss'] = {'seconds': measure(miss, 200, 3)}
+    results['http_calculate_price_hit'] = {'seconds': measure(hit, 200, 3)}
+
+    batch = {'items': random_items(1000, seed=3)}
+    results['http_calculate_prices_1000'] = {
+        'items': 1000,
+        'seconds': measure(lambda: client.post('/api/calculate-prices', json=batch), 1, 3)
+    }
+
+
+def history_rows(count, plan, start=0):
+    params_id = storage.tariff_params_id(plan)
+    rng = random.Random(start)
+    for i in range(start, start + count):
+        price = rng.uniform(1, 100000)
+        yield (f'Товар {i % 500}', price * 2.5, None, price, 'RUB', 10.0, 100.0, 100.0, 100.0,
+               params_id, 0.001, 10.0, 37700.0, 7.02, price * 1.5, price * 1.5 + 37700.0)
+
+
+def bench_history(results, sizes, xlsx):
+    plan = get_tariff_plan()
+    today = datetime.now(timezone.utc).date().isoformat()
+    chunk = 10000
+
+    for size in sizes:
+        existing, _ = storage.fetch_report_stats(today, today)
+        missing = max(size - existing, 0)
+        start = time.perf_counter()
+        rows = []
+        for row in history_rows(missing, plan, existing):
+            rows.append(row)
+            if len(rows) == chunk:
+                storage.save_calculations(rows)
+                rows = []
+        storage.save_calculations(rows)
+        elapsed = time.perf_counter() - start
+        if missing:
+            results[f'history_insert_{size}'] = {
+                'rows': missing, 'seconds': elapsed, 'rows_per_second': missing / elapsed
+            }
+
+        total, max_name_length = storage.fetch_report_stats(today, today)
+        start = time.perf_counter()
+        written = sum(len(part) for part in reports.iter_csv_report(today, today))
+        results[f'report_csv_{size}'] = {
+            'rows': total, 'bytes': written, 'seconds': time.perf_counter() - start
+        }
+
+        if xlsx:
+            start = time.perf_counter()
+            output = reports.write_xlsx_report(today, today, max_name_length)
+            output.seek(0, os.SEEK_END)
+            results[f'report_xlsx_{size}'] = {
+                'rows': total, 'bytes': output.tell(), 'seconds': time.perf_counter() - start
+            }
+            output.close()
+
+        start = time.perf_counter()
+        storage.fetch_summary(today, today)
+        results[f'report_summary_{size}'] = {'rows': total, 'seconds': time.perf_counter() - start}
+
+
+def compare(results, previous_path):
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)['benchmarks']
+    print(f"\n=== Сравнение с {previous_path} (время нового / прежнего) ===")
+    for name, result in results.items():
+        if name in previous and previous[name].get('seconds'):
+            ratio = result['seconds'] / previous[name]['seconds']
+            marker = '  ⚠️' if ratio > 1.1 else ''
+            print(f"{name:36} x{ratio:6.2f}{marker}")
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:10.2f} мкс"
+    if seconds < 1:
+        return f"{seconds * 1e3:10.2f} мс"
+    return f"{seconds:10.2f} с"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка и замеры расчета стоимости')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='объемы истории для записи и отчетов (через запятую)')
+    parser.add_argument('--no-xlsx', action='store_true', help='не замерять выгрузку XLSX')
+    parser.add_argument('--golden-only', action='store_true', help='только сверка с эталонными значениями')
+    parser.add_argument('--output', help='файл результатов JSON (по умолчанию benchmarks/results/...)')
+    parser.add_argument('--compare', help='файл результатов прежнего запуска для сравнения')
+    args = parser.parse_args()
+
+    client = server.app.test_client()
+
+    print("=== Сверка с эталонными значениями ===")
+    with contextlib.redirect_stdout(io.StringIO()):
+        checks = check_golden(client)
+        rates = client.get('/api/exchange-rates').get_json()['rates']
+    assert SOURCES.requests_served > 0, "Курсы не загружались из заглушек"
+    assert rates['RUB'] == round(HALYK_RUB_SELL * 1.01, 2), rates
+    print(f"Совпадение: {checks} проверок на границах 30 / 300 / 1000 кг")
+    if args.golden_only:
+        return
+
+    results = {}
+    print("\n=== Замеры ===")
+    bench_formula(results)
+    bench_http(results, client)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    with contextlib.redirect_stdout(io.StringIO()):
+        bench_history(results, sorted(sizes), xlsx=server.OPENPYXL_AVAILABLE and not args.no_xlsx)
+
+    for name, result in results.items():
+        extra = ''
+        if 'rows_per_second' in result:
+            extra = f"  ({result['rows_per_second']:,.0f} строк/с)"
+        elif 'items' in result:
+            extra = f"  ({result['items']} товаров)"
+        elif 'rows' in result:
+            extra = f"  ({result['rows']} строк)"
+        print(f"{name:36} {format_seconds(result['seconds'])}{extra}")
+
+    output_path = args.output or os.path.join(
+        RESULTS_DIR, f"bench_pricing-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': NUMPY_AVAILABLE,
+            'openpyxl': server.OPENPYXL_AVAILABLE,
+            'golden_checks': checks,
+            'benchmarks': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output_path}")
+
+    # Пакетный расчет через numpy должен быть быстрее цикла quote_item()
+    if 'quote_batch_vectorized' in results:
+        scalar = results['quote_batch_scalar']['seconds']
+        vectorized = results['quote_batch_vectorized']['seconds']
+        assert vectorized < scalar, (
+            f"Векторный пакетный расчет медленнее скалярного: {vectorized * 1e3:.1f} мс > {scalar * 1e3:.1f} мс")
+        print(f"✅ Векторный пакетный расчет быстрее скалярного в {scalar / vectorized:.1f} раза")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        SOURCES.stop()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
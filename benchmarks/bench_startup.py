@@ -0,0 +1,82 @@
+"""
+Проверка времени запуска приложения (импорт render_start:app)
+Импорт замеряется в отдельном процессе с -X importtime: лучший результат
+из нескольких запусков сравнивается с бюджетом, а тяжелые модули, нужные
+только отдельным эндпоинтам, не должны загружаться при запуске воркера
+
+Запуск из корня проекта:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --budget-ms 400 --runs 10
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Бюджет импорта приложения (мс)
+DEFAULT_BUDGET_MS = 300
+# Загружаются при первом использовании, а не при запуске
+LAZY_MODULES = ('numpy', 'requests', 'openpyxl', 'pandas', 'bs4')
+
+
+def import_times(workdir):
+    """
+    Импортирует render_start в отдельном процессе
+    Возвращает {модуль: (собственное время, суммарное время)} в мкс
+    """
+    env = dict(os.environ)
+    env.update({
+        'CALCULATIONS_DB_PATH': os.path.join(workdir, 'calculations.db'),
+        'RATES_STORE_PATH': os.path.join(workdir, 'rates.json'),
+        'FORMULA_VERSION_PATH': os.path.join(workdir, 'calculations.db.formula-version'),
+        'RATES_BACKGROUND_REFRESH': '0',
+        'HISTORY_WRITE_BEHIND': '0',
+        'PYTHONPATH': PROJECT_DIR,
+    })
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import render_start'],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка времени запуска приложения')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help='бюджет импорта (мс)')
+    parser.add_argument('--runs', type=int, default=5, help='число запусков (берется лучший)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bio-startup-')
+    try:
+        runs = [import_times(workdir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    best = min(runs, key=lambda times: times['render_start'][1])
+    total_ms = best['render_start'][1] / 1000
+
+    print("=== Время импорта render_start:app ===")
+    print("Самые долгие модули (собственное время):")
+    for name, (self_us, _) in sorted(best.items(), key=lambda item: -item[1][0])[:10]:
+        print(f"  {name:40} {self_us / 1000:8.2f} мс")
+    print(f"Всего: {total_ms:.1f} мс (бюджет {args.budget_ms:.0f} мс, лучший из {args.runs})")
+
+    loaded = sorted(name for name in LAZY_MODULES if name in best)
+    assert not loaded, f"При запуске загружаются модули, которые должны импортироваться лениво: {loaded}"
+    assert total_ms <= args.budget_ms, f"Импорт приложения {total_ms:.1f} мс превышает бюджет {args.budget_ms:.0f} мс"
+    print("✅ В пределах бюджета, тяжелые модули не загружаются")
+
+
+if __name__ == "__main__":
+    main()
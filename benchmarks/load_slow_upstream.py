@@ -0,0 +1,210 @@
+"""
+Нагрузочный тест: пропускная способность расчетов при медленном источнике курсов
+Сервер запускается отдельным процессом (gunicorn с gunicorn.conf.py, без
+gunicorn - встроенный многопоточный сервер Flask), Halyk и BIO заменяются
+заглушками (stub_sources.py), курсы обновляются каждую секунду.
+Две фазы с одинаковой нагрузкой на POST /api/calculate-price:
+  1. источники отвечают сразу
+  2. источники отвечают с задержкой --slow-delay секунд
+Пропускная способность во второй фазе должна остаться не ниже --min-ratio
+от первой: обработчики расчетов не ждут загрузки курсов.
+
+Запуск из корня проекта:
+    python benchmarks/load_slow_upstream.py
+    python benchmarks/load_slow_upstream.py --clients 64 --duration 20 --slow-delay 8
+    python benchmarks/load_slow_upstream.py --worker-class gevent
+    python benchmarks/load_slow_upstream.py --preload
+    python benchmarks/load_slow_upstream.py --worker-class gevent --preload
+
+--preload включает GUNICORN_PRELOAD=1; с gevent он не применяется, и
+воркеры должны сами запустить фоновые потоки. Перед замером по /healthz
+проверяется, что обновление курсов и запись истории работают.
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_sources import start_stub_sources
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ITEM = {'productName': 'Нагрузка', 'originalPrice': 1000, 'currency': 'EUR',
+        'weight': 12.5, 'length': 400, 'width': 300, 'height': 200}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, env, use_gunicorn):
+    if use_gunicorn:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                   '--bind', f'127.0.0.1:{port}', 'render_start:app']
+    else:
+        command = [sys.executable, '-c',
+                   f'import render_start; render_start.app.run(host="127.0.0.1", port={port}, threaded=True)']
+    return subprocess.Popen(command, cwd=PROJECT_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/healthz')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Сервер не запустился за {timeout} сек")
+
+
+def check_background_tasks(port, attempts=5):
+    """Фоновое обновление курсов и запись истории запущены в воркерах (по /healthz)"""
+    for _ in range(attempts):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        connection.request('GET', '/healthz')
+        health = json.loads(connection.getresponse().read())
+        connection.close()
+        assert health['rateRefresher'], "В воркере не запущено фоновое обновление курсов"
+        assert health['historyWriter'], "В воркере не запущена отложенная запись истории"
+
+
+def run_phase(port, clients, duration):
+    """Нагрузка clients потоками в течение duration секунд: (запросов/с, p50, p99, ошибки)"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        local_errors = 0
+        sequence = 0
+        while time.monotonic() < deadline:
+            # Разные цены - промах кэша расчетов, полный расчет и запись истории
+            body = json.dumps(dict(ITEM, originalPrice=1000 + index * 1000000 + sequence))
+            sequence += 1
+            start = time.perf_counter()
+            try:
+                connection.request('POST', '/api/calculate-price', body=body,
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    local_errors += 1
+            except OSError:
+                local_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    if not latencies:
+        return 0.0, None, None, errors[0]
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return len(latencies) / elapsed, p50, p99, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест с медленным источником курсов')
+    parser.add_argument('--clients', type=int, default=32, help='одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=10, help='длительность фазы (сек)')
+    parser.add_argument('--slow-delay', type=float, default=5, help='задержка источников во второй фазе (сек)')
+    parser.add_argument('--min-ratio', type=float, default=0.8,
+                        help='минимальная доля пропускной способности при медленном источнике')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'flask'), default='auto')
+    parser.add_argument('--worker-class', choices=('gthread', 'gevent'),
+                        help='класс воркеров gunicorn (по умолчанию GUNICORN_WORKER_CLASS или gthread)')
+    parser.add_argument('--preload', action='store_true', help='запуск gunicorn с GUNICORN_PRELOAD=1')
+    args = parser.parse_args()
+
+    use_gunicorn = args.server == 'gunicorn' or (
+        args.server == 'auto' and importlib.util.find_spec('gunicorn') is not None)
+
+    workdir = tempfile.mkdtemp(prefix='bio-load-')
+    sources = start_stub_sources()
+    port = free_port()
+    env = dict(os.environ)
+    env.update(sources.environ())
+    env.update({
+        'CALCULATIONS_DB_PATH': os.path.join(workdir, 'calculations.db'),
+        'RATES_STORE_PATH': os.path.join(workdir, 'rates.json'),
+        'FORMULA_VERSION_PATH': os.path.join(workdir, 'calculations.db.formula-version'),
+        'RATES_REFRESH_INTERVAL': '1',
+        'RATES_CACHE_TTL': '1',
+        'RATES_HTTP_RETRIES': '0',
+        'PYTHONPATH': PROJECT_DIR,
+    })
+    if args.worker_class:
+        env['GUNICORN_WORKER_CLASS'] = args.worker_class
+    if args.preload:
+        env['GUNICORN_PRELOAD'] = '1'
+
+    server = start_server(port, env, use_gunicorn)
+    try:
+        wait_ready(port)
+        check_background_tasks(port)
+        # Первая загрузка курсов до начала замера
+        time.sleep(2)
+        print(f"=== Нагрузка: {args.clients} клиентов × {args.duration:.0f} сек, "
+              f"сервер: {'gunicorn (' + env.get('GUNICORN_WORKER_CLASS', 'gthread') + (', preload' if env.get('GUNICORN_PRELOAD') == '1' else '') + ')' if use_gunicorn else 'Flask (threaded)'} ===")
+
+        results = {}
+        for phase, delay in (('fast', 0.0), ('slow', args.slow_delay)):
+            sources.set_delay(delay)
+            served_before = sources.requests_served
+            throughput, p50, p99, errors = run_phase(port, args.clients, args.duration)
+            upstream = sources.requests_served - served_before
+            results[phase] = throughput
+            p50_text = f"{p50 * 1000:7.1f} мс" if p50 is not None else '      -'
+            p99_text = f"{p99 * 1000:7.1f} мс" if p99 is not None else '      -'
+            print(f"Источники {'сразу' if phase == 'fast' else f'через {delay:.0f} сек':>14}: "
+                  f"{throughput:8.1f} запросов/с, p50 {p50_text}, p99 {p99_text}, "
+                  f"ошибок {errors}, запросов к источникам {upstream}")
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        sources.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ratio = results['slow'] / results['fast'] if results['fast'] else 0.0
+    print(f"Пропускная способность при медленном источнике: {ratio:.0%} от обычной")
+    assert ratio >= args.min_ratio, f"Пропускная способность упала ниже {args.min_ratio:.0%}"
+    print("✅ Медленный источник не снижает пропускную способность расчетов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Локальные заглушки источников курсов для замеров без сети
+Halyk отдает JSON в формате API currency-history, портал BIO -
+синтетическую страницу из fixtures/bio_portal.html. delay задает
+задержку ответа (медленный источник)
+
+Использование (до импорта server, адреса читаются из окружения):
+    sources = start_stub_sources()
+    os.environ.update(sources.environ())
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'bio_portal.html')
+
+# Курс продажи RUB/KZT для бизнеса, который отдает заглушка Halyk
+HALYK_RUB_SELL = 6.5
+
+
+def halyk_payload(rub_sell=HALYK_RUB_SELL):
+    return json.dumps({
+        'result': True,
+        'data': {
+            'currencyHistory': {
+                '1': {'legalPersons': {'RUB/KZT': {'buy': rub_sell - 0.2, 'sell': rub_sell}}}
+            }
+        }
+    }).encode('utf-8')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Заполняются в start_stub_sources()
+    routes = {}
+    delay = 0.0
+    requests_served = 0
+
+    def do_GET(self):
+        body, content_type = self.routes.get(self.path.split('?')[0], (None, None))
+        if self.delay:
+            time.sleep(self.delay)
+        type(self).requests_served += 1
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSources:
+    """Запущенный сервер заглушек"""
+
+    def __init__(self, server, handler):
+        self.server = server
+        self.handler = handler
+        host, port = server.server_address[:2]
+        self.halyk_url = f'http://{host}:{port}/halyk'
+        self.bio_url = f'http://{host}:{port}/bio'
+
+    @property
+    def requests_served(self):
+        return self.handler.requests_served
+
+    def set_delay(self, delay):
+        """Задержка ответа заглушек (сек), действует на следующие запросы"""
+        self.handler.delay = delay
+
+    def environ(self):
+        """Переменные окружения, направляющие загрузку курсов в заглушки"""
+        return {'HALYK_RATES_URL': self.halyk_url, 'BIO_PORTAL_URL': self.bio_url}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_stub_sources(delay=0.0, host='127.0.0.1', port=0):
+    """Запускает заглушки Halyk и BIO в фоновом потоке, port=0 - свободный порт"""
+    with open(FIXTURE_PATH, 'rb') as f:
+        bio_page = f.read()
+
+    handler = type('StubHandler', (_StubHandler,), {
+        'routes': {
+            '/halyk': (halyk_payload(), 'application/json'),
+            '/bio': (bio_page, 'text/html; charset=utf-8'),
+        },
+        'delay': delay,
+        'requests_served': 0,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-sources', daemon=True).start()
+    return StubSources(server, handler)
@@ -1 +0,0 @@
-bio_rates = {'EUR': 109.0, 'USD': 93.0}
@@ -1 +0,0 @@
-bio_rates_tenge = {'EUR': 783.71, 'USD': 668.67}
@@ -0,0 +1,46 @@
+"""
+Настройки gunicorn (Procfile и render.yaml передают файл через -c)
+
+Воркеры по умолчанию - gthread: каждый процесс обслуживает GUNICORN_THREADS
+запросов одновременно, поэтому запрос, ожидающий медленный источник курсов
+или запись в базу, не занимает весь воркер. Число процессов - WEB_CONCURRENCY
+(переменная Render, gunicorn читает ее сам).
+GUNICORN_WORKER_CLASS=gevent - кооперативные воркеры (нужен пакет gevent);
+gevent подменяет сетевые функции при запуске воркера, поэтому с ним
+режим preload не используется: GUNICORN_PRELOAD сбрасывается в 0, и каждый
+воркер при импорте приложения сам запускает фоновые потоки.
+
+GUNICORN_PRELOAD=1 - приложение импортируется один раз в мастер-процессе:
+модули, схема базы, снимок курсов и параметры формулы готовятся до fork
+и наследуются воркерами копированием при записи, поэтому новый воркер
+стартует без импорта и инициализации. Фоновые потоки (обновление курсов,
+запись истории) fork не переживают - каждый воркер запускает их в post_fork.
+Без GUNICORN_PRELOAD каждый воркер импортирует приложение сам.
+
+При запуске мастера удаляются файлы метрик прежнего запуска (metrics.py).
+"""
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Для gevent - число одновременных соединений на воркер
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+preload_requested = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+preload_app = preload_requested and worker_class != 'gevent'
+# server.py решает по этой переменной, запускать ли фоновые потоки при импорте:
+# без preload их должен запустить сам воркер (окружение наследуется при fork)
+os.environ['GUNICORN_PRELOAD'] = '1' if preload_app else '0'
+
+
+def on_starting(arbiter):
+    import metrics
+    metrics.reset_directory()
+    if preload_requested and not preload_app:
+        print("⚠️ GUNICORN_PRELOAD не используется с воркерами gevent")
+
+
+def post_fork(arbiter, worker):
+    if preload_app:
+        import server
+        server.start_background_tasks()
@@ -0,0 +1,167 @@
+"""
+Отложенная запись истории расчетов
+Расчеты ставятся в ограниченную очередь, фоновый поток сохраняет их
+пачками (каждые HISTORY_FLUSH_ROWS строк или HISTORY_FLUSH_MS миллисекунд),
+поэтому ответ на расчет не ждет записи на диск
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+
+# Максимум строк в очереди (ограничение памяти)
+HISTORY_QUEUE_SIZE = int(os.environ.get('HISTORY_QUEUE_SIZE', 10000))
+# Сохранять пачку, как только набралось столько строк
+HISTORY_FLUSH_ROWS = int(os.environ.get('HISTORY_FLUSH_ROWS', 500))
+# ...или прошло столько миллисекунд с первой строки пачки
+HISTORY_FLUSH_MS = int(os.environ.get('HISTORY_FLUSH_MS', 200))
+# Сколько секунд ждать места в заполненной очереди, прежде чем записать самим
+HISTORY_ENQUEUE_TIMEOUT = float(os.environ.get('HISTORY_ENQUEUE_TIMEOUT', 1))
+
+
+class HistoryWriter:
+    """
+    Фоновая запись строк истории пачками
+    write_batch - функция, сохраняющая список строк одной транзакцией
+
+    Если очередь заполнена, submit() ждет HISTORY_ENQUEUE_TIMEOUT секунд,
+    а затем записывает строки сам (обратное давление на обработчик запроса).
+    При завершении процесса очередь дописывается в базу.
+    Если пачка не записывается и после повторов, строки пишутся по одной:
+    теряются только строки, которые не записать (счетчик dropped).
+    """
+
+    def __init__(self, write_batch, max_queue=HISTORY_QUEUE_SIZE, flush_rows=HISTORY_FLUSH_ROWS,
+                 flush_interval=HISTORY_FLUSH_MS / 1000, enqueue_timeout=HISTORY_ENQUEUE_TIMEOUT):
+        self._write_batch = write_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        # Строки, которые не удалось записать
+        self.dropped = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, rows):
+        """Ставит строки в очередь на запись (без фонового потока - пишет сразу)"""
+        rows = list(rows)
+        if not self.running:
+            self._write(rows)
+            return
+
+        for index, row in enumerate(rows):
+            try:
+                self._queue.put(row, timeout=self.enqueue_timeout)
+            except queue.Full:
+                print("⚠️ Очередь записи истории заполнена, сохраняем синхронно")
+                self._write(rows[index:])
+                return
+
+    def flush(self):
+        """Ждет, пока все поставленные в очередь строки будут записаны"""
+        if self.running:
+            self._queue.join()
+
+    def stop(self, timeout=10):
+        """Останавливает поток и дописывает оставшиеся строки"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        # Все, что осталось после остановки потока, пишем сами
+        rows = self._drain(self._queue.qsize())
+        if rows:
+            self._write_queued(rows)
+        print("💾 Очередь записи истории сохранена")
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            rows = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._write_queued(rows)
+
+        # Дописываем очередь перед выходом
+        while True:
+            rows = self._drain(self.flush_rows)
+            if not rows:
+                break
+            self._write_queued(rows)
+
+    def _drain(self, limit):
+        rows = []
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write(self, rows, attempts=3):
+        for attempt in range(attempts):
+            try:
+                self._write_batch(rows)
+                return
+            except Exception as e:
+                print(f"❌ Ошибка записи истории ({len(rows)} строк, попытка {attempt + 1}): {e}")
+                time.sleep(0.1 * (attempt + 1))
+
+        # Пачка пишется одной транзакцией: одна неверная строка отменяет
+        # всю пачку, поэтому пишем по одной, чтобы потерять только ее
+        if len(rows) > 1:
+            print(f"⚠️ Записываем {len(rows)} строк истории по одной")
+            for row in rows:
+                try:
+                    self._write_batch([row])
+                except Exception as e:
+                    print(f"❌ Строка истории не сохранена: {e}")
+                    self._drop(1)
+        else:
+            self._drop(len(rows))
+
+    def _drop(self, count):
+        self.dropped += count
+        metrics.inc('bio_history_rows_dropped_total', count)
+
+    def _write_queued(self, rows):
+        """Записывает строки, взятые из очереди, и отмечает их обработанными"""
+        try:
+            self._write(rows)
+        finally:
+            for _ in rows:
+                self._queue.task_done()
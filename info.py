@@ -1 +0,0 @@
-exchange_rates = {'RUB': 7.02, 'USD': 668.67, 'EUR': 783.71}
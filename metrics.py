@@ -0,0 +1,265 @@
+"""
+Метрики приложения в формате Prometheus (эндпоинт /metrics)
+Каждый процесс считает счетчики и гистограммы времени в памяти и
+периодически сбрасывает их в свой файл metrics-<pid>.json в METRICS_DIR.
+/metrics суммирует файлы всех воркеров gunicorn, поэтому ответ
+не зависит от того, какой воркер принял запрос. Файлы завершившихся
+воркеров остаются (счетчики не уменьшаются) до перезапуска мастера
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import storage
+
+
+METRICS_DIR = os.environ.get('METRICS_DIR', storage.DB_PATH + '.metrics')
+# Как часто (сек) процесс сбрасывает свои метрики в файл
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Границы корзин гистограмм времени (сек)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Описания метрик: имя → (тип, описание)
+METRICS = {
+    'bio_http_request_duration_seconds': ('histogram', 'Время обработки запроса по эндпоинтам'),
+    'bio_stage_duration_seconds': ('histogram', 'Время этапа обработки'),
+    'bio_stage_errors_total': ('counter', 'Ошибки этапа обработки'),
+    'bio_outbound_request_duration_seconds': ('histogram', 'Время запроса к источнику курсов'),
+    'bio_outbound_requests_total': ('counter', 'Запросы к источникам курсов по результату'),
+    'bio_quote_cache_total': ('counter', 'Обращения к кэшу расчетов (hit/miss)'),
+    'bio_history_rows_total': ('counter', 'Строки истории, записанные в базу'),
+    'bio_history_rows_dropped_total': ('counter', 'Строки истории, которые не удалось записать'),
+    'bio_rate_snapshot_age_seconds': ('gauge', 'Возраст действующего снимка курсов'),
+    'bio_rate_snapshot_version': ('gauge', 'Версия действующего снимка курсов'),
+    'bio_metrics_processes': ('gauge', 'Процессы, метрики которых вошли в ответ'),
+}
+
+
+class Registry:
+    """
+    Метрики процесса
+    Ключ серии - (имя, метки), метки - отсортированный кортеж пар.
+    После fork дочерний процесс начинает с пустых метрик
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._counters = {}
+        # ключ → [счетчики по корзинам + корзина +Inf, сумма, количество]
+        self._histograms = {}
+        self._last_flush = 0.0
+
+    def _ensure_process(self):
+        # Вызывается под self._lock
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._counters = {}
+            self._histograms = {}
+            self._last_flush = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._ensure_process()
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._ensure_process()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(DURATION_BUCKETS) + 1), 0.0, 0]
+            index = 0
+            while index < len(DURATION_BUCKETS) and seconds > DURATION_BUCKETS[index]:
+                index += 1
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        self._maybe_flush()
+
+    @contextmanager
+    def stage(self, stage, **labels):
+        """
+        with stage('db_write'): ... - время этапа в bio_stage_duration_seconds,
+        исключение дополнительно считается в bio_stage_errors_total
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('bio_stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('bio_stage_duration_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Записывает метрики процесса в его файл (атомарно)"""
+        with self._lock:
+            self._ensure_process()
+            self._last_flush = time.monotonic()
+            data = {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, dict(labels), [list(buckets), total, count]]
+                               for (name, labels), (buckets, total, count) in self._histograms.items()]
+            }
+            pid = self._pid
+        if not data['counters'] and not data['histograms']:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.metrics-', suffix='.tmp', dir=self.directory)
+        except OSError as e:
+            print(f"❌ Ошибка записи метрик в {self.directory}: {e}")
+            return
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.directory, f'metrics-{pid}.json'))
+        except OSError as e:
+            print(f"❌ Ошибка записи метрик в {self.directory}: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def collect(self):
+        """
+        Метрики всех процессов: (счетчики, гистограммы, число процессов)
+        Свой процесс сначала сбрасывается в файл
+        """
+        self.flush()
+        counters = {}
+        histograms = {}
+        processes = 0
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            names = []
+
+        for file_name in names:
+            if not (file_name.startswith('metrics-') and file_name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, file_name), encoding='utf-8') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            processes += 1
+            for name, labels, value in data['counters']:
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, (buckets, total, count) in data['histograms']:
+                key = (name, tuple(sorted(labels.items())))
+                merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms, processes
+
+    def render(self, gauges=None):
+        """
+        Текст для /metrics в формате Prometheus
+        gauges - {имя: значение} текущих значений, вычисленных при запросе
+        """
+        counters, histograms, processes = self.collect()
+        gauges = dict(gauges or {}, bio_metrics_processes=processes)
+
+        series = {}
+        for (name, labels), value in counters.items():
+            series.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (buckets, total, count) in histograms.items():
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket_count in zip(DURATION_BUCKETS + ('+Inf',), buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, value in gauges.items():
+            if value is not None:
+                series[name] = [f"{name} {_format_value(value)}"]
+
+        output = []
+        for name in sorted(series):
+            metric_type, help_text = METRICS.get(name, ('untyped', name))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(sorted(series[name]) if metric_type != 'histogram' else series[name])
+        return '\n'.join(output) + '\n'
+
+    def reset_directory(self):
+        """Удаляет файлы метрик всех процессов (при запуске мастера gunicorn)"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for file_name in names:
+            if file_name.startswith('metrics-') or file_name.startswith('.metrics-'):
+                try:
+                    os.unlink(os.path.join(self.directory, file_name))
+                except OSError:
+                    pass
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+_registry = Registry()
+atexit.register(_registry.flush)
+
+
+def inc(name, value=1, **labels):
+    """Увеличивает счетчик"""
+    _registry.inc(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    """Добавляет наблюдение времени в гистограмму"""
+    _registry.observe(name, seconds, **labels)
+
+
+def stage(stage, **labels):
+    """Контекстный менеджер замера этапа обработки"""
+    return _registry.stage(stage, **labels)
+
+
+def timed_iter(iterable, stage, **labels):
+    """Генератор-обертка: время этапа - от начала до конца перебора (потоковые ответы)"""
+    with _registry.stage(stage, **labels):
+        yield from iterable
+
+
+def render(gauges=None):
+    return _registry.render(gauges)
+
+
+def reset_directory():
+    _registry.reset_directory()
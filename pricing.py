@@ -0,0 +1,280 @@
+"""
+Расчет стоимости товара: доставка БИО и конвертация цены
+Общий код для одиночного и пакетного расчета
+"""
+import importlib.util
+import math
+
+# Векторизованный расчет для пакетов (если numpy установлен)
+# numpy импортируется при первом пакетном расчете, а не при запуске воркера
+NUMPY_AVAILABLE = importlib.util.find_spec('numpy') is not None
+
+from tariff import TariffPlan, get_tariff_plan
+
+def calculate_delivery_cost(weight_kg, volume_m3, params):
+    """
+    Рассчитывает стоимость доставки с настраиваемыми параметрами
+    params - словарь параметров формулы или готовый TariffPlan
+    """
+    plan = params if isinstance(params, TariffPlan) else get_tariff_plan(params)
+    return plan.delivery_cost(weight_kg, volume_m3)
+
+def calculate_volume_from_dimensions(length, width, height):
+    """
+    Рассчитывает объем из габаритов
+    length, width, height - размеры в мм
+    возвращает объем в м³
+    """
+    if length <= 0 or width <= 0 or height <= 0:
+        return 0
+    
+    try:
+        # Преобразуем мм в метры и рассчитываем объем
+        length_m = length / 1000
+        width_m = width / 1000
+        height_m = height / 1000
+        volume = length_m * width_m * height_m
+        return volume
+    except (ValueError, IndexError):
+        return 0
+
+def resolve_used_rate(currency, current_rates, bio_rates):
+    """
+    Курс и источник курса для валюты
+    Двухэтапная конвертация для BIO товаров (EUR/USD → RUB → KZT):
+    BIO курсы уже конвертированы в тенге
+    """
+    exchange_rate = current_rates.get(currency, 1)
+    if currency in ['EUR', 'USD']:
+        return bio_rates.get(currency, exchange_rate), "BIO (двухэтапная конвертация)"
+    return exchange_rate, "МИГ.кз (прямая конвертация)"
+
+def parse_item(data):
+    """
+    Проверяет и нормализует данные товара из запроса
+    Габариты принимаются как {'dimensions': {...}} или плоскими полями
+    length/width/height (строки CSV/XLSX). При ошибке - ValueError
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Товар должен быть JSON-объектом')
+    dimensions_data = data.get('dimensions') or data
+    if not isinstance(dimensions_data, dict):
+        raise ValueError('Габариты (dimensions) должны быть JSON-объектом')
+    item = {
+        'productName': data.get('productName', 'Неизвестный товар'),
+        'originalPrice': float(data.get('originalPrice', 0) or 0),
+        'currency': data.get('currency', 'KZT'),
+        'weight': float(data.get('weight', 0) or 0),
+        'length': float(dimensions_data.get('length', 0) or 0),
+        'width': float(dimensions_data.get('width', 0) or 0),
+        'height': float(dimensions_data.get('height', 0) or 0)
+    }
+    
+    # nan и inf проходят сравнение "> 0" (inf) или не участвуют в нем (nan)
+    numbers = (item['originalPrice'], item['weight'], item['length'], item['width'], item['height'])
+    if (not item['productName'] or not item['currency'] or
+            not all(math.isfinite(value) and value > 0 for value in numbers)):
+        raise ValueError('Неверные данные. Проверьте все поля товара.')
+    
+    return item
+
+def quote_item(item, plan, current_rates, bio_rates):
+    """
+    Рассчитывает стоимость товара по формуле:
+    (X/divider * курс * multiplier + доставка) * nds
+    item - результат parse_item(), plan - TariffPlan
+    Возвращает словарь с исходными данными и промежуточными значениями
+    """
+    original_price = item['originalPrice']
+    currency = item['currency']
+    
+    # Расчет объема
+    volume = calculate_volume_from_dimensions(item['length'], item['width'], item['height'])
+    if volume == 0:
+        raise ValueError('Неверные данные габаритов. Проверьте длину, ширину и высоту.')
+    
+    # Расчет веса и стоимости доставки
+    delivery_weight = plan.delivery_weight(item['weight'], volume)
+    delivery_cost = plan.cost_for_weight(delivery_weight)
+    
+    # Получение курса валюты (для EUR/USD - двухэтапная конвертация по курсам BIO)
+    used_rate, rate_source = resolve_used_rate(currency, current_rates, bio_rates)
+    
+    converted_price, price_with_delivery, final_price = plan.price(original_price, used_rate, delivery_cost)
+    
+    return {
+        'productName': item['productName'],
+        'originalPrice': original_price,
+        'currency': currency,
+        'weight': item['weight'],
+        'length': item['length'],
+        'width': item['width'],
+        'height': item['height'],
+        'exchangeRate': used_rate,
+        'rateSource': rate_source,
+        'divider': plan.divider,
+        'multiplier': plan.multiplier,
+        'nds': plan.nds,
+        'convertedPrice': converted_price,
+        'volume': volume,
+        'deliveryWeight': delivery_weight,
+        'deliveryCost': delivery_cost,
+        'priceWithDelivery': price_with_delivery,
+        'finalPrice': final_price
+    }
+
+def format_quote(quote):
+    """
+    Округляет результат quote_item() для ответа API
+    """
+    return {
+        'productName': quote['productName'],
+        'originalPrice': quote['originalPrice'],
+        'currency': quote['currency'],
+        'exchangeRate': quote['exchangeRate'],
+        'rateSource': quote['rateSource'],
+        'convertedPrice': round(quote['convertedPrice'], 2),
+        'volume': round(quote['volume'], 4),
+        'deliveryWeight': round(quote['deliveryWeight'], 2),
+        'deliveryCost': round(quote['deliveryCost'], 2),
+        'priceWithDelivery': round(quote['priceWithDelivery'], 2),
+        'finalPrice': round(quote['finalPrice'], 2)
+    }
+
+def calculate_volumes_vectorized(lengths, widths, heights):
+    """
+    Векторный аналог calculate_volume_from_dimensions (мм → м³)
+    """
+    import numpy as np
+    
+    lengths = np.asarray(lengths, dtype=np.float64)
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    volumes = (lengths / 1000) * (widths / 1000) * (heights / 1000)
+    valid = (lengths > 0) & (widths > 0) & (heights > 0)
+    return np.where(valid, volumes, 0.0)
+
+def calculate_delivery_cost_vectorized(weights, volumes, plan):
+    """
+    Векторный аналог TariffPlan.delivery_cost
+    Категория ищется через searchsorted по границам плана, операции
+    выполняются в том же порядке, что и в скалярной версии, поэтому
+    результаты совпадают побитово
+    Возвращает (веса для доставки, стоимости доставки)
+    """
+    import numpy as np
+    
+    weights = np.asarray(weights, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    
+    delivery_weights = np.maximum(weights, volumes * plan.volumetric_factor)
+    tiers = np.searchsorted(np.asarray(plan.breakpoints, dtype=np.float64), delivery_weights, side='left')
+    
+    intercepts = np.asarray(plan.intercepts, dtype=np.float64)[tiers]
+    origins = np.asarray(plan.origins, dtype=np.float64)[tiers]
+    slopes = np.asarray(plan.slopes, dtype=np.float64)[tiers]
+    costs = intercepts + (delivery_weights - origins) * slopes
+    return delivery_weights, costs
+
+def calculate_prices_vectorized(prices, used_rates, delivery_costs, plan):
+    """
+    Векторный расчет формулы (X/divider * курс * multiplier + доставка) * nds
+    Возвращает (цены после конвертации, цены с доставкой, финальные цены)
+    """
+    import numpy as np
+    
+    prices = np.asarray(prices, dtype=np.float64)
+    used_rates = np.asarray(used_rates, dtype=np.float64)
+    
+    converted_prices = prices / plan.divider * used_rates * plan.multiplier
+    prices_with_delivery = converted_prices + delivery_costs
+    final_prices = prices_with_delivery * plan.nds
+    return converted_prices, prices_with_delivery, final_prices
+
+def quote_items_vectorized(items, plan, current_rates, bio_rates):
+    """
+    Векторный аналог quote_item() для списка товаров после parse_item()
+    Для товаров с нулевым объемом вместо результата возвращается ValueError
+    """
+    volumes = calculate_volumes_vectorized(
+        [item['length'] for item in items],
+        [item['width'] for item in items],
+        [item['height'] for item in items]
+    )
+    delivery_weights, delivery_costs = calculate_delivery_cost_vectorized(
+        [item['weight'] for item in items], volumes, plan
+    )
+    # Курс и источник зависят только от валюты: считаются один раз на валюту
+    rate_by_currency = {}
+    for item in items:
+        if item['currency'] not in rate_by_currency:
+            rate_by_currency[item['currency']] = resolve_used_rate(item['currency'], current_rates, bio_rates)
+    converted_prices, prices_with_delivery, final_prices = calculate_prices_vectorized(
+        [item['originalPrice'] for item in items],
+        [rate_by_currency[item['currency']][0] for item in items],
+        delivery_costs,
+        plan
+    )
+    
+    # Массивы переводятся в списки float один раз: обращение к элементу
+    # массива numpy по индексу создает скаляр numpy и медленнее цикла без numpy
+    columns = zip(
+        items, volumes.tolist(), delivery_weights.tolist(), delivery_costs.tolist(),
+        converted_prices.tolist(), prices_with_delivery.tolist(), final_prices.tolist()
+    )
+    
+    divider, multiplier, nds = plan.divider, plan.multiplier, plan.nds
+    quotes = []
+    for item, volume, delivery_weight, delivery_cost, converted_price, price_with_delivery, final_price in columns:
+        if volume == 0:
+            quotes.append(ValueError('Неверные данные габаритов. Проверьте длину, ширину и высоту.'))
+            continue
+        # Товар после parse_item() - первые поля результата quote_item(), копия
+        # словаря быстрее, чем перечислять их заново
+        quote = item.copy()
+        quote['exchangeRate'], quote['rateSource'] = rate_by_currency[item['currency']]
+        quote['divider'] = divider
+        quote['multiplier'] = multiplier
+        quote['nds'] = nds
+        quote['convertedPrice'] = converted_price
+        quote['volume'] = volume
+        quote['deliveryWeight'] = delivery_weight
+        quote['deliveryCost'] = delivery_cost
+        quote['priceWithDelivery'] = price_with_delivery
+        quote['finalPrice'] = final_price
+        quotes.append(quote)
+    return quotes
+
+if __name__ == "__main__":
+    import random
+    
+    print("=== Сверка векторного и скалярного расчета ===")
+    
+    params = {'divider': 1.22, 'multiplier': 1.16, 'nds': 1.16, 'base30': 9000, 'rate30': 215.5,
+              'pickup30': 12000, 'pickupRate30': 27, 'warehouseCount': 26, 'warehouseRate': 450,
+              'deliveryCity30': 5000, 'cityRate30': 19, 'rate300': 164, 'rate1000': 143,
+              'volumetricFactor': 200}
+    current_rates = {'RUB': 6.57, 'KZT': 1}
+    bio_rates = {'EUR': 624.81, 'USD': 526.91}
+    
+    # Границы весовых категорий и случайные товары
+    weights = [0.1, 29.999, 30, 30.001, 299.999, 300, 300.001, 999.999, 1000, 1000.001, 5000]
+    weights += [random.uniform(0.01, 2000) for _ in range(10000)]
+    items = [{
+        'productName': f'Товар {i}',
+        'originalPrice': random.uniform(1, 100000),
+        'currency': random.choice(['EUR', 'USD', 'RUB', 'KZT']),
+        'weight': weight,
+        'length': random.uniform(1, 3000),
+        'width': random.uniform(1, 3000),
+        'height': random.uniform(1, 3000)
+    } for i, weight in enumerate(weights)]
+    
+    for plan in (get_tariff_plan(params), get_tariff_plan()):
+        vectorized = quote_items_vectorized(items, plan, current_rates, bio_rates)
+        for item, quote in zip(items, vectorized):
+            expected = quote_item(item, plan, current_rates, bio_rates)
+            for key, value in expected.items():
+                assert quote[key] == value, (item, key, quote[key], value)
+    
+    print(f"Совпадение побитовое: {len(items)} товаров × 2 набора параметров")
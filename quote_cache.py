@@ -0,0 +1,83 @@
+"""
+Кэш результатов расчета цены в памяти процесса
+Повторный расчет с теми же данными товара, параметрами формулы и
+версией курсов берется из кэша (LRU с ограничением размера и TTL).
+Смена курсов меняет версию в ключе, поэтому старые результаты
+больше не используются и со временем вытесняются
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Максимум результатов в кэше
+QUOTE_CACHE_SIZE = int(os.environ.get('QUOTE_CACHE_SIZE', 10000))
+# Сколько секунд результат считается актуальным
+QUOTE_CACHE_TTL = float(os.environ.get('QUOTE_CACHE_TTL', 300))
+
+
+def quote_key(item, plan, rates_version):
+    """
+    Ключ кэша: данные товара после parse_item(), тарифный план
+    (хэшируется по параметрам формулы) и версия курсов
+    """
+    return (
+        item['productName'], item['originalPrice'], item['currency'], item['weight'],
+        item['length'], item['width'], item['height'], plan, rates_version
+    )
+
+
+class QuoteCache:
+    """
+    LRU кэш расчетов с ограничением размера и времени жизни
+    Значения отдаются как есть - вызывающий код не должен их изменять
+    """
+
+    def __init__(self, maxsize=QUOTE_CACHE_SIZE, ttl=QUOTE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # ключ -> (значение, момент истечения), в порядке последнего обращения
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Значение по ключу или None (нет в кэше или истекло)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() < entry[1]:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов для мониторинга"""
+        with self._lock:
+            requests_total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / requests_total, 4) if requests_total else 0.0
+            }
@@ -0,0 +1,144 @@
+"""
+Кэш курсов валют в памяти процесса
+TTL, stale-while-revalidate и single-flight обновление
+"""
+import os
+import threading
+import time
+
+
+# Сколько секунд курсы считаются свежими
+RATES_CACHE_TTL = float(os.environ.get('RATES_CACHE_TTL', 300))
+# Сколько секунд после истечения TTL можно отдавать старые курсы,
+# пока они обновляются в фоне
+RATES_CACHE_STALE_TTL = float(os.environ.get('RATES_CACHE_STALE_TTL', 3600))
+# Через сколько секунд повторить загрузку после ошибки
+RATES_CACHE_ERROR_TTL = float(os.environ.get('RATES_CACHE_ERROR_TTL', 30))
+
+
+class RateCache:
+    """
+    Кэш курсов валют с ограниченным временем жизни
+
+    loader    - функция загрузки свежих курсов (ходит в сеть, может упасть)
+    fallback  - функция, возвращающая курсы, если загрузить не удалось
+                и в кэше еще ничего нет
+    ttl       - время (сек), пока значение считается свежим
+    stale_ttl - время (сек) после истечения ttl, в течение которого
+                отдается старое значение, а обновление идет в фоне
+    error_ttl - время (сек) до повторной попытки после ошибки
+
+    Одновременно выполняется не больше одной загрузки (single-flight):
+    остальные потоки либо ждут ее результата, либо получают старое значение.
+    """
+
+    def __init__(self, name, loader, fallback=None, ttl=RATES_CACHE_TTL,
+                 stale_ttl=RATES_CACHE_STALE_TTL, error_ttl=RATES_CACHE_ERROR_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self._loader = loader
+        self._fallback = fallback
+        # (значение, момент истечения, версия) - заменяется целиком одной операцией
+        # Версия растет при каждой смене значения (ключ для кэшей расчетов)
+        self._entry = (None, 0.0, 0)
+        # Если курсы публикует фоновый обновлятель, get() не ходит в сеть сам:
+        # пока ничего не опубликовано, отдаются резервные курсы (fallback)
+        self.passive = False
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        """
+        Возвращает курсы из кэша
+        Сеть затрагивается только если значение устарело
+        """
+        value, expires_at, _ = self._entry
+        now = time.monotonic()
+
+        if value is not None and (self.passive or now < expires_at):
+            return value
+
+        if value is not None and now < expires_at + self.stale_ttl:
+            self._refresh_in_background()
+            return value
+
+        if self.passive:
+            # Курсы публикует фоновый обновлятель, запрос в сеть не ходит
+            return self._use_fallback()
+
+        return self._refresh(expired_only=True)
+
+    def get_versioned(self):
+        """Возвращает (курсы, версия курсов) - как get(), но вместе с версией"""
+        self.get()
+        value, _, version = self._entry
+        return value, version
+
+    @property
+    def version(self):
+        return self._entry[2]
+
+    def peek(self):
+        """Возвращает текущее значение без обновления (None, если пусто)"""
+        return self._entry[0]
+
+    def publish(self, value):
+        """Публикует свежие курсы, загруженные снаружи (фоновым обновлятелем)"""
+        self._set(value, time.monotonic() + self.ttl)
+
+    def invalidate(self):
+        """Помечает значение устаревшим (следующий get() обновит кэш)"""
+        value, _, version = self._entry
+        self._entry = (value, 0.0, version)
+
+    def _set(self, value, expires_at):
+        with self._state_lock:
+            old_value, _, version = self._entry
+            if value is not old_value:
+                version += 1
+            self._entry = (value, expires_at, version)
+
+    def _refresh(self, expired_only=False):
+        with self._load_lock:
+            # Пока ждали блокировку, курсы мог загрузить другой поток
+            value, expires_at, _ = self._entry
+            if expired_only and value is not None and time.monotonic() < expires_at:
+                return value
+
+            try:
+                value = self._loader()
+                self.publish(value)
+                return value
+            except Exception as e:
+                print(f"❌ Ошибка обновления кэша курсов {self.name}: {e}")
+                if value is None and self._fallback is not None:
+                    value = self._fallback()
+                self._set(value, time.monotonic() + self.error_ttl)
+                return value
+
+    def _use_fallback(self):
+        """Кладет в пустой кэш резервные курсы до первой публикации"""
+        with self._load_lock:
+            value, _, _ = self._entry
+            if value is None and self._fallback is not None:
+                value = self._fallback()
+                self._set(value, time.monotonic() + self.error_ttl)
+            return value
+
+    def _refresh_in_background(self):
+        with self._state_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def worker():
+            try:
+                self._refresh(expired_only=True)
+            finally:
+                with self._state_lock:
+                    self._refreshing = False
+
+        threading.Thread(target=worker, name=f'rate-cache-{self.name}', daemon=True).start()
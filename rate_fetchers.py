@@ -0,0 +1,154 @@
+"""
+HTTP загрузка страниц с курсами валют (Halyk и BIO)
+Одна сессия requests на процесс с пулом соединений (без повторных
+DNS/TCP/TLS рукопожатий), явные таймауты подключения и чтения,
+условные запросы (ETag / If-Modified-Since) и повторы с джиттером.
+Источники можно загружать параллельно: prefetch() запускает запрос
+в фоне, следующий fetch() забирает его результат
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+# Сколько повторов после сетевой ошибки или ответа 429/5xx
+RATES_HTTP_RETRIES = int(os.environ.get('RATES_HTTP_RETRIES', 2))
+# Первая пауза перед повтором (сек), далее удваивается, ±50% джиттер
+RATES_HTTP_BACKOFF = float(os.environ.get('RATES_HTTP_BACKOFF', 0.5))
+# Соединений в пуле на один хост
+RATES_HTTP_POOL_SIZE = int(os.environ.get('RATES_HTTP_POOL_SIZE', 4))
+# Результат prefetch() старше этого (сек) не используется
+PREFETCH_MAX_AGE = 60
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _RetryableStatus(Exception):
+    """Временная ошибка сервера (429/5xx), запрос можно повторить"""
+
+
+_session_lock = threading.Lock()
+_session = None
+_executor = None
+_owner_pid = None
+
+
+def _ensure_process_state():
+    """Сессия и пул потоков создаются заново в дочернем процессе после fork"""
+    global _session, _executor, _owner_pid
+    if _owner_pid == os.getpid():
+        return
+    with _session_lock:
+        if _owner_pid == os.getpid():
+            return
+        # requests импортируется при первой загрузке: воркеры, которые только
+        # читают общий снимок курсов, его не загружают
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=RATES_HTTP_POOL_SIZE, pool_maxsize=RATES_HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _session = session
+        _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rate-fetch')
+        _owner_pid = os.getpid()
+
+
+def get_session():
+    """Общая сессия requests текущего процесса"""
+    _ensure_process_state()
+    return _session
+
+
+class HttpFetcher:
+    """
+    Загрузчик одной страницы с курсами
+    fetch() возвращает текст ответа; если сервер ответил 304 Not Modified,
+    возвращается текст предыдущего ответа
+    """
+
+    def __init__(self, name, url, headers=None, timeout=(5, 10),
+                 retries=RATES_HTTP_RETRIES, backoff=RATES_HTTP_BACKOFF):
+        self.name = name
+        self.url = url
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        # Последний полный ответ и его валидаторы (ETag, Last-Modified)
+        self._etag = None
+        self._last_modified = None
+        self._body = None
+        self._pending = None
+
+    def prefetch(self):
+        """Запускает загрузку в фоне (результат заберет следующий fetch())"""
+        _ensure_process_state()
+        with self._lock:
+            if self._pending is not None and not self._pending[0].done():
+                return
+            self._pending = (_executor.submit(self._fetch), time.monotonic())
+
+    def fetch(self):
+        """Текст страницы (ошибка сети или HTTP - исключение)"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None and time.monotonic() - pending[1] < PREFETCH_MAX_AGE:
+            return pending[0].result()
+        return self._fetch()
+
+    def _fetch(self):
+        import requests
+        
+        for attempt in range(self.retries + 1):
+            try:
+                return self._request()
+            except (requests.ConnectionError, requests.Timeout, _RetryableStatus) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                print(f"⚠️ {self.name}: {e}, повтор через {delay:.1f} сек")
+                time.sleep(delay)
+
+    def _request(self):
+        headers = dict(self.headers)
+        with self._lock:
+            body = self._body
+            if body is not None:
+                if self._etag:
+                    headers['If-None-Match'] = self._etag
+                if self._last_modified:
+                    headers['If-Modified-Since'] = self._last_modified
+
+        start = time.perf_counter()
+        try:
+            response = get_session().get(self.url, headers=headers, timeout=self.timeout)
+        except Exception:
+            metrics.inc('bio_outbound_requests_total', source=self.name, result='error')
+            raise
+        finally:
+            metrics.observe('bio_outbound_request_duration_seconds', time.perf_counter() - start, source=self.name)
+
+        if response.status_code == 304 and body is not None:
+            self.not_modified += 1
+            metrics.inc('bio_outbound_requests_total', source=self.name, result='not_modified')
+            return body
+        if response.status_code >= 400:
+            metrics.inc('bio_outbound_requests_total', source=self.name, result='error')
+        if response.status_code in RETRY_STATUSES:
+            raise _RetryableStatus(f"HTTP {response.status_code}")
+        response.raise_for_status()
+        metrics.inc('bio_outbound_requests_total', source=self.name, result='ok')
+
+        with self._lock:
+            self._etag = response.headers.get('ETag')
+            self._last_modified = response.headers.get('Last-Modified')
+            self._body = response.text
+        return response.text
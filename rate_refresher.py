@@ -0,0 +1,202 @@
+"""
+Фоновое обновление курсов валют
+Опрашивает Halyk и BIO по расписанию (с джиттером, экспоненциальной
+задержкой после ошибок и автоматическим выключателем) и публикует
+свежие курсы в кэш, откуда их только читают обработчики запросов
+
+Среди нескольких процессов источники опрашивает только ведущий
+(захвативший leader-блокировку), остальные подхватывают опубликованный
+им снимок из общего хранилища курсов.
+"""
+import os
+import random
+import threading
+import time
+
+
+# Интервал опроса источников (сек)
+RATES_REFRESH_INTERVAL = float(os.environ.get('RATES_REFRESH_INTERVAL', 300))
+# Доля случайного разброса интервала (0.1 = ±10%)
+RATES_REFRESH_JITTER = float(os.environ.get('RATES_REFRESH_JITTER', 0.1))
+# Первая задержка после ошибки (сек), далее удваивается
+RATES_RETRY_BASE = float(os.environ.get('RATES_RETRY_BASE', 5))
+# Сколько ошибок подряд размыкают выключатель
+RATES_BREAKER_THRESHOLD = int(os.environ.get('RATES_BREAKER_THRESHOLD', 5))
+# Сколько секунд выключатель остается разомкнутым
+RATES_BREAKER_RESET = float(os.environ.get('RATES_BREAKER_RESET', 600))
+# Как часто ведомые процессы проверяют общий снимок курсов (сек)
+RATES_FOLLOW_INTERVAL = float(os.environ.get('RATES_FOLLOW_INTERVAL', 1))
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для внешнего источника
+    После threshold ошибок подряд запросы не выполняются reset_timeout секунд,
+    затем разрешается одна пробная попытка
+    """
+
+    def __init__(self, threshold=RATES_BREAKER_THRESHOLD, reset_timeout=RATES_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        return self.state != 'open'
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    def remaining(self):
+        """Сколько секунд выключатель еще будет разомкнут"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+class RefreshSource:
+    """
+    Источник курсов для фонового обновления
+    fetch    - функция загрузки (выбрасывает исключение при ошибке)
+    publish  - функция публикации загруженного значения
+    prefetch - функция, заранее запускающая сетевой запрос источника
+               (чтобы несколько источников загружались параллельно)
+    """
+
+    def __init__(self, name, fetch, publish, interval=RATES_REFRESH_INTERVAL,
+                 jitter=RATES_REFRESH_JITTER, retry_base=RATES_RETRY_BASE, prefetch=None):
+        self.name = name
+        self.fetch = fetch
+        self.publish = publish
+        self.prefetch = prefetch
+        self.interval = interval
+        self.jitter = jitter
+        self.retry_base = retry_base
+        self.breaker = CircuitBreaker()
+        self.next_run = 0.0
+        self.last_success = None
+        self.last_error = None
+
+    def run_once(self):
+        """Загружает и публикует курсы, возвращает задержку до следующего запуска"""
+        if not self.breaker.allow():
+            return self.breaker.remaining()
+
+        try:
+            self.publish(self.fetch())
+        except Exception as e:
+            self.breaker.record_failure()
+            self.last_error = str(e)
+            print(f"❌ Фоновое обновление курсов {self.name} не удалось "
+                  f"(ошибок подряд: {self.breaker.failures}): {e}")
+            if self.breaker.state == 'open':
+                print(f"⚠️ Источник {self.name} отключен на {self.breaker.reset_timeout:.0f} сек")
+                return self.breaker.remaining()
+            delay = min(self.interval, self.retry_base * 2 ** (self.breaker.failures - 1))
+            return self._with_jitter(delay)
+
+        self.breaker.record_success()
+        self.last_success = time.time()
+        self.last_error = None
+        return self._with_jitter(self.interval)
+
+    def _with_jitter(self, delay):
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+class RateRefresher:
+    """
+    Фоновый поток, по очереди обновляющий источники курсов
+    Источники опрашиваются в порядке списка (BIO зависит от курса рубля Halyk),
+    страницы источников, у которых есть prefetch, загружаются параллельно
+
+    leader - блокировка ведущего процесса (None - процесс всегда ведущий)
+    follow - функция, подхватывающая снимок ведущего, пока процесс ведомый
+    """
+
+    def __init__(self, sources, leader=None, follow=None, follow_interval=RATES_FOLLOW_INTERVAL):
+        self.sources = sources
+        self.leader = leader
+        self.follow = follow
+        self.follow_interval = follow_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def is_leader(self):
+        return self.leader is None or self.leader.held
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='rate-refresher', daemon=True)
+        self._thread.start()
+        print("💱 Фоновое обновление курсов запущено")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.leader is not None:
+            self.leader.release()
+
+    def status(self):
+        return {
+            source.name: {
+                'circuit': source.breaker.state,
+                'failures': source.breaker.failures,
+                'lastSuccess': source.last_success,
+                'lastError': source.last_error
+            }
+            for source in self.sources
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.leader is not None and not self.leader.held:
+                if self.leader.acquire():
+                    print(f"💱 Процесс {os.getpid()} стал ведущим для обновления курсов")
+                else:
+                    self._follow_once()
+                    self._stop.wait(self.follow_interval)
+                    continue
+
+            now = time.monotonic()
+            due = [source for source in self.sources if now >= source.next_run]
+            # Сетевые запросы всех источников идут параллельно,
+            # а разбор и публикация - в порядке списка
+            if len(due) > 1:
+                for source in due:
+                    if source.prefetch is not None and source.breaker.allow():
+                        source.prefetch()
+            for source in due:
+                source.next_run = time.monotonic() + source.run_once()
+            wake_at = min(source.next_run for source in self.sources)
+            self._stop.wait(max(0.5, wake_at - time.monotonic()))
+
+    def _follow_once(self):
+        if self.follow is None:
+            return
+        try:
+            self.follow()
+        except Exception as e:
+            print(f"❌ Ошибка чтения общего снимка курсов: {e}")
@@ -0,0 +1,209 @@
+"""
+Хранилище курсов валют
+Снимок курсов хранится в JSON файле, который заменяется атомарно
+(запись во временный файл + os.replace), поэтому читатель никогда
+не увидит наполовину записанный файл. Каждый снимок содержит номер
+версии и время получения курсов.
+
+Несколько процессов (воркеров gunicorn) согласуются через fcntl-блокировки:
+запись снимка сериализуется блокировкой файла, а обновлять курсы
+из внешних источников может только процесс, захвативший LeaderLock.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+import storage
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: межпроцессные блокировки недоступны, работаем в одном процессе
+    fcntl = None
+
+
+# По умолчанию рядом с базой расчетов (на постоянном диске), чтобы
+# снимок курсов переживал перезапуск и был общим для всех воркеров
+RATES_STORE_PATH = os.environ.get(
+    'RATES_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(storage.DB_PATH)), 'rates.json')
+)
+
+# Начальные значения, пока курсы ни разу не загружались
+DEFAULT_SNAPSHOT = {
+    'version': 0,
+    'fetched_at': None,
+    'snapshot_id': None,
+    'rates': {'RUB': 7.02, 'USD': 668.67, 'EUR': 783.71},
+    'bio_rates': {'EUR': 109.0, 'USD': 93.0},
+    'bio_rates_tenge': {'EUR': 783.71, 'USD': 668.67}
+}
+
+
+class RateStore:
+    """
+    Версионированное хранилище снимков курсов
+
+    load()    - читает текущий снимок без блокировок; файл разбирается
+                заново только если он изменился (по inode/mtime/size)
+    publish() - записывает новый снимок с увеличенной версией
+
+    Возвращаемые снимки общие для всех потоков - их нельзя изменять.
+
+    history - функция, сохраняющая снимок в историю курсов и возвращающая
+              id записи (он сохраняется в снимке как snapshot_id)
+    """
+
+    def __init__(self, path=RATES_STORE_PATH, history=None):
+        self.path = path
+        self.history = history
+        self._write_lock = threading.Lock()
+        # (ключ файла, снимок)
+        self._cached = (None, DEFAULT_SNAPSHOT)
+
+    def load(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return DEFAULT_SNAPSHOT
+
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cached_key, snapshot = self._cached
+        if cached_key == key:
+            return snapshot
+
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"❌ Ошибка чтения хранилища курсов {self.path}: {e}")
+            return snapshot
+
+        self._cached = (key, snapshot)
+        return snapshot
+
+    def publish(self, **sections):
+        """
+        Публикует новый снимок: переданные разделы (rates, bio_rates,
+        bio_rates_tenge) заменяются, остальные берутся из текущего снимка
+        """
+        with self._write_lock, _FileLock(self.path + '.write.lock'):
+            current = self.load()
+            snapshot = dict(current)
+            for name, value in sections.items():
+                if name not in DEFAULT_SNAPSHOT or name in ('version', 'fetched_at', 'snapshot_id'):
+                    raise KeyError(f"Неизвестный раздел снимка курсов: {name}")
+                snapshot[name] = dict(value)
+            snapshot['version'] = current.get('version', 0) + 1
+            snapshot['fetched_at'] = time.time()
+            snapshot['snapshot_id'] = self._record(snapshot)
+
+            self._write(snapshot)
+            return snapshot
+
+    def _record(self, snapshot):
+        """Сохраняет снимок в историю курсов (ошибка истории не мешает публикации)"""
+        if self.history is None:
+            return None
+        try:
+            return self.history(snapshot)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения снимка курсов в историю: {e}")
+            return None
+
+    def _write(self, snapshot):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.rates-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(snapshot, file, ensure_ascii=False)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class _FileLock:
+    """Эксклюзивная межпроцессная блокировка файла (ожидает освобождения)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class LeaderLock:
+    """
+    Блокировка "ведущего" процесса среди воркеров gunicorn
+    Захватывается без ожидания и удерживается до завершения процесса;
+    если ведущий процесс умер, ОС снимает блокировку и ее захватывает
+    следующий воркер. Без fcntl (Windows) процесс всегда ведущий.
+    """
+
+    def __init__(self, path=RATES_STORE_PATH + '.lock'):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return fcntl is None or self._file is not None
+
+    def acquire(self):
+        """Пытается стать ведущим, возвращает True если блокировка у нас"""
+        if self.held:
+            return True
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        file = open(self.path, 'a')
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+_store = RateStore()
+
+
+def load():
+    """Текущий снимок курсов (только для чтения)"""
+    return _store.load()
+
+
+def publish(**sections):
+    """Публикует новый снимок курсов и возвращает его"""
+    return _store.publish(**sections)
+
+
+def set_history(history):
+    """Подключает сохранение каждого публикуемого снимка в историю курсов"""
+    _store.history = history
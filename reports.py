@@ -0,0 +1,127 @@
+"""
+Потоковая выгрузка отчетов по расчетам
+Строки читаются из базы частями и сразу записываются в ответ (CSV)
+или в XLSX в режиме write-only, поэтому память не зависит от периода
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+
+import storage
+
+
+REPORT_HEADERS = ['Наименование товара', 'Финальная цена (KZT)', 'Дата расчета']
+REPRICE_REPORT_HEADERS = ['ID расчета', 'Наименование товара', 'Дата расчета',
+                          'Старая цена (KZT)', 'Новая цена (KZT)', 'Разница (KZT)', 'Разница (%)']
+REPORT_SHEET_TITLE = 'Отчет по расчетам'
+# Строк из базы за одно чтение курсора
+REPORT_CHUNK_SIZE = int(os.environ.get('REPORT_CHUNK_SIZE', 2000))
+# Максимальная ширина колонки XLSX (как в прежнем отчете)
+MAX_COLUMN_WIDTH = 50
+
+
+def format_report_row(row):
+    """(наименование, цена, дата) → строка отчета с округленной ценой и датой ДД.ММ.ГГГГ ЧЧ:ММ"""
+    product_name, final_price, calculation_date = row
+
+    try:
+        formatted_date = datetime.fromisoformat(str(calculation_date).replace('Z', '+00:00')).strftime('%d.%m.%Y %H:%M')
+    except ValueError:
+        formatted_date = calculation_date
+
+    try:
+        formatted_price = round(float(final_price), 2)
+    except (TypeError, ValueError):
+        formatted_price = final_price
+
+    return [product_name, formatted_price, formatted_date]
+
+
+def iter_csv_chunks(headers, chunks, format_row):
+    """
+    CSV по частям (str): первая часть - BOM и заголовки, чтобы Excel
+    правильно открыл кириллицу, дальше - одна часть на каждую пачку строк
+    chunks - пачки строк из базы, format_row - строка базы → строка CSV
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+
+    for rows in chunks:
+        for row in rows:
+            writer.writerow(format_row(row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_csv_report(start_date, end_date):
+    """CSV отчет за период по частям (str)"""
+    return iter_csv_chunks(
+        REPORT_HEADERS,
+        storage.iter_report_rows(start_date, end_date, REPORT_CHUNK_SIZE),
+        format_report_row
+    )
+
+
+def write_xlsx_report(start_date, end_date, max_name_length):
+    """
+    Записывает XLSX отчет во временный файл и возвращает открытый файл
+    Книга в режиме write-only: строки сразу сбрасываются на диск.
+    В этом режиме ширину колонок нужно задать до первой строки, поэтому
+    ширина колонки наименований берется из MAX(LENGTH(...)) по периоду
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(REPORT_SHEET_TITLE)
+
+    # Цена и дата имеют ограниченную длину, наименование - из статистики периода
+    widths = [
+        max(len(REPORT_HEADERS[0]), max_name_length),
+        max(len(REPORT_HEADERS[1]), 12),
+        max(len(REPORT_HEADERS[2]), len('31.12.2099 23:59'))
+    ]
+    for letter, width in zip('ABC', widths):
+        worksheet.column_dimensions[letter].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+    worksheet.append(REPORT_HEADERS)
+    for rows in storage.iter_report_rows(start_date, end_date, REPORT_CHUNK_SIZE):
+        for row in rows:
+            worksheet.append(format_report_row(row))
+
+    # Анонимный временный файл удаляется при закрытии (после отправки ответа)
+    output = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        workbook.save(output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def format_reprice_row(row):
+    """(id, наименование, дата, старая цена, новая цена) → строка отчета пересчета"""
+    calculation_id, product_name, calculation_date, old_price, new_price = row
+    product_name, _, formatted_date = format_report_row((product_name, old_price, calculation_date))
+    difference = new_price - old_price
+    percent = round(difference / old_price * 100, 2) if old_price else ''
+    return [calculation_id, product_name, formatted_date,
+            round(old_price, 2), round(new_price, 2), round(difference, 2), percent]
+
+
+def iter_reprice_csv_report(job_id):
+    """CSV отчет пересчета (старая и новая цена) по частям (str)"""
+    return iter_csv_chunks(
+        REPRICE_REPORT_HEADERS,
+        storage.iter_reprice_results(job_id, REPORT_CHUNK_SIZE),
+        format_reprice_row
+    )
@@ -0,0 +1,212 @@
+"""
+Пересчет сохраненных расчетов по новым тарифам и/или курсам
+Задание выполняется в фоновом потоке: исходные данные расчетов читаются
+частями, считаются векторно и сохраняются вместе с прогрессом задания,
+поэтому ход работы и отчет видны из любого воркера
+
+Каждая часть обновляет отметку задания (heartbeat_at) и последний
+обработанный id. Если воркер остановлен посреди пересчета, отметка
+устаревает, и сторож (start_watchdog) любого воркера продолжает задание
+с последнего сохраненного id
+"""
+import os
+import threading
+import time
+
+import storage
+from pricing import NUMPY_AVAILABLE, quote_item, quote_items_vectorized
+from tariff import get_tariff_plan
+
+
+# Расчетов в одной части пересчета
+REPRICE_CHUNK_SIZE = int(os.environ.get('REPRICE_CHUNK_SIZE', 5000))
+# Разница цен меньше этой (тенге) не считается изменением
+PRICE_EPSILON = 0.005
+# Задание без отметки дольше стольких секунд считается брошенным
+REPRICE_STALE_SECONDS = float(os.environ.get('REPRICE_STALE_SECONDS', 60))
+
+# Какими курсами пересчитывать: текущими или курсами исходного расчета
+RATES_CURRENT = 'current'
+RATES_ORIGINAL = 'original'
+
+
+def _item_from_row(row):
+    """Строка storage.iter_calculation_inputs() → товар в формате parse_item()"""
+    _, product_name, _, _, _, original_price, currency, weight, length, width, height = row
+    return {
+        'productName': product_name,
+        'originalPrice': original_price,
+        'currency': currency,
+        'weight': weight,
+        'length': length,
+        'width': width,
+        'height': height
+    }
+
+
+def reprice_rows(rows, plan, rates_for):
+    """
+    Пересчитывает часть расчетов
+    rows      - строки storage.iter_calculation_inputs()
+    rates_for - функция make_rates_for()
+    Возвращает список (id расчета, наименование, дата, старая цена, новая цена)
+    """
+    # Расчеты с одинаковыми курсами считаются одним векторным проходом
+    groups = {}
+    for row in rows:
+        key, current_rates, bio_rates = rates_for(row[4])
+        groups.setdefault(key, (current_rates, bio_rates, []))[2].append(row)
+
+    results = []
+    for current_rates, bio_rates, group in groups.values():
+        items = [_item_from_row(row) for row in group]
+        if NUMPY_AVAILABLE:
+            quotes = quote_items_vectorized(items, plan, current_rates, bio_rates)
+        else:
+            quotes = []
+            for item in items:
+                try:
+                    quotes.append(quote_item(item, plan, current_rates, bio_rates))
+                except ValueError as e:
+                    quotes.append(e)
+
+        for row, quote in zip(group, quotes):
+            if isinstance(quote, ValueError):
+                continue
+            results.append((row[0], row[1], row[3], row[2], quote['finalPrice']))
+
+    results.sort()
+    return results
+
+
+def make_rates_for(mode, current_rates, bio_rates):
+    """
+    Функция выбора курсов для пересчета:
+    id снимка курсов расчета → (ключ группы, курсы, курсы BIO в тенге)
+    mode - RATES_CURRENT, RATES_ORIGINAL или id снимка курсов из истории
+    Для RATES_ORIGINAL расчеты без сохраненного снимка считаются по текущим курсам
+    При неизвестном снимке - ValueError
+    """
+    if mode == RATES_CURRENT:
+        return lambda snapshot_id: (None, current_rates, bio_rates)
+
+    if mode == RATES_ORIGINAL:
+        def rates_for(snapshot_id):
+            snapshot = storage.fetch_rate_snapshot(snapshot_id) if snapshot_id is not None else None
+            if snapshot is None:
+                return None, current_rates, bio_rates
+            return snapshot_id, snapshot['rates'], snapshot['bio_rates_tenge']
+        return rates_for
+
+    snapshot = storage.fetch_rate_snapshot(mode)
+    if snapshot is None:
+        raise ValueError(f"Снимок курсов {mode} не найден")
+    return lambda snapshot_id: (mode, snapshot['rates'], snapshot['bio_rates_tenge'])
+
+
+def run_reprice_job(job_id, plan, rates_for, start_date=None, end_date=None, chunk_size=REPRICE_CHUNK_SIZE,
+                    resume=None):
+    """
+    Выполняет задание пересчета: статус running → done (или failed с ошибкой)
+    Результаты, прогресс и последний обработанный id сохраняются после каждой части
+    resume - задание (storage.fetch_reprice_job()), которое нужно продолжить
+    """
+    try:
+        total = storage.count_calculation_inputs(start_date, end_date)
+        storage.update_reprice_job(job_id, status='running', total=total, heartbeat_at=time.time())
+        print(f"🔁 Пересчет {job_id}: {total} расчетов")
+
+        processed = changed = last_id = 0
+        old_total = new_total = 0.0
+        if resume is not None:
+            processed, changed, last_id = resume['processed'], resume['changed'], resume['last_id']
+            old_total, new_total = resume['old_total'], resume['new_total']
+        for rows in storage.iter_calculation_inputs(start_date, end_date, chunk_size, after_id=last_id):
+            results = reprice_rows(rows, plan, rates_for)
+            processed += len(rows)
+            for _, _, _, old_price, new_price in results:
+                old_total += old_price
+                new_total += new_price
+                if abs(new_price - old_price) >= PRICE_EPSILON:
+                    changed += 1
+            storage.save_reprice_results(job_id, results, processed=processed, changed=changed,
+                                         old_total=old_total, new_total=new_total,
+                                         last_id=rows[-1][0], heartbeat_at=time.time())
+            # Отдаем GIL обработчикам запросов между частями
+            time.sleep(0)
+
+        storage.update_reprice_job(job_id, finished=True, status='done')
+        print(f"✅ Пересчет {job_id} завершен: изменилось {changed} из {processed}")
+    except Exception as e:
+        print(f"❌ Ошибка пересчета {job_id}: {e}")
+        storage.update_reprice_job(job_id, finished=True, status='failed', error=str(e))
+
+
+def start_reprice_job(params, plan, rates_for, start_date=None, end_date=None):
+    """
+    Создает задание пересчета и запускает его в фоновом потоке
+    params - параметры задания для отчета (сохраняются в базе как JSON)
+    Возвращает id задания
+    """
+    job_id = storage.create_reprice_job(params)
+    threading.Thread(
+        target=run_reprice_job,
+        args=(job_id, plan, rates_for, start_date, end_date),
+        name=f'reprice-{job_id}',
+        daemon=True
+    ).start()
+    return job_id
+
+
+def resume_reprice_job(job_id, get_rates):
+    """
+    Продолжает захваченное задание с последнего сохраненного id
+    Тарифный план и режим курсов восстанавливаются из параметров задания,
+    get_rates() - текущие (курсы, курсы BIO в тенге)
+    Режим current продолжается по курсам на момент продолжения
+    """
+    job = storage.fetch_reprice_job(job_id)
+    params = job['params']
+    try:
+        plan = get_tariff_plan(params['formulaParams'])
+        current_rates, bio_rates = get_rates()
+        rates_for = make_rates_for(params['rates'], current_rates, bio_rates)
+    except Exception as e:
+        print(f"❌ Пересчет {job_id} не удалось продолжить: {e}")
+        storage.update_reprice_job(job_id, finished=True, status='failed', error=str(e))
+        return
+
+    print(f"🔁 Пересчет {job_id} продолжается после расчета {job['last_id']}")
+    run_reprice_job(job_id, plan, rates_for, params.get('startDate'), params.get('endDate'), resume=job)
+
+
+_watchdog = None
+
+
+def start_watchdog(get_rates, interval=None):
+    """
+    Запускает сторожа пересчетов в текущем процессе: раз в interval секунд
+    (по умолчанию половина REPRICE_STALE_SECONDS) захватывает брошенные
+    задания и продолжает каждое в своем фоновом потоке
+    """
+    global _watchdog
+    if _watchdog is not None and _watchdog.is_alive():
+        return
+    interval = REPRICE_STALE_SECONDS / 2 if interval is None else interval
+
+    def watch():
+        while True:
+            try:
+                for job_id in storage.claim_stale_reprice_jobs(time.time() - REPRICE_STALE_SECONDS):
+                    threading.Thread(
+                        target=resume_reprice_job,
+                        args=(job_id, get_rates),
+                        name=f'reprice-{job_id}',
+                        daemon=True
+                    ).start()
+            except Exception as e:
+                print(f"❌ Ошибка проверки заданий пересчета: {e}")
+            time.sleep(interval)
+
+    _watchdog = threading.Thread(target=watch, name='reprice-watchdog', daemon=True)
+    _watchdog.start()
@@ -4,226 +4,296 @@ import io
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
-import requests
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
 import json
-from datetime import datetime, date
+from datetime import datetime, date, timezone
 from io import BytesIO
-import sqlite3
 import os
-import importlib
+import time
 import csv
+import importlib.util
+from urllib.parse import quote as url_quote
 
-# Попытка импорта pandas, если не удается - используем CSV
-try:
-    import pandas as pd
-    PANDAS_AVAILABLE = True
-except ImportError:
-    PANDAS_AVAILABLE = False
-    print("⚠️ pandas недоступен, отчеты будут в формате CSV")
+# XLSX отчеты требуют openpyxl, без него отчеты будут в формате CSV
+OPENPYXL_AVAILABLE = importlib.util.find_spec('openpyxl') is not None
+if not OPENPYXL_AVAILABLE:
+    print("⚠️ openpyxl недоступен, отчеты будут в формате CSV")
 
 app = Flask(__name__)
 
 # Импортируем модули для работы с курсами валют
 import valute
-import info
 import valute_bio
+import rate_store
+import storage
+import reports
+import metrics
+import repricing
+from history_writer import HistoryWriter
+from quote_cache import QuoteCache, quote_key
+from rate_cache import RateCache
+from rate_refresher import RateRefresher, RefreshSource
+import tariff_store
+from tariff import get_tariff_plan
+from static_assets import StaticAsset
+from pricing import parse_item, quote_item, format_quote, quote_items_vectorized, NUMPY_AVAILABLE
+
+# Ограничения пакетного расчета
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', 50000))
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 1000))
+# Максимальный размер страницы истории
+MAX_HISTORY_LIMIT = 500
+# Не сохранять в историю повторный расчет, взятый из кэша расчетов
+SKIP_DUPLICATE_QUOTE_HISTORY = os.environ.get('QUOTE_SKIP_DUPLICATE_HISTORY', '0') == '1'
+# Снимок курсов старше этого (сек) считается устаревшим в /healthz
+HEALTH_RATES_MAX_AGE = float(os.environ.get('HEALTH_RATES_MAX_AGE', 3600))
+
+def _load_exchange_rates():
+    """
+    Загружает курсы валют через valute.py (результат сохраняется в хранилище курсов)
+    """
+    with metrics.stage('rate_fetch', source='halyk'):
+        exchange_rates = valute.valute()
+    
+    print(f"Курсы валют обновлены: {exchange_rates}")
+    return exchange_rates
+
+def _load_bio_exchange_rates():
+    """
+    Загружает курсы валют BIO и конвертирует их в тенге
+    по курсу рубля из кэша Halyk (без повторного запроса к Halyk)
+    """
+    with metrics.stage('rate_fetch', source='bio'):
+        bio_rates = valute_bio.fetch_bio_rates()
+    rub_to_tenge = exchange_rates_cache.get().get('RUB', 1.0)
+    bio_rates_in_tenge = valute_bio.save_bio_rates_in_tenge(bio_rates, rub_to_tenge)
+    
+    print(f"BIO курсы в тенге обновлены: {bio_rates_in_tenge}")
+    return bio_rates_in_tenge
 
-# Параметры формулы по умолчанию
-DEFAULT_FORMULA_PARAMS = {
-    'divider': 1.22,
-    'multiplier': 1.16,
-    'nds': 1.16,
-    'base30': 9000,           # Базовая ставка (фиксированная)
-    'rate30': 215,            # Тариф город+город за кг свыше 30
-    'pickup30': 12000,        # Забор со склада БИО
-    'pickupRate30': 27,       # Тариф забора за кг свыше 30
-    'warehouseCount': 26,     # Количество единиц для складских услуг
-    'warehouseRate': 450,     # Тариф за единицу складских услуг
-    'deliveryCity30': 5000,   # Доставка по Астане
-    'cityRate30': 19,         # Тариф доставки по Астане за кг свыше 30
-    'rate300': 164,           # Тариф город+город 300-1000 кг
-    'rate1000': 143,          # Тариф город+город свыше 1000 кг
-    'volumetricFactor': 200   # Коэффициент объемного веса (логисты БИО)
-}
+# Кэши курсов: в пределах TTL расчеты не ходят в сеть и не пишут файлы
+# При ошибке и пустом кэше используются последние сохраненные курсы
+exchange_rates_cache = RateCache(
+    'halyk',
+    loader=_load_exchange_rates,
+    fallback=lambda: rate_store.load()['rates']
+)
+bio_rates_cache = RateCache(
+    'bio',
+    loader=_load_bio_exchange_rates,
+    fallback=lambda: rate_store.load()['bio_rates_tenge']
+)
+
+_followed_rates_version = 0
+
+def _follow_shared_rates():
+    """
+    Подхватывает в кэши снимок курсов, опубликованный ведущим воркером
+    """
+    global _followed_rates_version
+    snapshot = rate_store.load()
+    if snapshot['version'] == _followed_rates_version or not snapshot['fetched_at']:
+        return
+    # Публикуется только изменившийся раздел: новая версия кэша
+    # сбрасывает кэш расчетов, зависящий от этих курсов
+    if snapshot['rates'] != exchange_rates_cache.peek():
+        exchange_rates_cache.publish(snapshot['rates'])
+    if snapshot['bio_rates_tenge'] != bio_rates_cache.peek():
+        bio_rates_cache.publish(snapshot['bio_rates_tenge'])
+    _followed_rates_version = snapshot['version']
+
+# Фоновое обновление курсов: обработчики запросов только читают кэш
+# Из нескольких воркеров gunicorn в Halyk и BIO ходит только ведущий
+rate_refresher = RateRefresher(
+    [
+        RefreshSource('halyk', fetch=_load_exchange_rates, publish=exchange_rates_cache.publish,
+                      prefetch=valute.halyk_fetcher.prefetch),
+        RefreshSource('bio', fetch=_load_bio_exchange_rates, publish=bio_rates_cache.publish,
+                      prefetch=valute_bio.bio_fetcher.prefetch)
+    ],
+    leader=rate_store.LeaderLock(),
+    follow=_follow_shared_rates
+)
+
+def start_rate_refresher():
+    """
+    Запускает фоновое обновление курсов и переводит кэши в режим только чтения
+    Кэши сразу заполняются последним общим снимком, если он есть
+    """
+    _follow_shared_rates()
+    exchange_rates_cache.passive = True
+    bio_rates_cache.passive = True
+    rate_refresher.start()
 
 def update_exchange_rates():
     """
-    Обновляет курсы валют через valute.py и перезагружает info.py
+    Возвращает актуальные курсы валют (из кэша, обновляет по истечении TTL)
     """
-    try:
-        # Запускаем обновление курсов
-        valute.valute()
-        
-        # Перезагружаем модуль info для получения обновленных курсов
-        importlib.reload(info)
-        
-        print(f"Курсы валют обновлены: {info.exchange_rates}")
-        return info.exchange_rates
-    except Exception as e:
-        print(f"Ошибка обновления курсов валют: {e}")
-        return info.exchange_rates
+    return exchange_rates_cache.get()
 
 def update_bio_exchange_rates():
     """
-    Обновляет курсы валют BIO и конвертирует их в тенге
+    Возвращает курсы валют BIO в тенге (из кэша, обновляет по истечении TTL)
     """
-    try:
-        # Получаем BIO курсы в тенге
-        bio_rates_tenge = valute_bio.get_bio_rates_in_tenge()
-        
-        print(f"BIO курсы в тенге обновлены: {bio_rates_tenge}")
-        return bio_rates_tenge
-    except Exception as e:
-        print(f"Ошибка обновления BIO курсов: {e}")
-        # Возвращаем значения по умолчанию
-        return {'USD': 93.0, 'EUR': 109.0}
+    return bio_rates_cache.get()
+
+# Каждый опубликованный снимок курсов сохраняется в историю курсов,
+# расчеты ссылаются на действующий снимок (rate_snapshot_id)
+rate_store.set_history(storage.save_rate_snapshot)
+
+def current_rate_snapshot_id():
+    """id снимка курсов в истории, действующего сейчас (None, если не сохранялся)"""
+    return rate_store.load().get('snapshot_id')
+
+# Кэш одиночных расчетов (ключ включает версии курсов Halyk и BIO)
+quote_cache = QuoteCache()
+
+def write_history_batch(rows):
+    """Сохраняет строки истории одной транзакцией (с замером времени записи)"""
+    with metrics.stage('db_write'):
+        storage.save_calculations(rows)
+    metrics.inc('bio_history_rows_total', len(rows))
 
-def calculate_delivery_cost(weight_kg, volume_m3, params):
+# Отложенная запись истории: ответ на расчет не ждет записи на диск
+history_writer = HistoryWriter(write_history_batch)
+
+def calculation_row(quote, plan, rate_snapshot_id=None):
     """
-    Рассчитывает стоимость доставки с настраиваемыми параметрами
-    Точное соответствие оригинальному скрипту
+    Строка истории (storage.CALCULATION_COLUMNS) для результата quote_item():
+    наименование, финальная цена, id снимка курсов, исходные данные товара,
+    тарифный план и промежуточные результаты. Вместо id набора параметров
+    в строке остается план: набор сохраняется при записи строки
+    (в потоке записи истории), а не в обработчике запроса
     """
-    # Объемный вес = объем * 200 (как в оригинале)
-    volumetric_weight = volume_m3 * params.get('volumetricFactor', 200)
-    
-    # Выбираем больший вес для расчета (как в оригинале)
-    delivery_weight = max(weight_kg, volumetric_weight)
-    
-    if delivery_weight <= 30:
-        # До 30 кг: 9000 + 12000 + (26*450) + 5000 = 37,700 тг
-        return params.get('delivery30', 37700)
-        
-    elif delivery_weight <= 300:
-        # 30-300 кг: 9000 + (вес-30)*215 + 12000 + (вес-30)*27 + 26*450 + 5000 + (вес-30)*19
-        excess_weight = delivery_weight - 30
-        warehouse_total = params.get('warehouseCount', 26) * params.get('warehouseRate', 400)
-        return (params.get('base30', 7500) + 
-                (excess_weight * params.get('rate30', 179)) + 
-                params.get('pickup30', 10000) + 
-                (excess_weight * params.get('pickupRate30', 20)) + 
-                warehouse_total +  # 26*400 = 10400
-                params.get('deliveryCity30', 4000) + 
-                (excess_weight * params.get('cityRate30', 15)))
-                
-    elif delivery_weight <= 1000:
-        # 300-1000 кг: сумма трех компонентов (как в оригинале)
-        excess_300 = delivery_weight - 300
-        excess_1000 = max(0, delivery_weight - 1000)
-        warehouse_total = params.get('warehouseCount', 26) * params.get('warehouseRate', 400)
-        
-        # Компонент 1: город+город
-        component1 = (params.get('base30', 7500) + 
-                   (270 * params.get('rate30', 179)) +  # 270 = 300 - 30
-                   (excess_300 * params.get('rate300', 164)) + 
-                   (excess_1000 * params.get('rate1000', 143)))
-        
-        # Компонент 2: забор склад БИО
-        component2 = (params.get('pickup30', 10000) + 
-                   (270 * params.get('pickupRate30', 20)) +  # 270 = 300 - 30
-                   (excess_300 * 15) + excess_1000 + 
-                   warehouse_total)  # 26*400 = 10400
-        
-        # Компонент 3: доставка по Астане
-        component3 = (params.get('deliveryCity30', 4000) + 
-                   (270 * params.get('cityRate30', 15)) +  # 270 = 300 - 30
-                   (excess_300 * 2) + (excess_1000 * 9) + 
-                   warehouse_total)  # 26*400 = 10400
-        
-        return component1 + component2 + component3
-        
-    else:
-        # Свыше 1000 кг - используем формулу для 1000 кг (без рекурсии, как в оригинале)
-        excess_300 = 700  # 1000 - 300
-        excess_1000 = 0   # 1000 - 1000 = 0
-        warehouse_total = params.get('warehouseCount', 26) * params.get('warehouseRate', 400)
-        
-        # Компонент 1: город+город
-        component1 = (params.get('base30', 7500) + 
-                     (270 * params.get('rate30', 179)) +  # 270 = 300 - 30
-                     (excess_300 * params.get('rate300', 164)) + 
-                     (excess_1000 * params.get('rate1000', 143)))
-                     
-        # Компонент 2: забор склад БИО
-        component2 = (params.get('pickup30', 10000) + 
-                     (270 * params.get('pickupRate30', 20)) +  # 270 = 300 - 30
-                     (excess_300 * 15) + excess_1000 + 
-                     warehouse_total)  # 26*400 = 10400
-                     
-        # Компонент 3: доставка по Астане
-        component3 = (params.get('deliveryCity30', 4000) + 
-                     (270 * params.get('cityRate30', 15)) +  # 270 = 300 - 30
-                     (excess_300 * 2) + (excess_1000 * 9) + 
-                     warehouse_total)  # 26*400 = 10400
-        
-        return component1 + component2 + component3
-
-def calculate_volume_from_dimensions(length, width, height):
-    """
-    Рассчитывает объем из габаритов
-    length, width, height - размеры в мм
-    возвращает объем в м³
-    """
-    if length <= 0 or width <= 0 or height <= 0:
-        return 0
-    
-    try:
-        # Преобразуем мм в метры и рассчитываем объем
-        length_m = length / 1000
-        width_m = width / 1000
-        height_m = height / 1000
-        volume = length_m * width_m * height_m
-        return volume
-    except (ValueError, IndexError):
-        return 0
+    return (
+        quote['productName'], quote['finalPrice'], rate_snapshot_id,
+        quote['originalPrice'], quote['currency'], quote['weight'],
+        quote['length'], quote['width'], quote['height'],
+        plan, quote['volume'], quote['deliveryWeight'],
+        quote['deliveryCost'], quote['exchangeRate'], quote['convertedPrice'],
+        quote['priceWithDelivery']
+    )
 
-def save_calculation_to_db(product_name, final_price):
+def save_calculation_to_db(quote, plan, rate_snapshot_id=None):
     """
     Сохраняет результаты расчета в базу данных SQLite3
-    Только: наименование товара, финальная цена, дата расчета
+    Наименование товара, финальная цена, дата расчета, id снимка курсов,
+    исходные данные товара, параметры формулы и промежуточные результаты
     """
     try:
-        conn = sqlite3.connect('/var/data/calculations.db')
-        cursor = conn.cursor()
-        
-        # Создаем таблицу если её нет
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS calculations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_name TEXT NOT NULL,
-                final_price REAL NOT NULL,
-                calculation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Вставляем данные расчета
-        cursor.execute('''
-            INSERT INTO calculations (product_name, final_price)
-            VALUES (?, ?)
-        ''', (product_name, final_price))
+        # Запись выполняется фоновым потоком пачками
+        history_writer.submit([calculation_row(quote, plan, rate_snapshot_id)])
         
-        conn.commit()
-        conn.close()
-        
-        print(f"✅ Расчет сохранен в базу: {product_name} - {final_price} KZT")
+        print(f"✅ Расчет поставлен в очередь сохранения: {quote['productName']} - {quote['finalPrice']} KZT")
         
     except Exception as e:
         print(f"❌ Ошибка сохранения в базу: {e}")
         # Не прерываем выполнение при ошибке сохранения
 
+def save_calculations_to_db(rows):
+    """
+    Сохраняет пакет расчетов в базу данных одной транзакцией
+    rows - список строк calculation_row()
+    """
+    if not rows:
+        return
+    
+    try:
+        write_history_batch(rows)
+        
+        print(f"✅ Пакет расчетов сохранен в базу: {len(rows)} строк")
+        
+    except Exception as e:
+        print(f"❌ Ошибка сохранения пакета в базу: {e}")
+
+# Страница интерфейса сжимается один раз при запуске, а не на каждый запрос
+index_page = StaticAsset(os.path.join(app.root_path, 'index.html'), 'text/html')
+try:
+    index_page.load()
+except OSError as e:
+    print(f"⚠️ Страница интерфейса недоступна: {e}")
+
 @app.route('/')
 def index():
-    return send_from_directory('.', 'index.html')
+    try:
+        return index_page.response(request)
+    except FileNotFoundError:
+        return jsonify({
+            'error': 'Страница интерфейса не найдена'
+        }), 404
+
+@app.route('/healthz')
+def healthz():
+    """
+    Проверка работоспособности для балансировщика: доступность базы
+    и свежесть снимка курсов, без обращения к внешним источникам
+    Устаревшие курсы не считаются отказом (источники могут быть недоступны),
+    503 - только если недоступна база
+    """
+    snapshot = rate_store.load()
+    fetched_at = snapshot['fetched_at']
+    rates_age = time.time() - fetched_at if fetched_at else None
+    
+    try:
+        storage.ping()
+        database = {'ok': True}
+    except Exception as e:
+        database = {'ok': False, 'error': str(e)}
+    
+    response = jsonify({
+        'status': 'ok' if database['ok'] else 'error',
+        'database': database,
+        'rates': {
+            'version': snapshot['version'],
+            'snapshotId': snapshot.get('snapshot_id'),
+            'ageSeconds': round(rates_age, 1) if rates_age is not None else None,
+            'fresh': rates_age is not None and rates_age <= HEALTH_RATES_MAX_AGE
+        },
+        'rateRefresher': rate_refresher.running,
+        'historyWriter': history_writer.running,
+        'timestamp': datetime.now().isoformat()
+    })
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if database['ok'] else 503
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _observe_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint not in (None, 'static', 'get_metrics'):
+        metrics.observe('bio_http_request_duration_seconds', time.perf_counter() - started,
+                        endpoint=request.endpoint)
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """
+    Метрики в формате Prometheus: время этапов расчета, запросы к источникам
+    курсов, кэш расчетов, запись истории и выгрузка отчетов (по всем воркерам)
+    """
+    snapshot = rate_store.load()
+    fetched_at = snapshot['fetched_at']
+    text = metrics.render({
+        'bio_rate_snapshot_age_seconds': time.time() - fetched_at if fetched_at else None,
+        'bio_rate_snapshot_version': snapshot['version']
+    })
+    return Response(text, content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/api/exchange-rates')
 def get_exchange_rates():
-    """API для получения курсов валют из info.py"""
+    """API для получения курсов валют из хранилища курсов"""
     try:
-        # Обновляем курсы валют при каждом запросе
+        # Курсы из кэша (обновляются по истечении TTL)
         current_rates = update_exchange_rates()
+        snapshot = rate_store.load()
         
         return jsonify({
             'rates': current_rates,
+            'version': snapshot['version'],
+            'fetchedAt': snapshot['fetched_at'],
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -235,7 +305,7 @@ def get_exchange_rates():
 def get_bio_exchange_rates():
     """API для получения курсов валют BIO в тенге"""
     try:
-        # Обновляем BIO курсы валют при каждом запросе
+        # BIO курсы из кэша (обновляются по истечении TTL)
         bio_rates = update_bio_exchange_rates()
         
         return jsonify({
@@ -250,125 +320,268 @@ def get_bio_exchange_rates():
 
 @app.route('/api/formula-params')
 def get_formula_params():
-    """API для получения параметров формулы по умолчанию"""
+    """API для получения действующих параметров формулы и номера их версии"""
+    version, plan = tariff_store.current()
     return jsonify({
-        'params': DEFAULT_FORMULA_PARAMS,
+        'params': plan.params,
+        'version': version,
         'timestamp': datetime.now().isoformat()
     })
 
+def _json_body(default=None):
+    """
+    Тело запроса как JSON-объект
+    Пустое тело - default, тело не JSON или не объект - None (ответ 400)
+    """
+    if default is not None and not request.get_data(cache=True):
+        return default
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+def _bad_body():
+    return jsonify({
+        'error': 'Тело запроса должно быть JSON-объектом'
+    }), 400
+
 @app.route('/api/calculate-price', methods=['POST'])
 def calculate_price():
     """API для расчета стоимости товара с настраиваемыми параметрами"""
     try:
-        data = request.get_json()
-        
-        # Получаем данные из запроса
-        product_name = data.get('productName', 'Неизвестный товар')
-        original_price = float(data.get('originalPrice', 0))
-        currency = data.get('currency', 'KZT')
-        weight = float(data.get('weight', 0))
-        dimensions_data = data.get('dimensions', {})
-        length = float(dimensions_data.get('length', 0))
-        width = float(dimensions_data.get('width', 0))
-        height = float(dimensions_data.get('height', 0))
+        data = _json_body()
+        if data is None:
+            return _bad_body()
         
         # Получаем настраиваемые параметры формулы
         formula_params = data.get('formulaParams', {})
         
         # Валидация данных
-        if not product_name or original_price <= 0 or not currency or weight <= 0 or length <= 0 or width <= 0 or height <= 0:
+        try:
+            item = parse_item(data)
+        except ValueError as e:
             return jsonify({
-                'error': 'Неверные данные. Проверьте все поля товара.'
+                'error': str(e)
             }), 400
         
-        # Расчет объема
-        volume = calculate_volume_from_dimensions(length, width, height)
-        if volume == 0:
+        # Получаем актуальные курсы валют из кэша вместе с их версиями
+        current_rates, rates_version = exchange_rates_cache.get_versioned()
+        bio_rates, bio_rates_version = {}, 0
+        if item['currency'] in ['EUR', 'USD']:
+            bio_rates, bio_rates_version = bio_rates_cache.get_versioned()
+        
+        try:
+            plan = tariff_store.plan_for(formula_params)
+            # Повторный расчет с теми же данными и курсами берется из кэша
+            cache_key = quote_key(item, plan, (rates_version, bio_rates_version))
+            quote = quote_cache.get(cache_key)
+            cached = quote is not None
+            metrics.inc('bio_quote_cache_total', result='hit' if cached else 'miss')
+            if not cached:
+                with metrics.stage('quote_compute', mode='single'):
+                    quote = quote_item(item, plan, current_rates, bio_rates)
+                quote_cache.put(cache_key, quote)
+        except ValueError as e:
             return jsonify({
-                'error': 'Неверные данные габаритов. Проверьте длину, ширину и высоту.'
+                'error': str(e)
             }), 400
         
-        # Обновляем курсы валют и получаем актуальные
-        current_rates = update_exchange_rates()
+        if item['currency'] in ['EUR', 'USD'] and not cached:
+            print(f"🔄 Двухэтапная конвертация {item['currency']}: {item['originalPrice']} → {quote['exchangeRate']} тенге")
         
-        # Расчет стоимости доставки
-        delivery_cost = calculate_delivery_cost(weight, volume, formula_params)
+        # Сохраняем расчет в базу данных (повтор из кэша - по настройке)
+        if not (cached and SKIP_DUPLICATE_QUOTE_HISTORY):
+            save_calculation_to_db(quote, plan, rate_snapshot_id=current_rate_snapshot_id())
         
-        # Получение курса валюты из обновленных данных
-        exchange_rate = current_rates.get(currency, 1)
+        original_price = quote['originalPrice']
+        used_rate = quote['exchangeRate']
+        divider, multiplier, nds = quote['divider'], quote['multiplier'], quote['nds']
+        converted_price = quote['convertedPrice']
+        delivery_cost = quote['deliveryCost']
+        price_with_delivery = quote['priceWithDelivery']
+        final_price = quote['finalPrice']
         
-        # Применение настраиваемой формулы: (X/divider * курс * multiplier + доставка) * nds
-        divider = formula_params.get('divider', 1.22)
-        multiplier = formula_params.get('multiplier', 1.16)
-        nds = formula_params.get('nds', 1.16)
+        result = format_quote(quote)
+        result['formulaParams'] = formula_params
+        result['calculationSteps'] = {
+            'step1': f'Конвертация: {original_price} / {divider} × {used_rate} × {multiplier} = {converted_price:.2f}',
+            'step2': f'Добавление доставки: {converted_price:.2f} + {delivery_cost:.2f} = {price_with_delivery:.2f}',
+            'step3': f'НДС: {price_with_delivery:.2f} × {nds} = {final_price:.2f}'
+        }
+        return jsonify(result)
         
-        # Двухэтапная конвертация для BIO товаров (EUR/USD → RUB → KZT)
-        if currency in ['EUR', 'USD']:
-            # Этап 1: Получаем BIO курсы (в тенге, уже конвертированные)
-            bio_rates = update_bio_exchange_rates()
-            bio_rate = bio_rates.get(currency, exchange_rate)
-            
-            # Этап 2: Используем BIO курс для конвертации
-            converted_price = original_price / divider * bio_rate * multiplier
-            print(f"🔄 Двухэтапная конвертация {currency}: {original_price} → {bio_rate} тенге")
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка расчета: {str(e)}'
+        }), 500
+
+@app.route('/api/quote-cache')
+def get_quote_cache_stats():
+    """API для получения статистики кэша расчетов (попадания и промахи)"""
+    return jsonify({
+        'stats': quote_cache.stats(),
+        'skipDuplicateHistory': SKIP_DUPLICATE_QUOTE_HISTORY,
+        'timestamp': datetime.now().isoformat()
+    })
+
+def _read_batch_upload(upload):
+    """
+    Читает товары из загруженного CSV/XLSX файла
+    Первая строка - заголовки: productName, originalPrice, currency,
+    weight, length, width, height
+    """
+    filename = (upload.filename or '').lower()
+    
+    if filename.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(BytesIO(upload.read()), read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(value).strip() if value is not None else '' for value in next(rows, ())]
+        items = [dict(zip(headers, row)) for row in rows if any(value is not None for value in row)]
+        workbook.close()
+        return items
+    
+    if filename.endswith('.csv'):
+        text = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        return [
+            {key.strip(): value for key, value in row.items() if key}
+            for row in csv.DictReader(text)
+        ]
+    
+    raise ValueError('Поддерживаются только файлы CSV и XLSX')
+
+def _quote_batch(items, plan, current_rates, bio_rates, rate_snapshot_id=None):
+    """
+    Рассчитывает товары пакета, ошибки валидации возвращаются по каждому товару
+    Товары с общим тарифным планом считаются векторно (numpy),
+    товары со своими formulaParams - по одному (параметры товара
+    дополняются параметрами пакета)
+    Возвращает (результаты для ответа, строки для истории)
+    """
+    results = [None] * len(items)
+    quotes = [None] * len(items)
+    plans = [plan] * len(items)
+    batch_indexes = []
+    batch_items = []
+    for index, data in enumerate(items):
+        try:
+            item = parse_item(data)
+            if data.get('formulaParams') or not NUMPY_AVAILABLE:
+                item_plan = get_tariff_plan(data['formulaParams'], base=plan.params) if data.get('formulaParams') else plan
+                quotes[index] = quote_item(item, item_plan, current_rates, bio_rates)
+                plans[index] = item_plan
+            else:
+                batch_indexes.append(index)
+                batch_items.append(item)
+        except (ValueError, TypeError, AttributeError) as e:
+            results[index] = {'index': index, 'error': str(e)}
+    
+    if batch_items:
+        with metrics.stage('quote_compute', mode='batch'):
+            batch_quotes = quote_items_vectorized(batch_items, plan, current_rates, bio_rates)
+        for index, quote in zip(batch_indexes, batch_quotes):
+            if isinstance(quote, ValueError):
+                results[index] = {'index': index, 'error': str(quote)}
+            else:
+                quotes[index] = quote
+    
+    history_rows = []
+    for index, quote in enumerate(quotes):
+        if quote is None:
+            continue
+        result = format_quote(quote)
+        result['index'] = index
+        results[index] = result
+        history_rows.append(calculation_row(quote, plans[index], rate_snapshot_id))
+    return results, history_rows
+
+@app.route('/api/calculate-prices', methods=['POST'])
+def calculate_prices():
+    """
+    API для пакетного расчета стоимости товаров
+    JSON: {"items": [...], "formulaParams": {...}} или файл CSV/XLSX (поле file)
+    Курсы берутся один раз на весь пакет, история сохраняется одной транзакцией.
+    С параметром ?stream=1 ответ отдается построчно (NDJSON) частями по BATCH_CHUNK_SIZE.
+    """
+    try:
+        if 'file' in request.files:
+            items = _read_batch_upload(request.files['file'])
+            formula_params = json.loads(request.form.get('formulaParams') or '{}')
         else:
-            # Обычная конвертация для других валют
-            converted_price = original_price / divider * exchange_rate * multiplier
-        price_with_delivery = converted_price + delivery_cost
-        final_price = price_with_delivery * nds
-        
-        # Расчет веса для доставки
-        volumetric_factor = formula_params.get('volumetricFactor', 200)
-        delivery_weight = max(weight, volume * volumetric_factor)
-        
-        # Сохраняем расчет в базу данных
-        save_calculation_to_db(
-            product_name=product_name,
-            final_price=final_price
-        )
+            data = _json_body()
+            if data is None:
+                return _bad_body()
+            items = data.get('items')
+            formula_params = data.get('formulaParams', {})
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'error': 'Необходимо передать список товаров (items) или файл CSV/XLSX'
+            }), 400
+        if len(items) > MAX_BATCH_ITEMS:
+            return jsonify({
+                'error': f'Слишком много товаров в пакете (максимум {MAX_BATCH_ITEMS})'
+            }), 400
         
-        # Определяем, какой курс использовался
-        used_rate = bio_rate if currency in ['EUR', 'USD'] else exchange_rate
-        rate_source = "BIO (двухэтапная конвертация)" if currency in ['EUR', 'USD'] else "МИГ.кз (прямая конвертация)"
+        # Тарифный план и курсы один раз на весь пакет
+        plan = tariff_store.plan_for(formula_params)
+        current_rates = update_exchange_rates()
+        bio_rates = update_bio_exchange_rates()
+        rate_snapshot_id = current_rate_snapshot_id()
+        
+        if request.args.get('stream') == '1':
+            def generate():
+                # История сохраняется отдельной транзакцией на каждую часть,
+                # чтобы не держать блокировку записи SQLite весь ответ
+                for start in range(0, len(items), BATCH_CHUNK_SIZE):
+                    chunk = items[start:start + BATCH_CHUNK_SIZE]
+                    results, history_rows = _quote_batch(chunk, plan, current_rates, bio_rates, rate_snapshot_id)
+                    save_calculations_to_db(history_rows)
+                    for result in results:
+                        result['index'] += start
+                        yield json.dumps(result, ensure_ascii=False) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        results, history_rows = _quote_batch(items, plan, current_rates, bio_rates, rate_snapshot_id)
+        save_calculations_to_db(history_rows)
         
         return jsonify({
-            'productName': product_name,
-            'originalPrice': original_price,
-            'currency': currency,
-            'exchangeRate': used_rate,
-            'rateSource': rate_source,
-            'convertedPrice': round(converted_price, 2),
-            'volume': round(volume, 4),
-            'deliveryWeight': round(delivery_weight, 2),
-            'deliveryCost': round(delivery_cost, 2),
-            'priceWithDelivery': round(price_with_delivery, 2),
-            'finalPrice': round(final_price, 2),
-            'formulaParams': formula_params,
-            'calculationSteps': {
-                'step1': f'Конвертация: {original_price} / {divider} × {used_rate} × {multiplier} = {converted_price:.2f}',
-                'step2': f'Добавление доставки: {converted_price:.2f} + {delivery_cost:.2f} = {price_with_delivery:.2f}',
-                'step3': f'НДС: {price_with_delivery:.2f} × {nds} = {final_price:.2f}'
-            }
+            'results': results,
+            'total': len(results),
+            'succeeded': len(history_rows),
+            'failed': len(results) - len(history_rows),
+            'timestamp': datetime.now().isoformat()
         })
         
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({
+            'error': f'Неверные данные пакета: {str(e)}'
+        }), 400
     except Exception as e:
         return jsonify({
-            'error': f'Ошибка расчета: {str(e)}'
+            'error': f'Ошибка пакетного расчета: {str(e)}'
         }), 500
 
 @app.route('/api/update-formula-params', methods=['POST'])
 def update_formula_params():
     """API для обновления параметров формулы"""
     try:
-        data = request.get_json()
+        data = _json_body()
+        if data is None:
+            return _bad_body()
         new_params = data.get('params', {})
         
-        global DEFAULT_FORMULA_PARAMS
-        DEFAULT_FORMULA_PARAMS.update(new_params)
+        # Параметры проверяются до публикации, новая версия видна всем воркерам
+        try:
+            version, plan = tariff_store.publish(new_params)
+        except ValueError as e:
+            return jsonify({
+                'error': str(e)
+            }), 400
         
         return jsonify({
             'message': 'Параметры формулы обновлены',
-            'params': DEFAULT_FORMULA_PARAMS,
+            'params': plan.params,
+            'version': version,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -379,33 +592,48 @@ def update_formula_params():
 
 @app.route('/api/calculation-history')
 def get_calculation_history():
-    """API для получения истории расчетов из базы данных"""
+    """
+    API для получения истории расчетов из базы данных
+    Постраничный вывод: ?limit=50&before=<nextCursor предыдущей страницы>
+    """
     try:
-        conn = sqlite3.connect('/var/data/calculations.db')
-        cursor = conn.cursor()
+        limit = request.args.get('limit', 50, type=int)
+        if limit <= 0 or limit > MAX_HISTORY_LIMIT:
+            return jsonify({
+                'error': f'Параметр limit должен быть от 1 до {MAX_HISTORY_LIMIT}'
+            }), 400
         
-        # Получаем последние 50 расчетов, отсортированных по дате
-        cursor.execute('''
-            SELECT id, product_name, final_price, calculation_date
-            FROM calculations 
-            ORDER BY calculation_date DESC 
-            LIMIT 50
-        ''')
+        # Курсор "дата|id" последней строки предыдущей страницы
+        before = request.args.get('before')
+        if before:
+            try:
+                before_date, before_id = before.rsplit('|', 1)
+                before = (before_date, int(before_id))
+            except ValueError:
+                return jsonify({
+                    'error': 'Неверный курсор страницы (before)'
+                }), 400
         
+        # Расчеты, отсортированные по дате (новые первыми)
         calculations = []
-        for row in cursor.fetchall():
+        for row in storage.fetch_history(limit, before or None):
             calculations.append({
                 'id': row[0],
                 'productName': row[1],
                 'finalPrice': row[2],
-                'calculationDate': row[3]
+                'calculationDate': row[3],
+                'rateSnapshotId': row[4]
             })
         
-        conn.close()
+        next_cursor = None
+        if len(calculations) == limit:
+            last = calculations[-1]
+            next_cursor = f"{last['calculationDate']}|{last['id']}"
         
         return jsonify({
             'calculations': calculations,
             'total': len(calculations),
+            'nextCursor': next_cursor,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -414,11 +642,149 @@ def get_calculation_history():
             'error': f'Ошибка получения истории: {str(e)}'
         }), 500
 
+@app.route('/api/calculation-history/search')
+def search_calculation_history():
+    """
+    API для поиска расчетов по наименованию товара (полнотекстовый индекс)
+    ?q=проб вак - слова ищутся как префиксы (автодополнение), новые первыми
+    Фильтры: startDate, endDate (ГГГГ-ММ-ДД), minPrice, maxPrice
+    Постраничный вывод: ?limit=50&before=<nextCursor предыдущей страницы>
+    """
+    try:
+        text = request.args.get('q', '').strip()
+        if not storage.search_query(text):
+            return jsonify({
+                'error': 'Необходимо указать текст поиска (q)'
+            }), 400
+        
+        limit = request.args.get('limit', 50, type=int)
+        if limit <= 0 or limit > MAX_HISTORY_LIMIT:
+            return jsonify({
+                'error': f'Параметр limit должен быть от 1 до {MAX_HISTORY_LIMIT}'
+            }), 400
+        
+        # Курсор - id последней строки предыдущей страницы, цены - числа
+        filters = {}
+        for arg, name, convert in (('before', 'before', int),
+                                   ('minPrice', 'min_price', float),
+                                   ('maxPrice', 'max_price', float)):
+            value = request.args.get(arg)
+            if value:
+                try:
+                    filters[name] = convert(value)
+                except ValueError:
+                    return jsonify({
+                        'error': f'Неверное значение параметра {arg}'
+                    }), 400
+        
+        try:
+            rows = storage.search_calculations(
+                text, limit,
+                start_date=request.args.get('startDate') or None,
+                end_date=request.args.get('endDate') or None,
+                **filters
+            )
+        except ValueError:
+            return jsonify({
+                'error': 'Даты должны быть в формате ГГГГ-ММ-ДД'
+            }), 400
+        
+        calculations = []
+        for row in rows:
+            calculations.append({
+                'id': row[0],
+                'productName': row[1],
+                'finalPrice': row[2],
+                'calculationDate': row[3],
+                'rateSnapshotId': row[4]
+            })
+        
+        next_cursor = None
+        if len(calculations) == limit:
+            next_cursor = str(calculations[-1]['id'])
+        
+        return jsonify({
+            'query': text,
+            'calculations': calculations,
+            'total': len(calculations),
+            'nextCursor': next_cursor,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка поиска расчетов: {str(e)}'
+        }), 500
+
+@app.route('/api/calculation-history/<int:calculation_id>')
+def get_calculation(calculation_id):
+    """
+    API для получения сохраненного расчета целиком: исходные данные,
+    промежуточные результаты, параметры формулы и шаги расчета (без пересчета)
+    """
+    try:
+        row = storage.fetch_calculation(calculation_id)
+        if row is None:
+            return jsonify({
+                'error': 'Расчет не найден'
+            }), 404
+        
+        calculation = {
+            'id': row['id'],
+            'productName': row['product_name'],
+            'finalPrice': row['final_price'],
+            'calculationDate': row['calculation_date'],
+            'rateSnapshotId': row['rate_snapshot_id']
+        }
+        # Расчеты, сохраненные до появления полной записи, содержат только итог
+        if row['tariff_params_id'] is not None:
+            formula_params = storage.fetch_tariff_params(row['tariff_params_id'])
+            converted_price = row['converted_price']
+            delivery_cost = row['delivery_cost']
+            price_with_delivery = row['price_with_delivery']
+            calculation.update({
+                'originalPrice': row['original_price'],
+                'currency': row['currency'],
+                'weight': row['weight_kg'],
+                'dimensions': {
+                    'length': row['length_mm'],
+                    'width': row['width_mm'],
+                    'height': row['height_mm']
+                },
+                'exchangeRate': row['exchange_rate'],
+                'convertedPrice': round(converted_price, 2),
+                'volume': round(row['volume_m3'], 4),
+                'deliveryWeight': round(row['delivery_weight_kg'], 2),
+                'deliveryCost': round(delivery_cost, 2),
+                'priceWithDelivery': round(price_with_delivery, 2),
+                'formulaParams': formula_params,
+                'calculationSteps': {
+                    'step1': f"Конвертация: {row['original_price']} / {formula_params['divider']} × {row['exchange_rate']} × {formula_params['multiplier']} = {converted_price:.2f}",
+                    'step2': f'Добавление доставки: {converted_price:.2f} + {delivery_cost:.2f} = {price_with_delivery:.2f}',
+                    'step3': f"НДС: {price_with_delivery:.2f} × {formula_params['nds']} = {row['final_price']:.2f}"
+                }
+            })
+        
+        return jsonify({
+            'calculation': calculation,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка получения расчета: {str(e)}'
+        }), 500
+
 @app.route('/api/download-report', methods=['POST'])
 def download_report():
-    """API для скачивания отчета в Excel по выбранному диапазону дат"""
+    """
+    API для скачивания отчета в Excel по выбранному диапазону дат
+    {"format": "csv"} - потоковая выгрузка в CSV (также используется без openpyxl)
+    """
     try:
-        data = request.get_json()
+        data = _json_body()
+        if data is None:
+            return _bad_body()
         start_date = data.get('startDate')
         end_date = data.get('endDate')
         
@@ -427,143 +793,377 @@ def download_report():
                 'error': 'Необходимо указать начальную и конечную дату'
             }), 400
         
-        # Получаем данные за выбранный период
-        query = '''
-            SELECT product_name, final_price, calculation_date
-            FROM calculations 
-            WHERE DATE(calculation_date) BETWEEN ? AND ?
-            ORDER BY calculation_date DESC
-        '''
+        try:
+            row_count, max_name_length = storage.fetch_report_stats(start_date, end_date)
+        except ValueError:
+            return jsonify({
+                'error': 'Даты должны быть в формате ГГГГ-ММ-ДД'
+            }), 400
         
-        if PANDAS_AVAILABLE:
-            # Подключаемся к базе данных для pandas
-            conn = sqlite3.connect('/var/data/calculations.db')
-            df = pd.read_sql_query(query, conn, params=[start_date, end_date])
-            conn.close()
-
+        if row_count == 0:
+            return jsonify({
+                'error': 'За выбранный период данных не найдено'
+            }), 404
         
-        if PANDAS_AVAILABLE:
-            if df.empty:
-                return jsonify({
-                    'error': 'За выбранный период данных не найдено'
-                }), 404
-            
-            # Переименовываем колонки для красивого отображения
-            df.columns = ['Наименование товара', 'Финальная цена (KZT)', 'Дата расчета']
-            
-            # Форматируем дату
-            df['Дата расчета'] = pd.to_datetime(df['Дата расчета']).dt.strftime('%d.%m.%Y %H:%M')
-            
-            # Форматируем цену
-            df['Финальная цена (KZT)'] = df['Финальная цена (KZT)'].round(2)
-            
-            # Создаем Excel файл в памяти
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Отчет по расчетам', index=False)
-                
-                # Получаем рабочий лист для форматирования
-                worksheet = writer.sheets['Отчет по расчетам']
-                
-                # Автоматически подгоняем ширину колонок
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            output.seek(0)
-            
-            # Формируем имя файла с датами
-            start_date_formatted = start_date.replace('-', '.')
-            end_date_formatted = end_date.replace('-', '.')
-            filename = f'Отчет_расчетов_{start_date_formatted}-{end_date_formatted}.xlsx'
-            
+        # Формируем имя файла с датами
+        start_date_formatted = start_date.replace('-', '.')
+        end_date_formatted = end_date.replace('-', '.')
+        filename = f'Отчет_расчетов_{start_date_formatted}-{end_date_formatted}'
+        
+        if data.get('format') != 'csv' and OPENPYXL_AVAILABLE:
+            with metrics.stage('report_export', format='xlsx'):
+                output = reports.write_xlsx_report(start_date, end_date, max_name_length)
             return send_file(
                 output,
                 mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
                 as_attachment=True,
-                download_name=filename
+                download_name=f'{filename}.xlsx'
             )
+        
+        # CSV отдается по частям, по мере чтения строк из базы
+        response = Response(
+            stream_with_context(metrics.timed_iter(reports.iter_csv_report(start_date, end_date),
+                                                   'report_export', format='csv')),
+            content_type='text/csv; charset=utf-8'
+        )
+        response.headers['Content-Disposition'] = (
+            f"attachment; filename=report.csv; filename*=UTF-8''{url_quote(filename)}.csv"
+        )
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка создания отчета: {str(e)}'
+        }), 500
 
-        else:
-            # Альтернативный способ без pandas - CSV
-            conn = sqlite3.connect('/var/data/calculations.db')
-            cursor = conn.cursor()
-            cursor.execute(query, [start_date, end_date])
-            rows = cursor.fetchall()
-            conn.close()
-            
-            if not rows:
+def _reprice_job_json(job):
+    total = job['total']
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'params': job['params'],
+        'total': total,
+        'processed': job['processed'],
+        'progress': round(job['processed'] / total * 100, 1) if total else (100.0 if job['status'] == 'done' else 0.0),
+        'changed': job['changed'],
+        'oldTotal': round(job['old_total'], 2),
+        'newTotal': round(job['new_total'], 2),
+        'error': job['error'],
+        'createdAt': job['created_at'],
+        'finishedAt': job['finished_at']
+    }
+
+@app.route('/api/reprice-jobs', methods=['POST'])
+def create_reprice_job():
+    """
+    API для запуска пересчета сохраненных расчетов по новым тарифам и/или курсам
+    {"startDate", "endDate" (необязательно), "formulaParams": {...},
+     "rates": "current" | "original" | id снимка курсов}
+    Пересчет идет в фоне, ход работы - GET /api/reprice-jobs/<id>
+    """
+    try:
+        data = _json_body({})
+        if data is None:
+            return _bad_body()
+        start_date = data.get('startDate')
+        end_date = data.get('endDate')
+        rates_mode = data.get('rates', repricing.RATES_CURRENT)
+        
+        if bool(start_date) != bool(end_date):
+            return jsonify({
+                'error': 'Необходимо указать обе даты периода или ни одной'
+            }), 400
+        if start_date:
+            try:
+                storage.report_range(start_date, end_date)
+            except ValueError:
                 return jsonify({
-                    'error': 'За выбранный период данных не найдено'
-                }), 404
-            
-            # Создаем CSV файл в памяти
-            output = BytesIO()
-            writer = csv.writer(output)
-            
-            # Записываем заголовки
-            writer.writerow(['Наименование товара', 'Финальная цена (KZT)', 'Дата расчета'])
-            
-            # Записываем данные
-            for row in rows:
-                # Форматируем дату
-                try:
-                    date_obj = datetime.fromisoformat(row[2].replace('Z', '+00:00'))
-                    formatted_date = date_obj.strftime('%d.%m.%Y %H:%M')
-                except:
-                    formatted_date = row[2]
-                
-                # Форматируем цену
-                try:
-                    formatted_price = round(float(row[1]), 2)
-                except:
-                    formatted_price = row[1]
-                
-                writer.writerow([row[0], formatted_price, formatted_date])
-            
-            output.seek(0)
-            
-            # Формируем имя файла с датами
-            start_date_formatted = start_date.replace('-', '.')
-            end_date_formatted = end_date.replace('-', '.')
-            filename = f'Отчет_расчетов_{start_date_formatted}-{end_date_formatted}.csv'
-            
-            return send_file(
-                output,
-                mimetype='text/csv',
-                as_attachment=True,
-                download_name=filename
-            )
+                    'error': 'Даты должны быть в формате ГГГГ-ММ-ДД'
+                }), 400
+        
+        if rates_mode not in (repricing.RATES_CURRENT, repricing.RATES_ORIGINAL) and (
+                isinstance(rates_mode, bool) or not isinstance(rates_mode, int)):
+            return jsonify({
+                'error': 'Параметр rates должен быть "current", "original" или id снимка курсов'
+            }), 400
+        
+        try:
+            plan = tariff_store.plan_for(data.get('formulaParams'))
+            rates_for = repricing.make_rates_for(rates_mode, update_exchange_rates(), update_bio_exchange_rates())
+        except ValueError as e:
+            return jsonify({
+                'error': str(e)
+            }), 400
+        
+        params = {
+            'startDate': start_date,
+            'endDate': end_date,
+            'formulaParams': plan.params,
+            'rates': rates_mode
+        }
+        job_id = repricing.start_reprice_job(params, plan, rates_for, start_date, end_date)
+        
+        return jsonify({
+            'job': _reprice_job_json(storage.fetch_reprice_job(job_id)),
+            'timestamp': datetime.now().isoformat()
+        }), 202
         
     except Exception as e:
         return jsonify({
-            'error': f'Ошибка создания отчета: {str(e)}'
+            'error': f'Ошибка запуска пересчета: {str(e)}'
         }), 500
 
+@app.route('/api/reprice-jobs/<int:job_id>')
+def get_reprice_job(job_id):
+    """API для получения статуса и итогов задания пересчета"""
+    try:
+        job = storage.fetch_reprice_job(job_id)
+        if job is None:
+            return jsonify({
+                'error': 'Задание пересчета не найдено'
+            }), 404
+        
+        return jsonify({
+            'job': _reprice_job_json(job),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка получения задания пересчета: {str(e)}'
+        }), 500
+
+@app.route('/api/reprice-jobs/<int:job_id>/report')
+def download_reprice_report(job_id):
+    """API для скачивания отчета пересчета в CSV (старая и новая цена по каждому расчету)"""
+    try:
+        if storage.fetch_reprice_job(job_id) is None:
+            return jsonify({
+                'error': 'Задание пересчета не найдено'
+            }), 404
+        
+        response = Response(
+            stream_with_context(metrics.timed_iter(reports.iter_reprice_csv_report(job_id),
+                                                   'report_export', format='reprice_csv')),
+            content_type='text/csv; charset=utf-8'
+        )
+        filename = f'Пересчет_{job_id}'
+        response.headers['Content-Disposition'] = (
+            f"attachment; filename=reprice-{job_id}.csv; filename*=UTF-8''{url_quote(filename)}.csv"
+        )
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка создания отчета пересчета: {str(e)}'
+        }), 500
+
+def _rate_snapshot_json(snapshot):
+    return {
+        'id': snapshot['id'],
+        'version': snapshot['version'],
+        'fetchedAt': snapshot['fetched_at'],
+        'rates': snapshot['rates'],
+        'bioRates': snapshot['bio_rates'],
+        'bioRatesTenge': snapshot['bio_rates_tenge']
+    }
+
+@app.route('/api/rate-history')
+def get_rate_history():
+    """
+    API для получения снимка курсов из истории
+    ?id=<rateSnapshotId расчета> или ?at=<дата и время, UTC> - курсы на момент времени
+    """
+    try:
+        snapshot_id = request.args.get('id', type=int)
+        at = request.args.get('at')
+        
+        if snapshot_id is not None:
+            snapshot = storage.fetch_rate_snapshot(snapshot_id)
+        elif at:
+            try:
+                moment = datetime.fromisoformat(at.replace('Z', '+00:00'))
+            except ValueError:
+                return jsonify({
+                    'error': 'Параметр at должен быть датой в формате ISO (ГГГГ-ММ-ДД ЧЧ:ММ:СС)'
+                }), 400
+            # Время без часового пояса - UTC, как calculationDate в истории
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            snapshot = storage.rate_snapshot_at(moment.timestamp())
+        else:
+            return jsonify({
+                'error': 'Необходимо указать id снимка или момент времени (at)'
+            }), 400
+        
+        if snapshot is None:
+            return jsonify({
+                'error': 'Снимок курсов не найден'
+            }), 404
+        
+        return jsonify({
+            'snapshot': _rate_snapshot_json(snapshot),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка получения истории курсов: {str(e)}'
+        }), 500
+
+def _report_period_args():
+    """
+    Период отчета из ?startDate=&endDate= (YYYY-MM-DD)
+    Возвращает ((начало, конец), None) или (None, ответ с ошибкой)
+    """
+    start_date = request.args.get('startDate')
+    end_date = request.args.get('endDate')
+    if not start_date or not end_date:
+        return None, (jsonify({
+            'error': 'Необходимо указать начальную и конечную дату'
+        }), 400)
+    try:
+        storage.report_range(start_date, end_date)
+    except ValueError:
+        return None, (jsonify({
+            'error': 'Даты должны быть в формате ГГГГ-ММ-ДД'
+        }), 400)
+    return (start_date, end_date), None
+
+@app.route('/api/reports/summary')
+def get_report_summary():
+    """
+    Итоги по товарам за период из дневных агрегатов:
+    количество расчетов, сумма, средняя, минимальная, максимальная и последняя цена
+    """
+    try:
+        period, error = _report_period_args()
+        if error:
+            return error
+        
+        products = []
+        total_count = 0
+        total_sum = 0
+        for name, count, sum_price, min_price, max_price, last_price in storage.fetch_summary(*period):
+            products.append({
+                'productName': name,
+                'count': count,
+                'sumPrice': round(sum_price, 2),
+                'avgPrice': round(sum_price / count, 2),
+                'minPrice': round(min_price, 2),
+                'maxPrice': round(max_price, 2),
+                'lastPrice': round(last_price, 2)
+            })
+            total_count += count
+            total_sum += sum_price
+        
+        return jsonify({
+            'startDate': period[0],
+            'endDate': period[1],
+            'products': products,
+            'totalCount': total_count,
+            'totalSum': round(total_sum, 2),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка получения итогов: {str(e)}'
+        }), 500
+
+@app.route('/api/reports/trend')
+def get_report_trend():
+    """
+    Динамика расчетов по дням за период из дневных агрегатов
+    ?productName= - только по одному товару
+    """
+    try:
+        period, error = _report_period_args()
+        if error:
+            return error
+        
+        days = []
+        for day, count, sum_price, min_price, max_price in storage.fetch_trend(
+                *period, request.args.get('productName') or None):
+            days.append({
+                'day': day,
+                'count': count,
+                'sumPrice': round(sum_price, 2),
+                'avgPrice': round(sum_price / count, 2),
+                'minPrice': round(min_price, 2),
+                'maxPrice': round(max_price, 2)
+            })
+        
+        return jsonify({
+            'startDate': period[0],
+            'endDate': period[1],
+            'days': days,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': f'Ошибка получения динамики: {str(e)}'
+        }), 500
+
+def start_background_tasks():
+    """
+    Запускает фоновые потоки процесса: обновление курсов, отложенную запись
+    истории и сторожа заданий пересчета
+    """
+    if os.environ.get('RATES_BACKGROUND_REFRESH', '1') == '1':
+        start_rate_refresher()
+    if os.environ.get('HISTORY_WRITE_BEHIND', '1') == '1':
+        history_writer.start()
+    # Брошенные пересчеты (воркер остановлен посреди задания) продолжаются
+    repricing.start_watchdog(lambda: (update_exchange_rates(), update_bio_exchange_rates()))
+
+def warm_up():
+    """
+    Готовит общее состояние до fork воркеров (режим preload):
+    схема базы, последний снимок курсов в кэшах и действующие параметры формулы.
+    Воркеры наследуют его копированием при записи и не повторяют эту работу
+    """
+    _follow_shared_rates()
+    tariff_store.current()
+    storage.close_connection()
+    print("🔥 Приложение подготовлено в мастер-процессе")
+
+# Фоновые задачи запускаются вместе с приложением (в том числе под gunicorn).
+# В режиме preload (GUNICORN_PRELOAD=1, см. gunicorn.conf.py) приложение
+# импортируется в мастер-процессе: потоки не переживают fork, поэтому
+# их запускает каждый воркер в post_fork, а мастер только готовит состояние
+PRELOAD = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+if PRELOAD:
+    warm_up()
+else:
+    start_background_tasks()
+
 if __name__ == '__main__':
     print("🚀 Запуск сервера калькулятора стоимости товара...")
     print("📊 Доступные API endpoints:")
-    print("   - GET  /api/exchange-rates - получение курсов валют МИГ.кз (автообновление)")
-    print("   - GET  /api/bio-exchange-rates - получение курсов валют BIO в тенге (автообновление)")
+    print("   - GET  /healthz - проверка работоспособности (база, свежесть курсов)")
+    print("   - GET  /metrics - метрики Prometheus (этапы расчета, источники курсов, запись истории)")
+    print("   - GET  /api/exchange-rates - получение курсов валют МИГ.кз (фоновое обновление)")
+    print("   - GET  /api/bio-exchange-rates - получение курсов валют BIO в тенге (фоновое обновление)")
     print("   - GET  /api/formula-params - получение параметров формулы")
     print("   - POST /api/calculate-price - расчет стоимости товара (с сохранением в БД)")
-    print("   - GET  /api/calculation-history - история расчетов")
+    print("   - GET  /api/quote-cache - статистика кэша расчетов")
+    print("   - POST /api/calculate-prices - пакетный расчет (JSON или файл CSV/XLSX)")
+    print("   - POST /api/reprice-jobs - пересчет сохраненных расчетов по новым тарифам/курсам")
+    print("   - GET  /api/reprice-jobs/<id> - ход пересчета, /report - отчет старая/новая цена (CSV)")
+    print("   - GET  /api/rate-history - снимок курсов по id или на момент времени (?id= / ?at=)")
+    print("   - GET  /api/calculation-history - история расчетов (?limit=&before=)")
+    print("   - GET  /api/calculation-history/search - поиск по наименованию (?q=&startDate=&endDate=&minPrice=&maxPrice=)")
+    print("   - GET  /api/calculation-history/<id> - сохраненный расчет со всеми шагами")
     print("   - POST /api/download-report - скачивание отчета в Excel")
+    print("   - GET  /api/reports/summary - итоги по товарам за период (?startDate=&endDate=)")
+    print("   - GET  /api/reports/trend - динамика по дням (?startDate=&endDate=&productName=)")
     print("   - POST /api/update-formula-params - обновление параметров формулы")
     print("🌐 Веб-интерфейс доступен по адресу: http://localhost:5000")
     print("💾 Все расчеты автоматически сохраняются в SQLite3 базу данных")
     print("📊 Отчеты в Excel доступны по выбранному диапазону дат")
     
-    # Обновляем курсы валют при запуске сервера
-    print("💱 Обновление курсов валют при запуске...")
-    update_exchange_rates()
-    
+    if PRELOAD:
+        start_background_tasks()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,101 @@
+"""
+Отдача статических файлов интерфейса (index.html)
+Файл читается и сжимается (gzip, brotli - если установлен) один раз,
+ответ выбирается по Accept-Encoding без сжатия на каждый запрос.
+ETag строится по хэшу содержимого, поэтому повторный запрос браузера
+с If-None-Match получает 304 без тела. Если файл изменился на диске
+(проверка по os.stat), он перечитывается при следующем запросе.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Сколько секунд браузер может не перепроверять страницу (потом - запрос с If-None-Match)
+STATIC_CACHE_MAX_AGE = int(os.environ.get('STATIC_CACHE_MAX_AGE', 3600))
+
+# Сжатие выгодно только для файлов не меньше этого размера (байт)
+MIN_COMPRESS_SIZE = 1024
+
+
+class StaticAsset:
+    """
+    Статический файл с заранее сжатыми вариантами
+    response(request) - ответ Flask с нужной кодировкой или 304
+    """
+
+    def __init__(self, path, mimetype, max_age=STATIC_CACHE_MAX_AGE):
+        self.path = path
+        self.mimetype = mimetype
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # (ключ файла, {кодировка: (тело, ETag)})
+        self._cached = (None, {})
+
+    def load(self):
+        """Варианты файла (перечитывается только при изменении файла)"""
+        st = os.stat(self.path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cached_key, variants = self._cached
+        if cached_key == key:
+            return variants
+
+        with self._lock:
+            cached_key, variants = self._cached
+            if cached_key == key:
+                return variants
+            with open(self.path, 'rb') as f:
+                body = f.read()
+            variants = build_variants(body)
+            self._cached = (key, variants)
+            print(f"📦 {os.path.basename(self.path)}: {len(body)} байт, "
+                  + ', '.join(f"{name} {len(variant[0])}" for name, variant in variants.items() if name != 'identity'))
+            return variants
+
+    def response(self, request):
+        variants = self.load()
+        encoding = choose_encoding(request.accept_encodings, variants)
+        body, etag = variants[encoding]
+
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': f'public, max-age={self.max_age}',
+            'Vary': 'Accept-Encoding'
+        }
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+
+        response = Response(body, mimetype=self.mimetype, headers=headers)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def build_variants(body):
+    """{кодировка: (тело, ETag)}; у каждого варианта свой ETag (разные байты ответа)"""
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    variants = {'identity': (body, digest)}
+    if len(body) < MIN_COMPRESS_SIZE:
+        return variants
+
+    # mtime=0 - одинаковое содержимое всегда сжимается в одинаковые байты
+    variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'{digest}-gzip')
+    if brotli is not None:
+        variants['br'] = (brotli.compress(body, quality=11), f'{digest}-br')
+    return variants
+
+
+def choose_encoding(accept_encodings, variants):
+    """Лучшая кодировка из Accept-Encoding клиента, которая есть среди вариантов"""
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
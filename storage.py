@@ -0,0 +1,993 @@
+"""
+Хранение истории расчетов в SQLite3
+Одно соединение на поток (переиспользуется между запросами), режим WAL,
+схема создается и обновляется миграциями один раз при первом подключении
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+
+DB_PATH = os.environ.get('CALCULATIONS_DB_PATH', '/var/data/calculations.db')
+# Сколько миллисекунд ждать снятия блокировки записи другим воркером
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+
+# Пересчет дневных агрегатов по сырым расчетам; {where} - фильтр по дате
+# (пустой в миграции, диапазон дней в rebuild_daily_rollups)
+_ROLLUP_BACKFILL_TEMPLATE = '''
+    INSERT INTO calculation_daily (
+        day, product_name, count, sum_price, min_price, max_price,
+        last_price, last_at, last_id
+    )
+    SELECT day, product_name, count, sum_price, min_price, max_price,
+           last_price, last_at, last_id
+    FROM (
+        SELECT DATE(calculation_date) AS day,
+               product_name,
+               COUNT(*) OVER w AS count,
+               SUM(final_price) OVER w AS sum_price,
+               MIN(final_price) OVER w AS min_price,
+               MAX(final_price) OVER w AS max_price,
+               final_price AS last_price,
+               calculation_date AS last_at,
+               id AS last_id,
+               ROW_NUMBER() OVER (
+                   PARTITION BY DATE(calculation_date), product_name
+                   ORDER BY calculation_date DESC, id DESC
+               ) AS position
+        FROM calculations
+        {where}
+        WINDOW w AS (PARTITION BY DATE(calculation_date), product_name)
+    )
+    WHERE position = 1
+'''
+
+ROLLUP_BACKFILL_SQL = _ROLLUP_BACKFILL_TEMPLATE.format(
+    where='WHERE calculation_date >= ? AND calculation_date < ?'
+)
+
+# Миграции схемы: номер версии = индекс + 1 (PRAGMA user_version)
+# Каждая миграция - список SQL выражений
+MIGRATIONS = [
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS calculations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_name TEXT NOT NULL,
+            final_price REAL NOT NULL,
+            calculation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    [
+        # История и отчеты по дате: индекс включает rowid (id),
+        # поэтому ORDER BY calculation_date, id идет по индексу без сортировки
+        'CREATE INDEX IF NOT EXISTS idx_calculations_date ON calculations (calculation_date)',
+    ],
+    [
+        # Дневные агрегаты по товарам для отчетов: O(дней) вместо O(строк)
+        '''
+        CREATE TABLE IF NOT EXISTS calculation_daily (
+            day TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            sum_price REAL NOT NULL,
+            min_price REAL NOT NULL,
+            max_price REAL NOT NULL,
+            last_price REAL NOT NULL,
+            last_at TIMESTAMP NOT NULL,
+            last_id INTEGER NOT NULL,
+            PRIMARY KEY (day, product_name)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_calculation_daily_product ON calculation_daily (product_name, day)',
+        # Агрегаты обновляются в той же транзакции, что и вставка расчета
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_calculations_daily
+        AFTER INSERT ON calculations
+        BEGIN
+            INSERT INTO calculation_daily (
+                day, product_name, count, sum_price, min_price, max_price,
+                last_price, last_at, last_id
+            )
+            VALUES (
+                DATE(NEW.calculation_date), NEW.product_name, 1, NEW.final_price,
+                NEW.final_price, NEW.final_price, NEW.final_price, NEW.calculation_date, NEW.id
+            )
+            ON CONFLICT (day, product_name) DO UPDATE SET
+                count = count + 1,
+                sum_price = sum_price + excluded.sum_price,
+                min_price = MIN(min_price, excluded.min_price),
+                max_price = MAX(max_price, excluded.max_price),
+                last_price = CASE WHEN (excluded.last_at, excluded.last_id) >= (last_at, last_id)
+                                  THEN excluded.last_price ELSE last_price END,
+                last_id = CASE WHEN (excluded.last_at, excluded.last_id) >= (last_at, last_id)
+                               THEN excluded.last_id ELSE last_id END,
+                last_at = MAX(last_at, excluded.last_at);
+        END
+        ''',
+        # Заполняем агрегаты по уже накопленной истории
+        'DELETE FROM calculation_daily',
+        _ROLLUP_BACKFILL_TEMPLATE.format(where=''),
+    ],
+    [
+        # История снимков курсов: каждый опубликованный снимок (Halyk RUB/KZT,
+        # BIO EUR/USD) дописывается сюда, расчет ссылается на свой снимок
+        '''
+        CREATE TABLE IF NOT EXISTS rate_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            version INTEGER NOT NULL,
+            fetched_at REAL NOT NULL,
+            rates TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_rate_history_fetched ON rate_history (fetched_at)',
+        'ALTER TABLE calculations ADD COLUMN rate_snapshot_id INTEGER REFERENCES rate_history (id)',
+    ],
+    [
+        # Исходные данные расчета, чтобы его можно было пересчитать по новым
+        # тарифам или курсам (у старых расчетов - NULL)
+        'ALTER TABLE calculations ADD COLUMN original_price REAL',
+        'ALTER TABLE calculations ADD COLUMN currency TEXT',
+        'ALTER TABLE calculations ADD COLUMN weight_kg REAL',
+        'ALTER TABLE calculations ADD COLUMN length_mm REAL',
+        'ALTER TABLE calculations ADD COLUMN width_mm REAL',
+        'ALTER TABLE calculations ADD COLUMN height_mm REAL',
+        # Задания пересчета и их результаты (старая и новая цена)
+        '''
+        CREATE TABLE IF NOT EXISTS reprice_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL,
+            params TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            changed INTEGER NOT NULL DEFAULT 0,
+            old_total REAL NOT NULL DEFAULT 0,
+            new_total REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reprice_results (
+            job_id INTEGER NOT NULL REFERENCES reprice_jobs (id),
+            calculation_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            calculation_date TIMESTAMP,
+            old_price REAL NOT NULL,
+            new_price REAL NOT NULL,
+            PRIMARY KEY (job_id, calculation_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    [
+        # Наборы параметров формулы хранятся один раз (по хэшу), расчет
+        # ссылается на свой набор целым id вместо копии JSON в каждой строке
+        '''
+        CREATE TABLE IF NOT EXISTS tariff_params (
+            id INTEGER PRIMARY KEY,
+            hash TEXT NOT NULL UNIQUE,
+            params TEXT NOT NULL
+        )
+        ''',
+        'ALTER TABLE calculations ADD COLUMN tariff_params_id INTEGER REFERENCES tariff_params (id)',
+        # Промежуточные результаты расчета. Для REAL колонок SQLite хранит
+        # целые значения как целые (1-6 байт), поэтому строки остаются компактными
+        'ALTER TABLE calculations ADD COLUMN volume_m3 REAL',
+        'ALTER TABLE calculations ADD COLUMN delivery_weight_kg REAL',
+        'ALTER TABLE calculations ADD COLUMN delivery_cost REAL',
+        'ALTER TABLE calculations ADD COLUMN exchange_rate REAL',
+        'ALTER TABLE calculations ADD COLUMN converted_price REAL',
+        'ALTER TABLE calculations ADD COLUMN price_with_delivery REAL',
+    ],
+    [
+        # Опубликованные версии параметров формулы (последняя - действующая)
+        '''
+        CREATE TABLE IF NOT EXISTS formula_params (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            params TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    [
+        # Полнотекстовый индекс наименований (FTS5 с внешним содержимым:
+        # текст не дублируется, хранится только индекс). prefix - отдельные
+        # индексы префиксов из 2 и 3 символов для автодополнения
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS calculations_fts USING fts5 (
+            product_name,
+            content='calculations',
+            content_rowid='id',
+            prefix='2 3'
+        )
+        ''',
+        # Индекс обновляется триггерами в той же транзакции, что и расчеты
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_calculations_fts_insert
+        AFTER INSERT ON calculations
+        BEGIN
+            INSERT INTO calculations_fts (rowid, product_name)
+            VALUES (NEW.id, NEW.product_name);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_calculations_fts_delete
+        AFTER DELETE ON calculations
+        BEGIN
+            INSERT INTO calculations_fts (calculations_fts, rowid, product_name)
+            VALUES ('delete', OLD.id, OLD.product_name);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_calculations_fts_update
+        AFTER UPDATE OF product_name ON calculations
+        BEGIN
+            INSERT INTO calculations_fts (calculations_fts, rowid, product_name)
+            VALUES ('delete', OLD.id, OLD.product_name);
+            INSERT INTO calculations_fts (rowid, product_name)
+            VALUES (NEW.id, NEW.product_name);
+        END
+        ''',
+        # Индексируем уже накопленную историю
+        "INSERT INTO calculations_fts (calculations_fts) VALUES ('rebuild')",
+    ],
+    [
+        # Продолжение пересчета после гибели воркера: последний обработанный
+        # id расчета и время последней отметки задания (секунды Unix)
+        'ALTER TABLE reprice_jobs ADD COLUMN last_id INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE reprice_jobs ADD COLUMN heartbeat_at REAL',
+    ],
+]
+
+# Запросы общие для всех эндпоинтов: одинаковый текст запроса позволяет
+# sqlite3 переиспользовать подготовленные выражения из кэша соединения
+# Колонки строки истории в порядке значений в save_calculations()
+CALCULATION_COLUMNS = (
+    'product_name', 'final_price', 'rate_snapshot_id',
+    'original_price', 'currency', 'weight_kg', 'length_mm', 'width_mm', 'height_mm',
+    'tariff_params_id', 'volume_m3', 'delivery_weight_kg', 'delivery_cost',
+    'exchange_rate', 'converted_price', 'price_with_delivery'
+)
+
+# Позиция id набора параметров формулы в строке истории
+TARIFF_PARAMS_COLUMN = CALCULATION_COLUMNS.index('tariff_params_id')
+
+INSERT_CALCULATION_SQL = f'''
+    INSERT INTO calculations ({', '.join(CALCULATION_COLUMNS)})
+    VALUES ({', '.join('?' * len(CALCULATION_COLUMNS))})
+'''
+
+SELECT_HISTORY_SQL = '''
+    SELECT id, product_name, final_price, calculation_date, rate_snapshot_id
+    FROM calculations
+    ORDER BY calculation_date DESC, id DESC
+    LIMIT ?
+'''
+
+# Следующая страница истории (keyset): строки строго раньше курсора (дата, id)
+SELECT_HISTORY_BEFORE_SQL = '''
+    SELECT id, product_name, final_price, calculation_date, rate_snapshot_id
+    FROM calculations
+    WHERE (calculation_date, id) < (?, ?)
+    ORDER BY calculation_date DESC, id DESC
+    LIMIT ?
+'''
+
+# Диапазон дат без функций над колонкой, чтобы работал индекс:
+# calculation_date >= начало И calculation_date < день после конца
+SELECT_REPORT_SQL = '''
+    SELECT product_name, final_price, calculation_date
+    FROM calculations
+    WHERE calculation_date >= ? AND calculation_date < ?
+    ORDER BY calculation_date DESC, id DESC
+'''
+
+# Размер отчета и самое длинное наименование (для ширины колонки XLSX)
+SELECT_REPORT_STATS_SQL = '''
+    SELECT COUNT(*), MAX(LENGTH(product_name))
+    FROM calculations
+    WHERE calculation_date >= ? AND calculation_date < ?
+'''
+
+DELETE_ROLLUPS_SQL = '''
+    DELETE FROM calculation_daily
+    WHERE day >= ? AND day < ?
+'''
+
+# Итоги по товарам за период из дневных агрегатов;
+# последняя цена - из дня с самым поздним расчетом
+SELECT_SUMMARY_SQL = '''
+    SELECT product_name,
+           SUM(count),
+           SUM(sum_price),
+           MIN(min_price),
+           MAX(max_price),
+           (SELECT d.last_price FROM calculation_daily AS d
+            WHERE d.product_name = daily.product_name AND d.day >= ? AND d.day < ?
+            ORDER BY d.last_at DESC, d.last_id DESC
+            LIMIT 1)
+    FROM calculation_daily AS daily
+    WHERE day >= ? AND day < ?
+    GROUP BY product_name
+    ORDER BY SUM(count) DESC, product_name
+'''
+
+# Динамика по дням за период (все товары или один товар)
+SELECT_TREND_SQL = '''
+    SELECT day, SUM(count), SUM(sum_price), MIN(min_price), MAX(max_price)
+    FROM calculation_daily
+    WHERE day >= ? AND day < ?
+    GROUP BY day
+    ORDER BY day
+'''
+
+SELECT_PRODUCT_TREND_SQL = '''
+    SELECT day, count, sum_price, min_price, max_price
+    FROM calculation_daily
+    WHERE product_name = ? AND day >= ? AND day < ?
+    ORDER BY day
+'''
+
+# Поиск по наименованию: совпадения FTS5 перебираются от новых к старым
+# (ORDER BY rowid DESC выполняет сам FTS5), фильтры проверяются по строке
+# расчета, LIMIT останавливает перебор - без сортировки всех совпадений.
+# Диапазон id [от, до) сужает перебор до периода и курсора страницы
+SEARCH_CALCULATIONS_SQL = '''
+    SELECT c.id, c.product_name, c.final_price, c.calculation_date, c.rate_snapshot_id
+    FROM calculations_fts AS f
+    JOIN calculations AS c ON c.id = f.rowid
+    WHERE calculations_fts MATCH ?
+      AND f.rowid >= ? AND f.rowid < ?
+      AND c.calculation_date >= ? AND c.calculation_date < ?
+      AND c.final_price >= ? AND c.final_price <= ?
+    ORDER BY f.rowid DESC
+    LIMIT ?
+'''
+
+# Первый и последний расчет периода по индексу дат (границы id для поиска)
+SELECT_FIRST_ID_FROM_SQL = '''
+    SELECT id FROM calculations
+    WHERE calculation_date >= ?
+    ORDER BY calculation_date, id
+    LIMIT 1
+'''
+
+SELECT_LAST_ID_BEFORE_SQL = '''
+    SELECT id FROM calculations
+    WHERE calculation_date < ?
+    ORDER BY calculation_date DESC, id DESC
+    LIMIT 1
+'''
+
+INSERT_RATE_SNAPSHOT_SQL = '''
+    INSERT INTO rate_history (version, fetched_at, rates)
+    VALUES (?, ?, ?)
+'''
+
+SELECT_RATE_SNAPSHOT_SQL = '''
+    SELECT id, version, fetched_at, rates
+    FROM rate_history
+    WHERE id = ?
+'''
+
+# Снимок, действовавший на момент времени: последний полученный не позже него
+SELECT_RATE_SNAPSHOT_AT_SQL = '''
+    SELECT id, version, fetched_at, rates
+    FROM rate_history
+    WHERE fetched_at <= ?
+    ORDER BY fetched_at DESC, id DESC
+    LIMIT 1
+'''
+
+# Исходные данные расчетов для пересчета (keyset по id, только расчеты
+# с сохраненными исходными данными)
+SELECT_CALCULATION_INPUTS_SQL = '''
+    SELECT id, product_name, final_price, calculation_date, rate_snapshot_id,
+           original_price, currency, weight_kg, length_mm, width_mm, height_mm
+    FROM calculations
+    WHERE id > ? AND calculation_date >= ? AND calculation_date < ?
+      AND original_price IS NOT NULL
+    ORDER BY id
+    LIMIT ?
+'''
+
+COUNT_CALCULATION_INPUTS_SQL = '''
+    SELECT COUNT(*)
+    FROM calculations
+    WHERE calculation_date >= ? AND calculation_date < ?
+      AND original_price IS NOT NULL
+'''
+
+INSERT_REPRICE_JOB_SQL = '''
+    INSERT INTO reprice_jobs (status, params, heartbeat_at)
+    VALUES ('queued', ?, ?)
+'''
+
+SELECT_REPRICE_JOB_SQL = '''
+    SELECT id, status, params, total, processed, changed, old_total, new_total,
+           error, created_at, finished_at, last_id, heartbeat_at
+    FROM reprice_jobs
+    WHERE id = ?
+'''
+
+# Незавершенные задания, отметка которых устарела (воркер остановлен)
+SELECT_STALE_REPRICE_JOBS_SQL = '''
+    SELECT id FROM reprice_jobs
+    WHERE status IN ('queued', 'running') AND COALESCE(heartbeat_at, 0) < ?
+    ORDER BY id
+'''
+
+# Захват задания: условие повторяется, поэтому задание достается одному воркеру
+CLAIM_REPRICE_JOB_SQL = '''
+    UPDATE reprice_jobs SET heartbeat_at = ?
+    WHERE id = ? AND status IN ('queued', 'running') AND COALESCE(heartbeat_at, 0) < ?
+'''
+
+INSERT_REPRICE_RESULT_SQL = '''
+    INSERT OR REPLACE INTO reprice_results (
+        job_id, calculation_id, product_name, calculation_date, old_price, new_price
+    )
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+SELECT_REPRICE_RESULTS_SQL = '''
+    SELECT calculation_id, product_name, calculation_date, old_price, new_price
+    FROM reprice_results
+    WHERE job_id = ?
+    ORDER BY calculation_id
+'''
+
+# Поля задания пересчета, которые обновляются по ходу работы
+REPRICE_JOB_FIELDS = ('status', 'total', 'processed', 'changed', 'old_total', 'new_total', 'error',
+                      'last_id', 'heartbeat_at')
+
+SELECT_CALCULATION_SQL = f'''
+    SELECT id, calculation_date, {', '.join(CALCULATION_COLUMNS)}
+    FROM calculations
+    WHERE id = ?
+'''
+
+INSERT_TARIFF_PARAMS_SQL = '''
+    INSERT OR IGNORE INTO tariff_params (hash, params)
+    VALUES (?, ?)
+'''
+
+SELECT_TARIFF_PARAMS_ID_SQL = '''
+    SELECT id FROM tariff_params WHERE hash = ?
+'''
+
+SELECT_TARIFF_PARAMS_SQL = '''
+    SELECT params FROM tariff_params WHERE id = ?
+'''
+
+INSERT_FORMULA_PARAMS_SQL = '''
+    INSERT INTO formula_params (params)
+    VALUES (?)
+'''
+
+SELECT_LATEST_FORMULA_PARAMS_SQL = '''
+    SELECT version, params, created_at
+    FROM formula_params
+    ORDER BY version DESC
+    LIMIT 1
+'''
+
+# Разделы снимка курсов, которые сохраняются в историю
+RATE_SNAPSHOT_SECTIONS = ('rates', 'bio_rates', 'bio_rates_tenge')
+
+_local = threading.local()
+# Наборы параметров формулы, уже сохраненные в tariff_params: ключ плана → id
+_tariff_params_ids = {}
+# Неизменяемые строки по id: снимки курсов и наборы параметров формулы.
+# Кэшируются только найденные строки - id, которого еще нет, может
+# появиться позже (его записывает другой воркер)
+_rate_snapshots = {}
+_tariff_params_json = {}
+RATE_SNAPSHOT_CACHE_SIZE = 1024
+TARIFF_PARAMS_CACHE_SIZE = 256
+_migrate_lock = threading.Lock()
+_migrated_path = None
+
+
+def get_connection():
+    """
+    Соединение текущего потока (создается при первом обращении)
+    После fork дочерний процесс открывает свое соединение
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+
+    directory = os.path.dirname(DB_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None, cached_statements=64)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    _migrate(conn)
+
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def close_connection():
+    """
+    Закрывает соединение текущего потока
+    Вызывается в мастер-процессе gunicorn перед fork: открытое соединение
+    SQLite нельзя передавать в дочерний процесс. Схема при этом остается
+    отмеченной как проверенная, воркеры не повторяют миграции
+    """
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+
+
+def _migrate(conn):
+    """Применяет недостающие миграции (один раз на процесс)"""
+    global _migrated_path
+    if _migrated_path == DB_PATH:
+        return
+
+    with _migrate_lock:
+        if _migrated_path == DB_PATH:
+            return
+
+        # BEGIN IMMEDIATE сериализует миграции между воркерами
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version={number}')
+                print(f"💾 Схема базы расчетов обновлена до версии {number}")
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+        _migrated_path = DB_PATH
+
+
+@contextmanager
+def transaction(immediate=False):
+    """
+    Транзакция на соединении текущего потока
+    with transaction() as conn: ... - COMMIT при успехе, ROLLBACK при ошибке
+    immediate - блокировка записи сразу (BEGIN IMMEDIATE): чтение и запись
+    внутри транзакции не пересекаются с записью других воркеров
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def ping():
+    """Проверка доступности базы (легкий запрос без чтения таблиц)"""
+    get_connection().execute('SELECT 1').fetchone()
+
+
+def save_calculations(rows):
+    """
+    Сохраняет расчеты одной транзакцией
+    rows - список кортежей значений в порядке CALCULATION_COLUMNS
+    (наименование, финальная цена, id снимка курсов, исходные данные товара,
+    id набора параметров формулы, промежуточные результаты)
+    Вместо id набора параметров можно передать TariffPlan: новый набор
+    сохраняется в tariff_params в той же транзакции
+    """
+    if not rows:
+        return
+    saved_ids = {}
+    with transaction() as conn:
+        conn.executemany(INSERT_CALCULATION_SQL, [_with_tariff_params_id(conn, row, saved_ids) for row in rows])
+    # id запоминаются только после COMMIT (при откате их нет в базе)
+    _tariff_params_ids.update(saved_ids)
+
+
+def _with_tariff_params_id(conn, row, saved_ids):
+    """Строка с id набора параметров вместо TariffPlan (набор сохраняется при необходимости)"""
+    plan = row[TARIFF_PARAMS_COLUMN]
+    if plan is None or isinstance(plan, int):
+        return row
+    params_id = _tariff_params_ids.get(plan.key)
+    if params_id is None:
+        params_id = saved_ids.get(plan.key)
+    if params_id is None:
+        params_id = saved_ids[plan.key] = _save_tariff_params(conn, plan)
+    return row[:TARIFF_PARAMS_COLUMN] + (params_id,) + row[TARIFF_PARAMS_COLUMN + 1:]
+
+
+def fetch_history(limit=50, before=None):
+    """
+    Страница истории расчетов: список (id, наименование, цена, дата, id снимка курсов)
+    before - курсор (дата, id) последней строки предыдущей страницы
+    """
+    if before is None:
+        return get_connection().execute(SELECT_HISTORY_SQL, (limit,)).fetchall()
+    return get_connection().execute(SELECT_HISTORY_BEFORE_SQL, (before[0], before[1], limit)).fetchall()
+
+
+def search_query(text):
+    """
+    Запрос FTS5 из введенного текста: каждое слово - префикс ("проб 5" →
+    "проб"* "5"*), все слова обязательны. Синтаксис FTS5 (кавычки,
+    операторы) в тексте не действует. Без слов - None
+    """
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_calculations(text, limit=50, before=None, start_date=None, end_date=None,
+                        min_price=None, max_price=None):
+    """
+    Расчеты, наименование которых содержит слова (префиксы) из text,
+    от новых к старым: список (id, наименование, цена, дата, id снимка курсов)
+    before - id последней строки предыдущей страницы
+    start_date, end_date - даты YYYY-MM-DD включительно (ValueError при неверном формате),
+    min_price, max_price - границы финальной цены включительно
+
+    Дата расчета - время вставки (DEFAULT CURRENT_TIMESTAMP), поэтому id
+    растут вместе с датой и период переводится в диапазон id. Узкий фильтр
+    по цене при частом слове перебирает все совпадения этого слова
+    """
+    query = search_query(text)
+    if query is None:
+        return []
+    start, end = report_range(start_date or date.min.isoformat(), end_date or '9999-12-30')
+
+    conn = get_connection()
+    first_id, end_id = 0, 2 ** 63 - 1
+    if start_date:
+        row = conn.execute(SELECT_FIRST_ID_FROM_SQL, (start,)).fetchone()
+        if row is None:
+            return []
+        first_id = row[0]
+    if end_date:
+        row = conn.execute(SELECT_LAST_ID_BEFORE_SQL, (end,)).fetchone()
+        if row is None:
+            return []
+        end_id = row[0] + 1
+    if before is not None:
+        end_id = min(end_id, before)
+
+    return conn.execute(SEARCH_CALCULATIONS_SQL, (
+        query,
+        first_id, end_id,
+        start, end,
+        min_price if min_price is not None else float('-inf'),
+        max_price if max_price is not None else float('inf'),
+        limit,
+    )).fetchall()
+
+
+def report_range(start_date, end_date):
+    """
+    Границы полуинтервала [начало, день после конца) для отчета
+    start_date, end_date - строки YYYY-MM-DD, при неверном формате - ValueError
+    """
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date) + timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+
+def fetch_report_rows(start_date, end_date):
+    """Расчеты за период (даты в формате YYYY-MM-DD включительно)"""
+    return get_connection().execute(SELECT_REPORT_SQL, report_range(start_date, end_date)).fetchall()
+
+
+def iter_report_rows(start_date, end_date, chunk_size=1000):
+    """
+    Расчеты за период частями по chunk_size строк (курсор читается
+    постепенно, весь период в память не загружается)
+    """
+    # Отдельное соединение: курсор живет, пока отдается ответ
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    try:
+        cursor = conn.execute(SELECT_REPORT_SQL, report_range(start_date, end_date))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def fetch_report_stats(start_date, end_date):
+    """(число строк, длина самого длинного наименования) за период"""
+    count, max_name_length = get_connection().execute(
+        SELECT_REPORT_STATS_SQL, report_range(start_date, end_date)
+    ).fetchone()
+    return count, max_name_length or 0
+
+
+def fetch_summary(start_date, end_date):
+    """
+    Итоги по товарам за период из дневных агрегатов:
+    список (наименование, количество, сумма, мин, макс, последняя цена)
+    """
+    start, end = report_range(start_date, end_date)
+    return get_connection().execute(SELECT_SUMMARY_SQL, (start, end, start, end)).fetchall()
+
+
+def fetch_trend(start_date, end_date, product_name=None):
+    """
+    Динамика по дням за период: список (день, количество, сумма, мин, макс)
+    product_name - только один товар (иначе все товары вместе)
+    """
+    start, end = report_range(start_date, end_date)
+    if product_name is None:
+        return get_connection().execute(SELECT_TREND_SQL, (start, end)).fetchall()
+    return get_connection().execute(SELECT_PRODUCT_TREND_SQL, (product_name, start, end)).fetchall()
+
+
+def rebuild_daily_rollups(start_date=None, end_date=None):
+    """
+    Пересчитывает дневные агрегаты по сырым расчетам (сверка/восстановление)
+    start_date, end_date - период YYYY-MM-DD, без них - вся история
+    Возвращает число строк агрегатов (день × товар) в пересчитанном периоде
+    """
+    with transaction() as conn:
+        if start_date is None or end_date is None:
+            conn.execute('DELETE FROM calculation_daily')
+            conn.execute(_ROLLUP_BACKFILL_TEMPLATE.format(where=''))
+            return conn.execute('SELECT COUNT(*) FROM calculation_daily').fetchone()[0]
+
+        start, end = report_range(start_date, end_date)
+        conn.execute(DELETE_ROLLUPS_SQL, (start, end))
+        conn.execute(ROLLUP_BACKFILL_SQL, (start, end))
+        return conn.execute(
+            'SELECT COUNT(*) FROM calculation_daily WHERE day >= ? AND day < ?', (start, end)
+        ).fetchone()[0]
+
+
+def save_rate_snapshot(snapshot):
+    """
+    Дописывает снимок курсов (rate_store) в историю, возвращает id записи
+    """
+    rates = json.dumps({name: snapshot.get(name, {}) for name in RATE_SNAPSHOT_SECTIONS})
+    with transaction() as conn:
+        cursor = conn.execute(INSERT_RATE_SNAPSHOT_SQL, (snapshot['version'], snapshot['fetched_at'], rates))
+        return cursor.lastrowid
+
+
+def _rate_snapshot(row):
+    if row is None:
+        return None
+    snapshot_id, version, fetched_at, rates = row
+    snapshot = {'id': snapshot_id, 'version': version, 'fetched_at': fetched_at}
+    snapshot.update(json.loads(rates))
+    return snapshot
+
+
+def _remember(cache, key, value, max_size):
+    """Кладет значение в кэш, при переполнении вытесняет самое старое"""
+    if len(cache) >= max_size:
+        cache.pop(next(iter(cache), None), None)
+    cache[key] = value
+
+
+def fetch_rate_snapshot(snapshot_id):
+    """
+    Снимок курсов по id: словарь id, version, fetched_at, rates, bio_rates,
+    bio_rates_tenge или None. Снимки не изменяются, поэтому найденные
+    кэшируются (возвращаемый словарь изменять нельзя)
+    """
+    snapshot = _rate_snapshots.get(snapshot_id)
+    if snapshot is None:
+        snapshot = _rate_snapshot(get_connection().execute(SELECT_RATE_SNAPSHOT_SQL, (snapshot_id,)).fetchone())
+        if snapshot is not None:
+            _remember(_rate_snapshots, snapshot_id, snapshot, RATE_SNAPSHOT_CACHE_SIZE)
+    return snapshot
+
+
+def rate_snapshot_at(timestamp):
+    """
+    Снимок курсов, действовавший на момент timestamp (секунды Unix):
+    последний полученный не позже этого момента, или None
+    """
+    return _rate_snapshot(get_connection().execute(SELECT_RATE_SNAPSHOT_AT_SQL, (timestamp,)).fetchone())
+
+
+# Границы "всей истории" для пересчета без периода
+_ALL_TIME = ('0001-01-01', '9999-12-31')
+
+
+def count_calculation_inputs(start_date=None, end_date=None):
+    """Сколько расчетов за период можно пересчитать (есть исходные данные)"""
+    bounds = report_range(start_date, end_date) if start_date and end_date else _ALL_TIME
+    return get_connection().execute(COUNT_CALCULATION_INPUTS_SQL, bounds).fetchone()[0]
+
+
+def iter_calculation_inputs(start_date=None, end_date=None, chunk_size=1000, after_id=0):
+    """
+    Расчеты с исходными данными за период частями по chunk_size строк:
+    (id, наименование, цена, дата, id снимка курсов, цена товара, валюта,
+    вес, длина, ширина, высота). Без периода - вся история
+    after_id - начать после этого id (продолжение пересчета)
+    """
+    bounds = report_range(start_date, end_date) if start_date and end_date else _ALL_TIME
+    last_id = after_id
+    while True:
+        rows = get_connection().execute(
+            SELECT_CALCULATION_INPUTS_SQL, (last_id, bounds[0], bounds[1], chunk_size)
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def create_reprice_job(params):
+    """Создает задание пересчета (статус queued), возвращает его id"""
+    with transaction() as conn:
+        return conn.execute(
+            INSERT_REPRICE_JOB_SQL, (json.dumps(params, ensure_ascii=False), time.time())
+        ).lastrowid
+
+
+def update_reprice_job(job_id, finished=False, **fields):
+    """Обновляет поля задания (см. REPRICE_JOB_FIELDS), finished - отметить время завершения"""
+    with transaction() as conn:
+        _update_reprice_job(conn, job_id, fields, finished)
+
+
+def _update_reprice_job(conn, job_id, fields, finished=False):
+    unknown = set(fields) - set(REPRICE_JOB_FIELDS)
+    if unknown:
+        raise KeyError(f"Неизвестные поля задания пересчета: {', '.join(sorted(unknown))}")
+    assignments = [f'{name} = ?' for name in fields]
+    if finished:
+        assignments.append('finished_at = CURRENT_TIMESTAMP')
+    if assignments:
+        conn.execute(
+            f"UPDATE reprice_jobs SET {', '.join(assignments)} WHERE id = ?",
+            (*fields.values(), job_id)
+        )
+
+
+def fetch_reprice_job(job_id):
+    """Задание пересчета: словарь полей (params - разобранный JSON) или None"""
+    row = get_connection().execute(SELECT_REPRICE_JOB_SQL, (job_id,)).fetchone()
+    if row is None:
+        return None
+    names = ('id', 'status', 'params', 'total', 'processed', 'changed', 'old_total', 'new_total',
+             'error', 'created_at', 'finished_at', 'last_id', 'heartbeat_at')
+    job = dict(zip(names, row))
+    job['params'] = json.loads(job['params'])
+    return job
+
+
+def claim_stale_reprice_jobs(stale_before):
+    """
+    Захватывает незавершенные задания с отметкой раньше stale_before
+    (секунды Unix): их отметка обновляется, другой воркер их уже не возьмет
+    Возвращает список id захваченных заданий
+    """
+    claimed = []
+    with transaction(immediate=True) as conn:
+        for (job_id,) in conn.execute(SELECT_STALE_REPRICE_JOBS_SQL, (stale_before,)).fetchall():
+            if conn.execute(CLAIM_REPRICE_JOB_SQL, (time.time(), job_id, stale_before)).rowcount:
+                claimed.append(job_id)
+    return claimed
+
+
+def save_reprice_results(job_id, rows, **progress):
+    """
+    Сохраняет результаты части пересчета и прогресс задания одной транзакцией
+    rows - список (id расчета, наименование, дата, старая цена, новая цена)
+    """
+    with transaction() as conn:
+        conn.executemany(INSERT_REPRICE_RESULT_SQL, [(job_id, *row) for row in rows])
+        _update_reprice_job(conn, job_id, progress)
+
+
+def iter_reprice_results(job_id, chunk_size=1000):
+    """Результаты пересчета частями: (id расчета, наименование, дата, старая цена, новая цена)"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    try:
+        cursor = conn.execute(SELECT_REPRICE_RESULTS_SQL, (job_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def fetch_calculation(calculation_id):
+    """
+    Расчет со всеми сохраненными колонками: словарь id, calculation_date
+    и CALCULATION_COLUMNS (у старых расчетов часть значений None) или None
+    """
+    row = get_connection().execute(SELECT_CALCULATION_SQL, (calculation_id,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('id', 'calculation_date') + CALCULATION_COLUMNS, row))
+
+
+def tariff_params_id(plan):
+    """
+    id набора параметров формулы TariffPlan в tariff_params
+    Набор сохраняется при первом обращении, дальше id берется из памяти процесса
+    """
+    params_id = _tariff_params_ids.get(plan.key)
+    if params_id is not None:
+        return params_id
+
+    with transaction() as conn:
+        params_id = _save_tariff_params(conn, plan)
+
+    _tariff_params_ids[plan.key] = params_id
+    return params_id
+
+
+def _save_tariff_params(conn, plan):
+    """Сохраняет набор параметров плана (если его еще нет), возвращает id"""
+    params = json.dumps(dict(plan.key), sort_keys=True, separators=(',', ':'))
+    params_hash = hashlib.sha256(params.encode('utf-8')).hexdigest()
+    conn.execute(INSERT_TARIFF_PARAMS_SQL, (params_hash, params))
+    return conn.execute(SELECT_TARIFF_PARAMS_ID_SQL, (params_hash,)).fetchone()[0]
+
+
+def _fetch_tariff_params_json(params_id):
+    params = _tariff_params_json.get(params_id)
+    if params is None:
+        row = get_connection().execute(SELECT_TARIFF_PARAMS_SQL, (params_id,)).fetchone()
+        if row is None:
+            return None
+        params = row[0]
+        _remember(_tariff_params_json, params_id, params, TARIFF_PARAMS_CACHE_SIZE)
+    return params
+
+
+def fetch_tariff_params(params_id):
+    """Параметры формулы по id из tariff_params (словарь) или None"""
+    params = _fetch_tariff_params_json(params_id)
+    return json.loads(params) if params is not None else None
+
+
+def update_formula_params(update):
+    """
+    Новая версия параметров формулы на основе последней: update(последние
+    параметры или None) возвращает новые параметры. Чтение и запись идут
+    одной транзакцией BEGIN IMMEDIATE, поэтому одновременные публикации
+    из разных воркеров выполняются по очереди и не теряют друг друга
+    Исключение из update отменяет публикацию. Возвращает (версия, параметры)
+    """
+    with transaction(immediate=True) as conn:
+        row = conn.execute(SELECT_LATEST_FORMULA_PARAMS_SQL).fetchone()
+        params = update(json.loads(row[1]) if row else None)
+        version = conn.execute(INSERT_FORMULA_PARAMS_SQL, (json.dumps(params, sort_keys=True),)).lastrowid
+    return version, params
+
+
+def fetch_latest_formula_params():
+    """Действующая версия параметров формулы: (версия, параметры, дата) или None"""
+    row = get_connection().execute(SELECT_LATEST_FORMULA_PARAMS_SQL).fetchone()
+    if row is None:
+        return None
+    version, params, created_at = row
+    return version, json.loads(params), created_at
@@ -0,0 +1,152 @@
+"""
+Тарифный план доставки БИО и коэффициенты формулы цены
+План строится один раз из параметров формулы: все инварианты тарифа
+(складские услуги, базовые суммы на 270 кг, стоимость свыше 1000 кг)
+посчитаны заранее в виде кусочно-линейных отрезков
+"""
+import math
+from bisect import bisect_left
+from functools import lru_cache
+
+
+# Параметры формулы по умолчанию
+DEFAULT_FORMULA_PARAMS = {
+    'divider': 1.22,
+    'multiplier': 1.16,
+    'nds': 1.16,
+    'delivery30': 37700,      # Доставка до 30 кг: 9000 + 12000 + (26*450) + 5000
+    'base30': 9000,           # Базовая ставка (фиксированная)
+    'rate30': 215,            # Тариф город+город за кг свыше 30
+    'pickup30': 12000,        # Забор со склада БИО
+    'pickupRate30': 27,       # Тариф забора за кг свыше 30
+    'warehouseCount': 26,     # Количество единиц для складских услуг
+    'warehouseRate': 450,     # Тариф за единицу складских услуг
+    'deliveryCity30': 5000,   # Доставка по Астане
+    'cityRate30': 19,         # Тариф доставки по Астане за кг свыше 30
+    'rate300': 164,           # Тариф город+город 300-1000 кг
+    'rate1000': 143,          # Тариф город+город свыше 1000 кг
+    'volumetricFactor': 200   # Коэффициент объемного веса (логисты БИО)
+}
+
+# Тарифы за кг свыше 300 кг, зашитые в оригинальный скрипт
+PICKUP_RATE_300 = 15          # Забор склад БИО
+CITY_RATE_300 = 2             # Доставка по Астане
+
+# Границы весовых категорий (кг), каждая граница включается в свою категорию
+TIER_BREAKPOINTS = (30, 300, 1000)
+
+# Параметры, которые должны быть строго положительными
+_POSITIVE_PARAMS = ('divider', 'multiplier', 'nds')
+
+
+class TariffPlan:
+    """
+    Неизменяемый тарифный план
+    Стоимость доставки в каждой категории: intercept + (вес - origin) * slope
+    Планы с одинаковыми параметрами равны и имеют одинаковый хэш,
+    поэтому план можно использовать как ключ кэша
+    """
+
+    __slots__ = ('params', 'key', 'divider', 'multiplier', 'nds', 'volumetric_factor',
+                 'breakpoints', 'origins', 'intercepts', 'slopes', '_hash')
+
+    def __init__(self, params):
+        """
+        params - полный набор параметров формулы (см. DEFAULT_FORMULA_PARAMS)
+        При неверных значениях выбрасывает ValueError
+        """
+        values = {}
+        for name in DEFAULT_FORMULA_PARAMS:
+            value = params.get(name)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"Неверное значение параметра формулы {name}: {value!r}")
+            if value < 0 or (name in _POSITIVE_PARAMS and value == 0):
+                raise ValueError(f"Параметр формулы {name} должен быть положительным: {value!r}")
+            values[name] = value
+
+        set_ = object.__setattr__
+        set_(self, 'params', values)
+        set_(self, 'key', tuple(sorted(values.items())))
+        set_(self, 'divider', values['divider'])
+        set_(self, 'multiplier', values['multiplier'])
+        set_(self, 'nds', values['nds'])
+        set_(self, 'volumetric_factor', values['volumetricFactor'])
+
+        warehouse_total = values['warehouseCount'] * values['warehouseRate']
+
+        # 30-300 кг: город+город, забор склад БИО и доставка по Астане
+        intercept_30 = values['base30'] + values['pickup30'] + warehouse_total + values['deliveryCity30']
+        slope_30 = values['rate30'] + values['pickupRate30'] + values['cityRate30']
+
+        # 300-1000 кг: три компонента, база на 270 кг (300 - 30)
+        intercept_300 = (
+            (values['base30'] + 270 * values['rate30']) +
+            (values['pickup30'] + 270 * values['pickupRate30'] + warehouse_total) +
+            (values['deliveryCity30'] + 270 * values['cityRate30'] + warehouse_total)
+        )
+        slope_300 = values['rate300'] + PICKUP_RATE_300 + CITY_RATE_300
+
+        # Свыше 1000 кг - стоимость как для 1000 кг (постоянная)
+        cost_1000 = intercept_300 + 700 * slope_300
+
+        set_(self, 'breakpoints', TIER_BREAKPOINTS)
+        set_(self, 'origins', (30, 30, 300, 1000))
+        set_(self, 'intercepts', (values['delivery30'], intercept_30, intercept_300, cost_1000))
+        set_(self, 'slopes', (0, slope_30, slope_300, 0))
+        set_(self, '_hash', hash(self.key))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TariffPlan неизменяемый")
+
+    def __eq__(self, other):
+        return isinstance(other, TariffPlan) and self.key == other.key
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"TariffPlan({self.params!r})"
+
+    def delivery_weight(self, weight_kg, volume_m3):
+        """Вес для доставки: больший из фактического и объемного"""
+        return max(weight_kg, volume_m3 * self.volumetric_factor)
+
+    def cost_for_weight(self, delivery_weight):
+        """Стоимость доставки для веса: поиск категории и одно умножение-сложение"""
+        tier = bisect_left(self.breakpoints, delivery_weight)
+        return self.intercepts[tier] + (delivery_weight - self.origins[tier]) * self.slopes[tier]
+
+    def delivery_cost(self, weight_kg, volume_m3):
+        return self.cost_for_weight(self.delivery_weight(weight_kg, volume_m3))
+
+    def price(self, original_price, rate, delivery_cost):
+        """
+        Формула (X/divider * курс * multiplier + доставка) * nds
+        Возвращает (цена после конвертации, цена с доставкой, финальная цена)
+        """
+        converted_price = original_price / self.divider * rate * self.multiplier
+        price_with_delivery = converted_price + delivery_cost
+        return converted_price, price_with_delivery, price_with_delivery * self.nds
+
+
+def get_tariff_plan(params=None, base=None):
+    """
+    Тарифный план для параметров формулы (недостающие берутся из base,
+    по умолчанию DEFAULT_FORMULA_PARAMS). Планы кэшируются, повторный вызов
+    с теми же параметрами не пересчитывает тариф. При неверных значениях - ValueError
+    """
+    if params is not None and not isinstance(params, dict):
+        raise ValueError('Параметры формулы должны быть объектом')
+    merged = dict(base or DEFAULT_FORMULA_PARAMS)
+    if params:
+        merged.update((name, value) for name, value in params.items() if name in DEFAULT_FORMULA_PARAMS)
+    try:
+        return _cached_plan(tuple(sorted(merged.items())))
+    except TypeError:
+        # Нехэшируемое значение параметра (список, словарь)
+        return TariffPlan(merged)
+
+
+@lru_cache(maxsize=256)
+def _cached_plan(items):
+    return TariffPlan(dict(items))
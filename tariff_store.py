@@ -0,0 +1,131 @@
+"""
+Версионированные параметры формулы, общие для всех воркеров
+Каждая публикация сохраняется в базе расчетов новой версией и сразу
+проверяется сборкой TariffPlan. Воркеры узнают о новой версии по файлу
+версии рядом с базой: на каждый запрос - только os.stat(), а база
+читается и план собирается лишь когда файл изменился
+"""
+import os
+import tempfile
+import threading
+
+import metrics
+import storage
+from tariff import get_tariff_plan
+
+
+FORMULA_VERSION_PATH = os.environ.get('FORMULA_VERSION_PATH', storage.DB_PATH + '.formula-version')
+
+# Ключ файла версии до первой проверки (отличается от None - "файла нет")
+_UNCHECKED = object()
+
+
+class TariffStore:
+    """
+    Действующий тарифный план и номер его версии
+    current() - (версия, TariffPlan), версия 0 - параметры по умолчанию
+    publish() - проверяет и публикует новую версию параметров
+    """
+
+    def __init__(self, version_path=FORMULA_VERSION_PATH):
+        self.version_path = version_path
+        self._lock = threading.Lock()
+        # (ключ файла версии, версия, план) - заменяется целиком
+        self._cached = (_UNCHECKED, 0, get_tariff_plan())
+
+    def current(self):
+        key = self._file_key()
+        cached_key, version, plan = self._cached
+        if key == cached_key:
+            return version, plan
+
+        with self._lock:
+            cached_key, version, plan = self._cached
+            if key == cached_key:
+                return version, plan
+            with metrics.stage('formula_params_reload'):
+                version, plan = self._load_latest()
+            self._cached = (key, version, plan)
+            return version, plan
+
+    def publish(self, params):
+        """
+        Новая версия параметров: params дополняются действующими значениями,
+        при неверных значениях - ValueError (ничего не сохраняется)
+        Возвращает (версия, TariffPlan)
+        """
+        with self._lock:
+            # База - последняя версия из базы (ее мог опубликовать другой воркер),
+            # чтение и запись новой версии - одна транзакция
+            version, merged = storage.update_formula_params(
+                lambda latest: get_tariff_plan(params, base=latest).params
+            )
+            plan = get_tariff_plan(merged)
+            self._write_version(version)
+            # Файл версии пишется уже после фиксации транзакции, и другой воркер
+            # мог успеть опубликовать более новую версию: ключ файла нельзя
+            # связывать с нашей версией, следующий current() перечитает базу
+            self._cached = (_UNCHECKED, version, plan)
+        print(f"🧮 Параметры формулы опубликованы (версия {version})")
+        return version, plan
+
+    def _load_latest(self):
+        latest = storage.fetch_latest_formula_params()
+        if latest is None:
+            return 0, get_tariff_plan()
+        version, params, _ = latest
+        return version, get_tariff_plan(params)
+
+    def _file_key(self):
+        try:
+            st = os.stat(self.version_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _write_version(self, version):
+        """Атомарно заменяет файл версии (меняется inode - воркеры видят изменение)"""
+        directory = os.path.dirname(self.version_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.formula-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(str(version))
+            os.replace(tmp_path, self.version_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+_store = TariffStore()
+
+
+def current():
+    """(версия, TariffPlan) действующих параметров формулы"""
+    return _store.current()
+
+
+def current_plan():
+    return _store.current()[1]
+
+
+def publish(params):
+    """Публикует новую версию параметров формулы, возвращает (версия, TariffPlan)"""
+    return _store.publish(params)
+
+
+def plan_for(formula_params=None):
+    """
+    Тарифный план для параметров из запроса: недостающие значения берутся
+    из действующей версии, без параметров - действующий план
+    Параметры не объектом - ValueError
+    """
+    if formula_params is not None and not isinstance(formula_params, dict):
+        raise ValueError('Параметры формулы должны быть объектом')
+    plan = current_plan()
+    if not formula_params:
+        return plan
+    return get_tariff_plan(formula_params, base=plan.params)
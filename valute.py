@@ -1,22 +1,28 @@
-import requests
-import importlib
+import json
+import os
 
-import info
-import bio_rates_tenge
+import rate_store
+from rate_fetchers import HttpFetcher
 
+# Адрес API курсов Halyk Bank (можно переопределить, например для тестового стенда)
+HALYK_RATES_URL = os.environ.get('HALYK_RATES_URL', "https://back.halykbank.kz/common/currency-history")
+# Таймауты запроса к Halyk Bank: (подключение, чтение) в секундах
+HALYK_TIMEOUT = (5, 10)
 
-def valute():
-    URL = "https://back.halykbank.kz/common/currency-history"
-    headers = {
+halyk_fetcher = HttpFetcher(
+    'halyk',
+    HALYK_RATES_URL,
+    headers={
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
         "Accept": "application/json",
         "Referer": "https://halykbank.kz/exchange-rates"
-    }
+    },
+    timeout=HALYK_TIMEOUT
+)
 
-    response = requests.get(URL, headers=headers)
-    response.raise_for_status()
 
-    data = response.json()
+def valute():
+    data = json.loads(halyk_fetcher.fetch())
     
     if not data.get("result") or not data.get("data"):
         raise ValueError("Неверный формат ответа от API.")
@@ -35,11 +41,9 @@ def valute():
     latest_data = currency_history[latest_key]
     legal_persons = latest_data.get("legalPersons", {})
     
-    # Сохраняем существующие курсы из info.py (если есть USD и EUR)
-    try:
-        existing_rates = info.exchange_rates.copy()
-    except:
-        existing_rates = {}
+    # Текущий снимок курсов (остальные валюты сохраняем)
+    snapshot = rate_store.load()
+    existing_rates = dict(snapshot['rates'])
     
     # Парсим только RUB - курс продажи для бизнеса
     rub_data = legal_persons.get("RUB/KZT")
@@ -57,30 +61,20 @@ def valute():
     exchange_rates_nb = existing_rates.copy()
     exchange_rates_nb["RUB"] = rate_value
     
-    # Добавляем курсы USD и EUR из bio_rates_tenge.py
-    try:
-        importlib.reload(bio_rates_tenge)
-        if hasattr(bio_rates_tenge, 'bio_rates_tenge'):
-            bio_rates = bio_rates_tenge.bio_rates_tenge
-            if 'USD' in bio_rates:
-                exchange_rates_nb["USD"] = bio_rates["USD"]
-            if 'EUR' in bio_rates:
-                exchange_rates_nb["EUR"] = bio_rates["EUR"]
-    except Exception as e:
-        print(f"Предупреждение: не удалось загрузить курсы из bio_rates_tenge.py: {e}")
+    # Добавляем курсы USD и EUR из курсов BIO в тенге
+    bio_rates = snapshot.get('bio_rates_tenge', {})
+    if 'USD' in bio_rates:
+        exchange_rates_nb["USD"] = bio_rates["USD"]
+    if 'EUR' in bio_rates:
+        exchange_rates_nb["EUR"] = bio_rates["EUR"]
 
     print(exchange_rates_nb)
 
-    # Записываем в info.py
-    with open("info.py", "w", encoding="utf-8") as file:
-        file.write(f"exchange_rates = {exchange_rates_nb}\n")
-
-    # Перезагружаем модуль info для получения обновленных курсов
-    importlib.reload(info)
+    # Публикуем новый снимок в хранилище курсов
+    snapshot = rate_store.publish(rates=exchange_rates_nb)
     
-    print("Курсы валют сохранены в info.py (RUB из Halyk Bank, USD/EUR из bio_rates_tenge.py)")
-    exchange_rates = info.exchange_rates
-    return exchange_rates
+    print(f"Курсы валют сохранены (версия {snapshot['version']}): RUB из Halyk Bank, USD/EUR из курсов BIO")
+    return snapshot['rates']
 
 
 if __name__ == "__main__":
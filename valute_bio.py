@@ -1,69 +1,137 @@
-import requests
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+import os
 import re
 
+import rate_store
+from rate_fetchers import HttpFetcher
+
+# Адрес портала BIO с курсами (можно переопределить, например для тестового стенда)
+BIO_PORTAL_URL = os.environ.get('BIO_PORTAL_URL', "https://portal.holdingbio.ru/")
+# Таймауты запроса к порталу BIO: (подключение, чтение) в секундах
+BIO_TIMEOUT = (5, 10)
+
+bio_fetcher = HttpFetcher(
+    'bio',
+    BIO_PORTAL_URL,
+    headers={
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+    },
+    timeout=BIO_TIMEOUT
+)
+
+# Все нужные фрагменты текста страницы за один проход:
+# валюта (с необязательным префиксом "YE") или курс вида "95,10 P"
+_RATE_TOKENS = re.compile(r'(?P<ye>YE\s*)?(?P<currency>EUR|USD)|(?P<rate>\d+,\d+)\s*P', re.IGNORECASE)
+
+# Содержимое этих тегов не является текстом страницы
+_SKIP_TAGS = ('script', 'style', 'template')
+
+
+class _PageText(HTMLParser):
+    """Текст HTML страницы без тегов, скриптов, стилей и комментариев"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def page_text(html):
+    """
+    Текст страницы (как BeautifulSoup(...).get_text(), но без построения дерева)
+    html - строка или итерируемый набор частей (например, потоковый ответ)
+    """
+    parser = _PageText()
+    for chunk in ([html] if isinstance(html, str) else html):
+        parser.feed(chunk)
+    parser.close()
+    return ''.join(parser.parts)
+
+
+def find_bio_rates(text):
+    """
+    Курсы EUR/USD к рублю из текста страницы BIO за один проход регулярного выражения
+    Для каждой валюты по порядку приоритета берется:
+    1. первый курс после первого "YE <валюта>"
+    2. первый курс после первого упоминания валюты
+    3. первый курс, за которым где-то дальше упоминается валюта
+    """
+    tokens = []
+    for match in _RATE_TOKENS.finditer(text):
+        if match.group('rate'):
+            tokens.append((None, float(match.group('rate').replace(',', '.')), False))
+        else:
+            tokens.append((match.group('currency').upper(), None, bool(match.group('ye'))))
+    
+    # Ближайший курс после каждого фрагмента (обратный проход)
+    next_rate = [None] * len(tokens)
+    following = None
+    for index in range(len(tokens) - 1, -1, -1):
+        next_rate[index] = following
+        if tokens[index][0] is None:
+            following = tokens[index][1]
+    
+    bio_rates = {}
+    for currency in ('EUR', 'USD'):
+        positions = [index for index, token in enumerate(tokens) if token[0] == currency]
+        if not positions:
+            continue
+        
+        prefixed = [index for index in positions if tokens[index][2]]
+        if prefixed and next_rate[prefixed[0]] is not None:
+            rate = next_rate[prefixed[0]]
+        elif next_rate[positions[0]] is not None:
+            rate = next_rate[positions[0]]
+        else:
+            rate = next((token[1] for token in tokens[:positions[-1]] if token[0] is None), None)
+        
+        if rate is not None:
+            bio_rates[currency] = rate
+            print(f"Найден курс {currency}: {rate}")
+    
+    return bio_rates
+
+
+def parse_bio_rates(html):
+    """
+    Курсы BIO из HTML страницы портала (строка или части потокового ответа)
+    Если курсы не найдены - ValueError
+    """
+    bio_rates = find_bio_rates(page_text(html))
+    if not bio_rates:
+        raise ValueError("Курсы BIO не найдены на странице")
+    
+    print(f"Итоговые курсы BIO: {bio_rates}")
+    return bio_rates
+
+
+def fetch_bio_rates():
+    """
+    Парсит курсы валют с сайта BIO (EUR/USD к рублю)
+    В отличие от valute_bio() не подставляет значения по умолчанию,
+    а выбрасывает исключение при ошибке сети или если курсы не найдены
+    """
+    return parse_bio_rates(bio_fetcher.fetch())
+
 def valute_bio():
     """
     Парсит курсы валют с сайта BIO (EUR/USD к рублю)
     Возвращает курсы BIO для конвертации в рубли
     """
-    URL = "https://portal.holdingbio.ru/"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-    
     try:
-        response = requests.get(URL, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, "html.parser")
-        
-        # Ищем курсы валют на странице
-        bio_rates = {}
-        
-        # Поиск по различным паттернам
-        patterns = [
-            r'YE\s*EUR.*?(\d+,\d+)\s*P',
-            r'EUR.*?(\d+,\d+)\s*P',
-            r'(\d+,\d+)\s*P.*?EUR'
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, soup.get_text(), re.IGNORECASE | re.DOTALL)
-            if matches:
-                try:
-                    rate_str = matches[0].replace(',', '.')
-                    bio_rates['EUR'] = float(rate_str)
-                    print(f"Найден курс EUR: {bio_rates['EUR']}")
-                    break
-                except ValueError:
-                    continue
-        
-        # Поиск USD курса
-        usd_patterns = [
-            r'YE\s*USD.*?(\d+,\d+)\s*P',
-            r'USD.*?(\d+,\d+)\s*P',
-            r'(\d+,\d+)\s*P.*?USD'
-        ]
-        
-        for pattern in usd_patterns:
-            matches = re.findall(pattern, soup.get_text(), re.IGNORECASE | re.DOTALL)
-            if matches:
-                try:
-                    rate_str = matches[0].replace(',', '.')
-                    bio_rates['USD'] = float(rate_str)
-                    print(f"Найден курс USD: {bio_rates['USD']}")
-                    break
-                except ValueError:
-                    continue
-        
-        # Если не нашли, используем значения по умолчанию
-        if not bio_rates:
-            print("⚠️ Курсы BIO не найдены на странице, используем значения по умолчанию")
-            bio_rates = {'EUR': 109.0, 'USD': 93.0}
-        
-        print(f"Итоговые курсы BIO: {bio_rates}")
-        return bio_rates
+        return fetch_bio_rates()
         
     except Exception as e:
         print(f"❌ Ошибка при парсинге курсов BIO: {e}")
@@ -88,48 +156,47 @@ def convert_bio_rates_to_tenge(bio_rates, rub_to_tenge_rate):
 
 def get_bio_rates():
     """
-    Получает курсы BIO и сохраняет их в файл
+    Получает курсы BIO и сохраняет их в хранилище курсов
     """
     rates = valute_bio()
     
-    # Сохраняем курсы BIO в отдельный файл
-    with open("bio_rates.py", "w", encoding="utf-8") as file:
-        file.write(f"bio_rates = {rates}\n")
+    # Сохраняем курсы BIO в хранилище курсов
+    rate_store.publish(bio_rates=rates)
     
-    print("Курсы BIO сохранены в bio_rates.py")
+    print("Курсы BIO сохранены в хранилище курсов")
     return rates
 
+def save_bio_rates_in_tenge(bio_rates, rub_to_tenge):
+    """
+    Конвертирует курсы BIO в тенге и сохраняет их в хранилище курсов
+    """
+    bio_rates_tenge = convert_bio_rates_to_tenge(bio_rates, rub_to_tenge)
+    
+    snapshot = rate_store.publish(bio_rates=bio_rates, bio_rates_tenge=bio_rates_tenge)
+    
+    print(f"Курсы BIO в тенге сохранены (версия {snapshot['version']})")
+    return snapshot['bio_rates_tenge']
+
 def get_bio_rates_in_tenge():
     """
     Получает курсы BIO и конвертирует их в тенге
     Требует курс рубля к тенге из МИГ.кз
     """
     try:
-        # Получаем курсы BIO (в рублях)
-        bio_rates = valute_bio()
-        
-        # Получаем курс рубля к тенге из МИГ.кз
         import valute
-        import info
-        import importlib
         
-        # Обновляем курсы МИГ.кз
-        valute.valute()
-        importlib.reload(info)
-        
-        # Получаем курс рубля к тенге
-        rub_to_tenge = info.exchange_rates.get('RUB', 1.0)
-        print(f"Курс рубля к тенге (МИГ.кз): {rub_to_tenge}")
+        # Обе страницы загружаются параллельно, разбор - по очереди
+        bio_fetcher.prefetch()
+        valute.halyk_fetcher.prefetch()
         
-        # Конвертируем курсы BIO в тенге
-        bio_rates_tenge = convert_bio_rates_to_tenge(bio_rates, rub_to_tenge)
+        # Получаем курсы BIO (в рублях)
+        bio_rates = valute_bio()
         
-        # Сохраняем конвертированные курсы
-        with open("bio_rates_tenge.py", "w", encoding="utf-8") as file:
-            file.write(f"bio_rates_tenge = {bio_rates_tenge}\n")
+        # Обновляем курсы МИГ.кз и получаем курс рубля к тенге
+        rub_to_tenge = valute.valute().get('RUB', 1.0)
+        print(f"Курс рубля к тенге (МИГ.кз): {rub_to_tenge}")
         
-        print("Курсы BIO в тенге сохранены в bio_rates_tenge.py")
-        return bio_rates_tenge
+        return save_bio_rates_in_tenge(bio_rates, rub_to_tenge)
         
     except Exception as e:
         print(f"❌ Ошибка конвертации BIO курсов: {e}")